@@ -0,0 +1,41 @@
+import pytest
+
+from benchmarks.synthetic import make_catalogues, write_synthetic_catalogue
+
+DEFAULT_SIZES = '10000,50000,200000'
+CHUNK_SIZES = (100, 500)
+
+
+def pytest_addoption(parser):
+    parser.addoption('--catalogue-sizes', action='store', default=DEFAULT_SIZES,
+                     help=f'comma separated list of synthetic catalogue sizes to benchmark (default {DEFAULT_SIZES})')
+
+
+def pytest_generate_tests(metafunc):
+    if 'catalogue_size' in metafunc.fixturenames:
+        sizes = [int(s) for s in metafunc.config.getoption('catalogue_sizes').split(',') if s.strip()]
+        metafunc.parametrize('catalogue_size', sizes, ids=[f'{s // 1000}k' if s >= 1000 else str(s) for s in sizes],
+                             scope='session')
+
+
+@pytest.fixture(scope='session')
+def catalogue_json(tmp_path_factory, catalogue_size):
+    """
+    A synthetic database.json of catalogue_size entries, generated once per session.
+    """
+    path = tmp_path_factory.mktemp(f'catalogue_{catalogue_size}') / 'database.json'
+    write_synthetic_catalogue(path, catalogue_size)
+    return path
+
+
+@pytest.fixture(scope='session')
+def loaded_catalogues(tmp_path_factory, catalogue_json, catalogue_size):
+    """
+    A Catalogues with the synthetic catalogue already ingested, shared by the read benchmarks.
+    """
+    path = tmp_path_factory.mktemp(f'loaded_{catalogue_size}')
+    cat = make_catalogues(path, CHUNK_SIZES)
+    (path / 'database.json').symlink_to(catalogue_json)
+    (path / 'version.txt').write_text('bench')
+    cat._Catalogues__catalogues = cat._Catalogues__load_catalogues()
+    return cat
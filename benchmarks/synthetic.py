@@ -0,0 +1,117 @@
+"""
+Synthetic catalogues, in the database.json format published by beqcatalogue, and a Catalogues factory shared by the
+tests, the benchmarks and the websocket harness.
+"""
+import json
+import random
+
+from ezbeq.catalogue import Catalogues
+from ezbeq.iir import HighShelf, LowShelf, PeakingEQ
+
+AUTHORS = ['aron7awol', 'mobe1969', 'halcyon888', 'kaelaria', 't1g8rsfan', 'Mobe1969', 'dgage', 'jbw']
+LANGUAGES = ['English', 'French', 'German', 'Japanese', 'Korean', 'Spanish']
+CODECS = [('DTS-HD MA', ['5.1', '7.1']), ('TrueHD', ['5.1', '7.1']), ('Atmos', ['7.1']), ('DTS-X', ['7.1']),
+          ('LPCM', ['2.0', '5.1']), ('AC3', ['2.0', '5.1'])]
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Drama', 'Horror', 'Science Fiction', 'Thriller', 'War']
+FILTER_TYPES = [('LowShelf', LowShelf), ('PeakingEQ', PeakingEQ), ('HighShelf', HighShelf)]
+WORDS = ['alien', 'dark', 'night', 'storm', 'king', 'return', 'edge', 'empire', 'star', 'fury', 'ghost', 'iron',
+         'last', 'lost', 'rising', 'shadow', 'steel', 'world', 'war', 'zero']
+
+
+def make_filters(rng: random.Random) -> list[dict]:
+    filters = []
+    for _ in range(rng.randint(2, 10)):
+        name, t = rng.choice(FILTER_TYPES)
+        freq = round(rng.uniform(10, 120), 1)
+        gain = round(rng.uniform(-6, 12), 1)
+        q = round(rng.choice([0.5, 0.707, 0.9, 1.0, 1.5]), 3)
+        bq = t(96000, freq, q, gain).format_biquads()
+        filters.append({
+            'type': name,
+            'freq': freq,
+            'gain': gain,
+            'q': q,
+            'biquads': {
+                '96000': {
+                    'b': [bq['b0'], bq['b1'], bq['b2']],
+                    'a': [bq['a1'], bq['a2']]
+                }
+            },
+            'count': 1
+        })
+    return filters
+
+
+def make_entry(rng: random.Random, idx: int) -> dict:
+    """
+    An entry in the same shape as database.json published by beqcatalogue.
+    """
+    title = ' '.join(rng.sample(WORDS, rng.randint(1, 4))).title()
+    codec, channels = rng.choice(CODECS)
+    channel = rng.choice(channels)
+    is_tv = rng.random() < 0.15
+    entry = {
+        'title': title,
+        'year': str(rng.randint(1960, 2025)),
+        'audioTypes': [f'{codec} {channel}'],
+        'audioCodecs': [codec],
+        'audioChannelCounts': [channel],
+        'content_type': 'TV' if is_tv else 'film',
+        'author': rng.choice(AUTHORS),
+        'catalogue_url': f'https://beqcatalogue.readthedocs.io/en/latest/synthetic/{idx}/',
+        'filters': make_filters(rng),
+        'images': [f'https://i.imgur.com/{idx:08d}.png'],
+        'warning': '',
+        'mv': f'{rng.choice([-3, 0, 0, 0, 3, 5]):+d}',
+        'avs': f'https://www.avsforum.com/threads/bass-eq-for-filtered-movies.2995212/post-{idx}',
+        'sortTitle': title.lower(),
+        'edition': rng.choice(['', '', '', 'Extended', "Director's Cut"]),
+        'note': '',
+        'language': rng.choice(LANGUAGES),
+        'source': rng.choice(['Disc', 'Streaming']),
+        'overview': ' '.join(rng.choices(WORDS, k=40)),
+        'theMovieDB': str(100000 + idx),
+        'rating': rng.choice(['G', 'PG', 'PG-13', 'R', 'NR']),
+        'runtime': str(rng.randint(80, 180)),
+        'genres': rng.sample(GENRES, rng.randint(1, 3)),
+        'altTitle': '',
+        'created_at': 1500000000 + idx * 600,
+        'updated_at': 1500000000 + idx * 600 + rng.randint(0, 10000000),
+        'digest': f'{idx:013x}'
+    }
+    if rng.random() < 0.2:
+        entry['collection'] = {'id': str(idx // 3), 'name': f'{title} Collection'}
+    if is_tv:
+        entry['season'] = str(rng.randint(1, 8))
+        entry['episode'] = ','.join(str(e) for e in range(1, rng.randint(2, 12)))
+    return entry
+
+
+def write_synthetic_catalogue(path, size: int, seed: int = 1):
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write('[')
+        for idx in range(size):
+            if idx:
+                f.write(',')
+            json.dump(make_entry(rng, idx), f)
+        f.write(']')
+
+
+def make_catalogues(path, chunk_sizes: tuple[int, int] = (100, 100), mmap_mb: int = 0) -> Catalogues:
+    """
+    Build a Catalogues instance without going through __init__, which requires a live WsServer, network access and a
+    running reactor, so the private SQL/threading methods can be exercised directly.
+    """
+    cat = Catalogues.__new__(Catalogues)
+    cat._Catalogues__db = str(path / 'ezbeq.db')
+    cat._Catalogues__catalogue_file = str(path / 'database.json')
+    cat._Catalogues__version_file = str(path / 'version.txt')
+    cat._Catalogues__mmap_mb = mmap_mb
+    cat._Catalogues__slow_query_millis = 0
+    cat._Catalogues__sample_rates = ()
+    cat._Catalogues__chunk_sizes = chunk_sizes
+    cat._Catalogues__catalogues = []
+    cat._Catalogues__prune_pool = None
+    cat._Catalogues__ensure_db()
+    return cat
@@ -0,0 +1,139 @@
+import gc
+import itertools
+import tracemalloc
+
+import pytest
+
+from benchmarks.conftest import CHUNK_SIZES
+from benchmarks.synthetic import make_catalogues
+from ezbeq.catalogue import FIELDS_STR, CatalogueEntry, db_ops
+
+SEARCHES = {
+    'all': {},
+    'author': {'authors': ['aron7awol']},
+    'year': {'years': [1999, 2010]},
+    'audio_type': {'audio_types': ['Atmos 7.1']},
+    'content_type': {'content_types': ['TV']},
+    'tmdb_id': {'tmdb_id': '100042'},
+    'text': {'text': 'shadow'},
+    'audio_codec': {'audio_codecs': ['TrueHD', 'DTS-X']},
+    'audio_channel_count': {'audio_channel_counts': ['7.1']},
+    'combined': {'authors': ['aron7awol', 'mobe1969'], 'content_types': ['film'], 'text': 'star'},
+}
+
+
+def search(cat, authors=None, years=None, audio_types=None, content_types=None, tmdb_id=None, text=None,
+           audio_codecs=None, audio_channel_counts=None, limit=None):
+    return cat.search(authors or [], years or [], audio_types or [], content_types or [], tmdb_id, text,
+                      audio_codecs or [], audio_channel_counts or [], [], limit)
+
+
+@pytest.mark.parametrize('sample_rates', [(), (48000, 96000)], ids=['as_published', 'precompute_48k'])
+def test_insert_catalogue(benchmark, tmp_path_factory, catalogue_json, catalogue_size, sample_rates):
+    def setup():
+        path = tmp_path_factory.mktemp('ingest')
+        (path / 'database.json').symlink_to(catalogue_json)
+        cat = make_catalogues(path, CHUNK_SIZES)
+        cat._Catalogues__sample_rates = sample_rates
+        return (cat, ), {}
+
+    catalogue = benchmark.pedantic(lambda cat: cat._Catalogues__insert_catalogue('bench'), setup=setup, rounds=3)
+    assert catalogue.count == catalogue_size
+    benchmark.extra_info['entries'] = catalogue_size
+    if benchmark.stats:
+        benchmark.extra_info['entries_per_second'] = round(catalogue_size / benchmark.stats.stats.mean)
+
+
+def test_insert_catalogue_memory(benchmark, tmp_path_factory, catalogue_json, catalogue_size):
+    """
+    Peak traced allocations during ingest, the time includes the tracemalloc overhead so is not comparable with
+    test_insert_catalogue.
+    """
+    def setup():
+        path = tmp_path_factory.mktemp('ingest_memory')
+        (path / 'database.json').symlink_to(catalogue_json)
+        return (make_catalogues(path, CHUNK_SIZES), ), {}
+
+    def ingest(cat):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            c = cat._Catalogues__insert_catalogue('bench')
+            return c, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    catalogue, peak = benchmark.pedantic(ingest, setup=setup, rounds=1)
+    assert catalogue.count == catalogue_size
+    benchmark.extra_info['peak_bytes'] = peak
+
+
+@pytest.mark.parametrize('count', [1000])
+def test_entries_from_rows(benchmark, loaded_catalogues, count):
+    """
+    Time to build entries from db rows and the memory and gc tracked objects retained per entry.
+    """
+    with db_ops(loaded_catalogues._Catalogues__db) as cur:
+        rows = cur.execute(f'SELECT {FIELDS_STR} FROM catalogue_entry LIMIT {count}').fetchall()
+
+    def build():
+        return [CatalogueEntry.from_row(r) for r in rows]
+
+    benchmark(build)
+    gc.collect()
+    objects = len(gc.get_objects())
+    tracemalloc.start()
+    try:
+        entries = build()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['bytes_per_entry'] = round(retained / len(entries))
+    benchmark.extra_info['objects_per_entry'] = round((len(gc.get_objects()) - objects) / len(entries), 2)
+    assert entries[0].filters
+
+
+def test_load_catalogues(benchmark, tmp_path_factory, loaded_catalogues, catalogue_size):
+    db = loaded_catalogues._Catalogues__db
+
+    def setup():
+        cat = make_catalogues(tmp_path_factory.mktemp('startup'), CHUNK_SIZES)
+        cat._Catalogues__db = db
+        return (cat, ), {}
+
+    catalogues = benchmark.pedantic(lambda cat: cat._Catalogues__load_catalogues(), setup=setup, rounds=10)
+    assert catalogues[-1].count == catalogue_size
+
+
+@pytest.mark.parametrize('search_type', SEARCHES.keys())
+def test_search(benchmark, loaded_catalogues, search_type):
+    results = benchmark(lambda: search(loaded_catalogues, **SEARCHES[search_type]))
+    benchmark.extra_info['results'] = len(results)
+    assert results
+
+
+def test_find_by_digest(benchmark, loaded_catalogues, catalogue_size):
+    digests = itertools.cycle([f'{i:013x}' for i in range(0, catalogue_size, max(1, catalogue_size // 97))])
+    entry = benchmark(lambda: loaded_catalogues.find_by_digest(next(digests)))
+    assert entry is not None
+
+
+@pytest.mark.parametrize('chunk_size', [100, 500, 2000])
+def test_stream_chunked_catalogue(benchmark, loaded_catalogues, catalogue_size, chunk_size):
+    """
+    Mirrors the sequence of chunks produced by __send_next_chunk when a client sends "load catalogue".
+    """
+    version = loaded_catalogues.latest.version
+    load_chunk = loaded_catalogues._Catalogues__load_chunk
+
+    def stream() -> tuple[int, int]:
+        chunks = 0
+        size = 0
+        for offset in range(0, catalogue_size, chunk_size):
+            size += len(load_chunk(version, chunk_size, offset))
+            chunks += 1
+        return chunks, size
+
+    chunks, size = benchmark.pedantic(stream, rounds=3)
+    benchmark.extra_info['chunks'] = chunks
+    benchmark.extra_info['bytes'] = size
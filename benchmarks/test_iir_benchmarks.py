@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+from ezbeq.iir import FILTER_TYPES, design_biquads, format_designed_biquads, make_biquad
+
+SAMPLE_RATES = [48000, 96000, 192000]
+
+
+@pytest.fixture(scope='module', params=[100, 10000], ids=lambda n: f'{n}_filters')
+def filters(request):
+    rng = random.Random(1)
+    return [
+        (rng.choice(list(FILTER_TYPES)), round(rng.uniform(10, 120), 1), rng.choice([0.5, 0.707, 0.9, 1.0]),
+         round(rng.uniform(-6, 12), 1))
+        for _ in range(request.param)
+    ]
+
+
+def test_scalar_design(benchmark, filters):
+    def design():
+        return [[tuple(make_biquad(t, fs, f, q, g).format_biquads().values()) for t, f, q, g in filters]
+                for fs in SAMPLE_RATES]
+
+    benchmark(design)
+
+
+def test_batch_design(benchmark, filters):
+    types, freqs, qs, gains = (list(x) for x in zip(*filters, strict=True))
+
+    def design():
+        return format_designed_biquads(*design_biquads(types, freqs, qs, gains, SAMPLE_RATES))
+
+    benchmark(design)
+
+
+def test_batch_design_unformatted(benchmark, filters):
+    types, freqs, qs, gains = (list(x) for x in zip(*filters, strict=True))
+    benchmark(lambda: design_biquads(types, freqs, qs, gains, SAMPLE_RATES))
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+from autobahn.websocket.compress import PerMessageDeflate, PerMessageDeflateOffer
+from autobahn.websocket.protocol import WebSocketProtocol
+from twisted.internet.testing import StringTransport
+
+from ezbeq.apis.ws import AutobahnWsServerFactory
+
+CLIENTS = 20
+STATE_SIZE = 50 * 1024
+
+
+def make_state_msg(size: int) -> str:
+    """
+    A DeviceState message padded out with slots until it is at least size chars long.
+    """
+    slots = []
+    state = {'name': 'master', 'type': 'minidsp', 'mute': False, 'masterVolume': -10.0, 'slots': slots}
+    while len(json.dumps(state)) < size:
+        idx = len(slots)
+        slots.append({
+            'id': str(idx),
+            'last': f'Some Film With A Long Title ({idx})',
+            'gains': [{'id': str(i), 'value': -1.5 * i} for i in range(8)],
+            'mutes': [{'id': str(i), 'value': bool(i % 2)} for i in range(8)],
+            'canActivate': True,
+        })
+    return json.dumps({'message': 'DeviceState', 'data': state}, ensure_ascii=False)
+
+
+class DiscardingTransport(StringTransport):
+
+    def write(self, data):
+        pass
+
+
+def open_client(factory: AutobahnWsServerFactory, compress: bool = False) -> WebSocketProtocol:
+    client = factory.buildProtocol(None)
+    client.makeConnection(DiscardingTransport())
+    client.state = WebSocketProtocol.STATE_OPEN
+    client.websocket_version = 13
+    client._perMessageCompress = None
+    if compress:
+        accept = factory.perMessageCompressionAccept([PerMessageDeflateOffer()])
+        client._perMessageCompress = PerMessageDeflate.create_from_offer_accept(True, accept)
+    return client
+
+
+@pytest.fixture
+def factory():
+    factory = AutobahnWsServerFactory()
+    for _ in range(CLIENTS):
+        factory.register(open_client(factory))
+    return factory
+
+
+def test_broadcast_state(benchmark, factory):
+    msg = make_state_msg(STATE_SIZE)
+    benchmark.extra_info['bytes'] = len(msg.encode('utf8'))
+    benchmark.extra_info['clients'] = CLIENTS
+    benchmark(factory.broadcast, msg)
+
+
+def test_broadcast_state_encoded_per_client(benchmark, factory):
+    """
+    The baseline which encodes and frames the message for each client.
+    """
+    msg = make_state_msg(STATE_SIZE)
+    clients = [open_client(factory) for _ in range(CLIENTS)]
+
+    def send():
+        for c in clients:
+            c.sendMessage(msg.encode('utf8'), isBinary=False)
+
+    benchmark(send)
+
+
+@pytest.mark.parametrize('mem_level', [1, 8])
+def test_broadcast_state_compressed(benchmark, mem_level):
+    factory = AutobahnWsServerFactory()
+    factory.enable_compression(1024, mem_level)
+    clients = [open_client(factory, compress=True) for _ in range(CLIENTS)]
+    for c in clients:
+        factory.register(c)
+    msg = make_state_msg(STATE_SIZE)
+
+    benchmark(factory.broadcast, msg)
+
+    app = sum(c.trafficStats.outgoingOctetsAppLevel for c in clients)
+    ws = sum(c.trafficStats.outgoingOctetsWebSocketLevel for c in clients)
+    benchmark.extra_info['ratio'] = round(ws / app, 3)
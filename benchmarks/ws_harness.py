@@ -0,0 +1,334 @@
+"""
+Load test for the websocket server. Starts ezbeq against the stub minidsp, connects N websocket clients and then, for
+the requested duration, loads the catalogue, streams levels and PATCHes the master volume while recording how long
+each message takes to arrive along with the server CPU and RSS.
+
+    $ python -m benchmarks.ws_harness --clients 20 --levels-clients 5 --duration 30
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import psutil
+import requests
+from autobahn.twisted.websocket import (
+    WebSocketClientFactory,
+    WebSocketClientProtocol,
+    connectWS,
+)
+from twisted.internet import reactor
+
+from benchmarks.synthetic import write_synthetic_catalogue
+from ezbeq.apis.ws import unpack_levels
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# the number of distinct master volumes, 0.01dB apart from -0.01 to -127.00, used to carry the PATCH sequence number
+VOLUME_STEPS = 12700
+
+
+def volume_for(seq: int) -> float:
+    """
+    :return: the master volume which carries this sequence number, consecutive sequences always differ so no state
+    broadcast is suppressed.
+    """
+    return -((seq % VOLUME_STEPS) + 1) / 100
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+class Recorder:
+    """
+    Collects the arrival of every message along with its latency, if known.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts: dict[str, int] = defaultdict(int)
+        self.bytes: dict[str, int] = defaultdict(int)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.catalogue_loads: list[float] = []
+        # PATCH sequence number -> when it was sent
+        self.patched: dict[int, float] = {}
+        # volume step -> the latest sequence number sent with that volume
+        self.__latest: dict[int, int] = {}
+
+    def patching(self, seq: int) -> float:
+        """
+        Records that the master volume carrying seq is about to be PATCHed.
+        :return: the volume to send.
+        """
+        volume = volume_for(seq)
+        with self.lock:
+            self.patched[seq] = time.time()
+            self.__latest[seq % VOLUME_STEPS] = seq
+        return volume
+
+    def sequence_of(self, volume: float | None) -> int | None:
+        """
+        :return: the latest sequence number sent with this volume, if any.
+        """
+        if volume is None:
+            return None
+        with self.lock:
+            return self.__latest.get(round(-volume * 100) - 1)
+
+    def received(self, kind: str, size: int, latency: float | None = None):
+        with self.lock:
+            self.counts[kind] += 1
+            self.bytes[kind] += size
+            if latency is not None:
+                self.latencies[kind].append(latency)
+
+    def state_received(self, kind: str, size: int, volume: float | None, last_seq: int) -> int:
+        """
+        Records a state message, its latency is only recorded the first time a client sees a given PATCH.
+        :param last_seq: the latest sequence number already seen by the client.
+        :return: the latest sequence number now seen by the client.
+        """
+        now = time.time()
+        seq = self.sequence_of(volume)
+        if seq is not None and seq > last_seq:
+            self.received(kind, size, now - self.patched[seq])
+            return seq
+        self.received(kind, size)
+        return last_seq
+
+
+class HarnessClient(WebSocketClientProtocol):
+
+    def onOpen(self):
+        f: HarnessClientFactory = self.factory
+        self.last_seq = -1
+        self.catalogue_entries = 0
+        self.catalogue_started = time.time()
+        if f.state_patch:
+            self.sendMessage(b'capabilities state-patch')
+        if f.levels:
+            self.sendMessage(f"subscribe levels master{' binary' if f.binary else ''}".encode())
+        elif f.catalogue_size:
+            self.sendMessage(b'load catalogue')
+
+    def onMessage(self, payload, isBinary):
+        f: HarnessClientFactory = self.factory
+        now = time.time()
+        if isBinary:
+            levels = unpack_levels(payload)
+            f.recorder.received('Levels', len(payload), now - levels['ts'])
+            return
+        msg = json.loads(payload)
+        kind = msg.get('message')
+        if kind == 'Levels':
+            f.recorder.received(kind, len(payload), now - msg['data']['ts'] if msg['data'] else None)
+        elif kind == 'DeviceState':
+            self.last_seq = f.recorder.state_received(kind, len(payload), msg['data'].get('masterVolume'),
+                                                      self.last_seq)
+        elif kind == 'DeviceStatePatch':
+            volume = next((op['value'] for op in msg['data']['patch'] if op['path'] == '/masterVolume'), None)
+            self.last_seq = f.recorder.state_received(kind, len(payload), volume, self.last_seq)
+        elif kind == 'CatalogueEntries':
+            f.recorder.received(kind, len(payload))
+            self.catalogue_entries += len(msg['data'])
+            if self.catalogue_entries >= f.catalogue_size:
+                with f.recorder.lock:
+                    f.recorder.catalogue_loads.append(now - self.catalogue_started)
+        else:
+            f.recorder.received(kind or 'Other', len(payload))
+
+
+class HarnessClientFactory(WebSocketClientFactory):
+    protocol = HarnessClient
+
+    def __init__(self, url: str, recorder: Recorder, levels: bool, binary: bool, state_patch: bool,
+                 catalogue_size: int):
+        super().__init__(url)
+        self.recorder = recorder
+        self.levels = levels
+        self.binary = binary
+        self.state_patch = state_patch
+        self.catalogue_size = catalogue_size
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_catalogue(path: str) -> tuple[http.server.ThreadingHTTPServer, int]:
+    port = free_port()
+    handler = functools.partial(QuietHandler, directory=path)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='catalogue-server').start()
+    return server, port
+
+
+def start_server(config_home: str, port: int, catalogue_port: int, levels_fps: int) -> subprocess.Popen:
+    with open(os.path.join(config_home, 'ezbeq.yml'), 'w') as f:
+        f.write(f"""port: {port}
+accessLogging: false
+debugLogging: false
+catalogueUrl: http://127.0.0.1:{catalogue_port}/
+devices:
+  master:
+    type: minidsp
+    exe: stub
+    levelsFps: {levels_fps}
+""")
+    return subprocess.Popen([sys.executable, '-c', 'from ezbeq.main import main; main()'],
+                            env={**os.environ, 'EZBEQ_CONFIG_HOME': config_home},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(base: str, catalogue_size: int, timeout: float = 120.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            r = requests.get(f'{base}/api/1/meta', timeout=1)
+            if r.status_code == 200 and (not catalogue_size or r.json().get('count', 0) >= catalogue_size):
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise TimeoutError(f'Server at {base} not ready after {timeout}s')
+
+
+def patch_master_volume(base: str, recorder: Recorder, rate: float, stop: threading.Event):
+    session = requests.Session()
+    seq = 0
+    while not stop.wait(1.0 / rate):
+        volume = recorder.patching(seq)
+        seq += 1
+        try:
+            session.patch(f'{base}/api/3/devices/master', json={'masterVolume': volume}, timeout=5)
+        except requests.RequestException as e:
+            print(f'PATCH failed: {e}', file=sys.stderr)
+
+
+def sample_server(proc: psutil.Process, samples: list[tuple[float, float, int]], stop: threading.Event):
+    while not stop.wait(0.25):
+        try:
+            cpu = proc.cpu_times()
+            samples.append((time.time(), cpu.user + cpu.system, proc.memory_info().rss))
+        except psutil.Error:
+            return
+
+
+def report(recorder: Recorder, duration: float, samples: list[tuple[float, float, int]]) -> dict:
+    result = {'duration': duration, 'messages': {}}
+    for kind in sorted(recorder.counts):
+        latencies = [v * 1000 for v in recorder.latencies.get(kind, [])]
+        result['messages'][kind] = {
+            'count': recorder.counts[kind],
+            'per_second': round(recorder.counts[kind] / duration, 1),
+            'bytes_per_second': round(recorder.bytes[kind] / duration),
+            'latency_ms': {p: round(percentile(latencies, n), 2)
+                           for p, n in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))} if latencies else None
+        }
+    if recorder.catalogue_loads:
+        loads = [v * 1000 for v in recorder.catalogue_loads]
+        result['catalogue_load_ms'] = {'count': len(loads), 'p50': round(percentile(loads, 50)),
+                                       'max': round(max(loads)), 'mean': round(statistics.mean(loads))}
+    if len(samples) > 1:
+        elapsed = samples[-1][0] - samples[0][0]
+        result['server'] = {
+            'cpu_percent': round(100 * (samples[-1][1] - samples[0][1]) / elapsed, 1),
+            'rss_mb_start': round(samples[0][2] / 2 ** 20, 1),
+            'rss_mb_peak': round(max(s[2] for s in samples) / 2 ** 20, 1),
+            'rss_mb_end': round(samples[-1][2] / 2 ** 20, 1),
+        }
+    return result
+
+
+def print_report(result: dict):
+    print(f"\n{'message':<20}{'count':>8}{'msg/s':>10}{'KB/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+          f"{'max ms':>10}")
+    for kind, m in result['messages'].items():
+        lat = m['latency_ms'] or {}
+        print(f"{kind:<20}{m['count']:>8}{m['per_second']:>10}{m['bytes_per_second'] / 1024:>10.1f}"
+              + ''.join(f"{lat.get(p, '-'):>10}" for p in ('p50', 'p90', 'p99', 'max')))
+    if 'catalogue_load_ms' in result:
+        c = result['catalogue_load_ms']
+        print(f"\ncatalogue loads: {c['count']}, p50 {c['p50']}ms, mean {c['mean']}ms, max {c['max']}ms")
+    if 'server' in result:
+        s = result['server']
+        print(f"server: cpu {s['cpu_percent']}%, rss {s['rss_mb_start']}MB -> {s['rss_mb_end']}MB "
+              f"(peak {s['rss_mb_peak']}MB)")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Websocket load test against the stub minidsp')
+    parser.add_argument('--clients', type=int, default=10, help='UI clients receiving state and the catalogue')
+    parser.add_argument('--levels-clients', type=int, default=2, help='clients subscribed to levels')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds to run for once the clients connect')
+    parser.add_argument('--patch-rate', type=float, default=5.0, help='master volume PATCHes per second')
+    parser.add_argument('--levels-fps', type=int, default=10, help='levelsFps for the stub device')
+    parser.add_argument('--catalogue-size', type=int, default=5000,
+                        help='synthetic catalogue entries, each UI client loads it once (0 to skip)')
+    parser.add_argument('--binary-levels', action='store_true', help='subscribe to binary levels frames')
+    parser.add_argument('--state-patch', action='store_true', help='accept DeviceStatePatch deltas')
+    parser.add_argument('--json', help='also write the results to this file')
+    opts = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory(prefix='ezbeq-ws-harness') as tmp:
+        catalogue_dir = os.path.join(tmp, 'catalogue')
+        config_home = os.path.join(tmp, 'config')
+        os.makedirs(catalogue_dir)
+        os.makedirs(config_home)
+        if opts.catalogue_size:
+            write_synthetic_catalogue(os.path.join(catalogue_dir, 'database.json'), opts.catalogue_size)
+            with open(os.path.join(catalogue_dir, 'version.txt'), 'w') as f:
+                f.write('harness')
+        catalogue_server, catalogue_port = serve_catalogue(catalogue_dir)
+        port = free_port()
+        base = f'http://127.0.0.1:{port}'
+        server = start_server(config_home, port, catalogue_port, opts.levels_fps)
+        try:
+            wait_until_ready(base, opts.catalogue_size)
+            recorder = Recorder()
+            url = f'ws://127.0.0.1:{port}/ws'
+            for levels in [False] * opts.clients + [True] * opts.levels_clients:
+                connectWS(HarnessClientFactory(url, recorder, levels, opts.binary_levels, opts.state_patch,
+                                               opts.catalogue_size))
+            stop = threading.Event()
+            samples = []
+            threading.Thread(target=sample_server, args=(psutil.Process(server.pid), samples, stop),
+                             daemon=True).start()
+            threading.Thread(target=patch_master_volume, args=(base, recorder, opts.patch_rate, stop),
+                             daemon=True).start()
+            reactor.callLater(opts.duration, reactor.stop)
+            reactor.run()
+            stop.set()
+            result = report(recorder, opts.duration, samples)
+            print_report(result)
+            if opts.json:
+                with open(opts.json, 'w') as f:
+                    json.dump(result, f, indent=2)
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+            catalogue_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
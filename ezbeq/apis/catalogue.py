@@ -1,8 +1,9 @@
 import logging
 
-from flask_restx import Namespace, Resource
+from flask_restx import Namespace, Resource, reqparse
 
 from ezbeq.catalogue import CatalogueProvider
+from ezbeq.response import FrequencyResponseService, InvalidGridError
 
 logger = logging.getLogger('ezbeq.catalogue')
 
@@ -49,3 +50,34 @@ class FilterLoad(Resource):
             }, 200
         else:
             return None, 404
+
+
+@api.route('/<string:entry_id>/response')
+@api.doc(params={
+    'entry_id': 'The entry id (digest from beqcatalogue)'
+})
+class FrequencyResponse(Resource):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__response: FrequencyResponseService = kwargs['response']
+        self.__parser = reqparse.RequestParser()
+        self.__parser.add_argument('fs', type=int, default=48000)
+        self.__parser.add_argument('fmin', type=float, default=1.0)
+        self.__parser.add_argument('fmax', type=float, default=200.0)
+        self.__parser.add_argument('points', type=int, default=200)
+
+    @api.param('fs', 'The sample rate to compute the response at, defaults to 48000')
+    @api.param('fmin', 'The lowest frequency in the log spaced grid, defaults to 1Hz')
+    @api.param('fmax', 'The highest frequency in the log spaced grid, defaults to 200Hz')
+    @api.param('points', 'The number of frequencies in the grid, defaults to 200')
+    def get(self, entry_id: str):
+        args = self.__parser.parse_args()
+        try:
+            response = self.__response.response(entry_id, args['fs'], args['fmin'], args['fmax'], args['points'])
+        except InvalidGridError as e:
+            return str(e), 400
+        if response:
+            return response, 200
+        else:
+            return None, 404
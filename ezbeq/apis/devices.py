@@ -7,7 +7,12 @@ from flask import request
 from flask_restx import Namespace, Resource, fields
 
 from ezbeq.catalogue import CatalogueEntry, CatalogueProvider
-from ezbeq.device import DeviceRepository, InvalidRequestError, UnableToPatchDeviceError
+from ezbeq.device import (
+    DeviceRepository,
+    InvalidRequestError,
+    NoSuchDevice,
+    UnableToPatchDeviceError,
+)
 from ezbeq.iir import HighShelf, LowShelf, PeakingEQ
 
 logger = logging.getLogger('ezbeq.devices')
@@ -244,6 +249,28 @@ def set_gain(bridge: DeviceRepository, device_name: str, slot: str | None, value
         return bridge.state(device_name).serialise(), 500
 
 
+def levels_history(bridge: DeviceRepository, device_name: str, seconds: float | None, points: int) -> tuple[dict, int]:
+    '''
+    Reads the recent levels held for the device.
+    :param bridge: the bridge to the device.
+    :param device_name: the device name.
+    :param seconds: how far back to go, everything held if not set.
+    :param points: the maximum number of points to return.
+    :return: the levels history and 200, 400 if the args are invalid or 404 if the device does not keep a history.
+    '''
+    if points <= 0:
+        return {'message': f'points must be greater than 0, got {points}'}, 400
+    if seconds is not None and not seconds >= 0:
+        return {'message': f'seconds must not be negative, got {seconds}'}, 400
+    try:
+        history = bridge.levels_history(device_name, seconds, points)
+    except NoSuchDevice:
+        return {'message': f'Unknown device {device_name}'}, 404
+    if history is None:
+        return {'message': f'{device_name} does not keep levels history'}, 404
+    return history, 200
+
+
 v1_api = Namespace('1/devices', description='Device related operations')
 v2_api = Namespace('2/devices', description='Device related operations')
 v3_api = Namespace('3/devices', description='Device related operations')
@@ -270,10 +297,18 @@ class DevicesV2(Resource):
         super().__init__(*args, **kwargs)
         self.__bridge: DeviceRepository = kwargs['device_bridge']
 
+    @v2_api.param('maxAge', 'The max age, in seconds, of the returned device state, 0 forces a read from every device. '
+                            'Cache-Control: max-age or no-cache headers are also honoured.')
     def get(self):
         from ezbeq import to_millis
         start = time.time()
-        v = {n: d.serialise() for n, d in self.__bridge.all_devices(refresh=True).items()}
+        max_age = request.args.get('maxAge', type=float)
+        if max_age is None:
+            if request.cache_control.no_cache:
+                max_age = 0.0
+            elif request.cache_control.max_age is not None:
+                max_age = float(request.cache_control.max_age)
+        v = {n: r.serialise() for n, r in self.__bridge.read_all(refresh=True, max_age=max_age).items()}
         logger.debug(f'Loaded device state in {to_millis(start, time.time())}ms')
         return v
 
@@ -393,6 +428,21 @@ class DeviceLevels(Resource):
             return {}, 500
 
 
+@v1_api.route('/<string:device_name>/levels/history')
+class DeviceLevelsHistory(Resource):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__bridge: DeviceRepository = kwargs['device_bridge']
+
+    @v1_api.param('seconds', 'How far back, in seconds, to go (default everything held)')
+    @v1_api.param('points', 'The maximum number of points to return, older levels are downsampled to fit '
+                            '(default 300)')
+    def get(self, device_name: str) -> tuple[dict, int]:
+        return levels_history(self.__bridge, device_name, request.args.get('seconds', type=float),
+                              request.args.get('points', default=300, type=int))
+
+
 @v1_api.route('/<string:device_name>/config/<string:slot>/active')
 @v1_api.doc(params={
     'device_name': 'The dsp device name',
@@ -5,6 +5,19 @@ from ezbeq.catalogue import CatalogueProvider
 api = Namespace('1/meta', description='Provides access to metadata about the beq catalogue')
 
 
+def catalogue_meta(provider: CatalogueProvider) -> dict:
+    catalogue = provider.catalogue
+    return {
+        'version': catalogue.version,
+        'loaded': int(catalogue.loaded_at.timestamp()),
+        'count': catalogue.count
+    } if catalogue else {
+        'version': 'N/A',
+        'loaded': None,
+        'count': 0
+    }
+
+
 @api.route('')
 class CatalogueMeta(Resource):
 
@@ -13,13 +26,4 @@ class CatalogueMeta(Resource):
         self.__provider: CatalogueProvider = kwargs['catalogue']
 
     def get(self):
-        catalogue = self.__provider.catalogue
-        return {
-            'version': catalogue.version,
-            'loaded': int(catalogue.loaded_at.timestamp()),
-            'count': catalogue.count
-        } if catalogue else {
-            'version': 'N/A',
-            'loaded': None,
-            'count': 0
-        }
+        return catalogue_meta(self.__provider)
@@ -0,0 +1,192 @@
+import json
+import logging
+import time
+from collections.abc import Callable
+from typing import Any
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.resource import EncodingResourceWrapper, Resource
+from twisted.web.server import NOT_DONE_YET, GzipEncoderFactory, Request
+
+from ezbeq import to_millis
+from ezbeq.apis.devices import levels_history
+from ezbeq.apis.meta import catalogue_meta
+from ezbeq.apis.search import search
+from ezbeq.catalogue import CatalogueProvider
+from ezbeq.device import DeviceRepository, InvalidRequestError
+from ezbeq.pools import WorkerPool
+
+logger = logging.getLogger('ezbeq.native')
+
+# repeatable search args and how to convert each value, as declared on CatalogueSearch
+SEARCH_LIST_ARGS: dict[str, Callable[[str], Any]] = {
+    'authors': str,
+    'years': int,
+    'audiotypes': str,
+    'contenttypes': str,
+    'fields': str,
+    'audiocodecs': str,
+    'audiochannelcounts': str,
+}
+SEARCH_ARGS = ('text', 'tmdbid')
+
+
+class JsonEndpoint(Resource):
+    """
+    Renders the result of a handler, which may return a Deferred, as json. The handler returns the body and the
+    status code.
+    """
+    isLeaf = True
+
+    def __init__(self, handler: Callable[..., Any], params: list[str]):
+        super().__init__()
+        self.__handler = handler
+        self.__params = params
+
+    def render_GET(self, request: Request):
+        finished = []
+        request.notifyFinish().addBoth(finished.append)
+        d = defer.maybeDeferred(self.__handler, request, *self.__params)
+        d.addCallbacks(lambda r: self.__write(request, finished, *r),
+                       lambda f: self.__fail(request, finished, f))
+        return NOT_DONE_YET
+
+    @staticmethod
+    def __write(request: Request, finished: list, body: Any, code: int):
+        if finished:
+            # the client went away while the handler was running
+            return
+        payload = (json.dumps(body) + '\n').encode('utf-8')
+        request.setResponseCode(code)
+        request.setHeader(b'content-type', b'application/json')
+        request.setHeader(b'content-length', str(len(payload)).encode('ascii'))
+        # twisted swaps write for a no-op on the instance once a HEAD response starts, go via the class
+        type(request).write(request, payload)
+        request.finish()
+
+    def __fail(self, request: Request, finished: list, failure: Failure):
+        logger.error(f'Failed to handle {request.method.decode()} {request.uri.decode()}',
+                     exc_info=failure.value)
+        self.__write(request, finished, {'message': 'Internal Server Error'}, 500)
+
+
+class NativeApi:
+    """
+    Serves the hot read endpoints (device state, search, catalogue meta and levels) directly on the reactor rather
+    than via the WSGI app, which ties up a reactor threadpool thread for the life of every request. Anything that
+    blocks on a device is run in the device-io pool and catalogue queries in the catalogue-io pool, everything else is
+    cheap enough to answer on the reactor. Requests with no native route fall through to the WSGI app.
+    """
+
+    def __init__(self, bridge: DeviceRepository, catalogue: CatalogueProvider, device_io: WorkerPool,
+                 catalogue_io: WorkerPool):
+        self.__bridge = bridge
+        self.__catalogue = catalogue
+        self.__device_io = device_io
+        self.__catalogue_io = catalogue_io
+        # paths below /api, * matches any single segment and is passed to the handler
+        self.__routes: list[tuple[tuple[str, ...], Callable[..., Any]]] = [
+            (('2', 'devices'), self.__devices),
+            (('1', 'search'), self.__search),
+            (('1', 'meta'), self.__meta),
+            (('1', 'devices', '*', 'levels'), self.__levels),
+            (('1', 'devices', '*', 'levels', 'history'), self.__levels_history),
+        ]
+
+    def resource(self, request: Request) -> Resource | None:
+        """
+        :param request: the request, its postpath is the path below /api.
+        :return: the resource to render the request or None if it should be handled by the WSGI app.
+        """
+        if request.method not in (b'GET', b'HEAD'):
+            return None
+        try:
+            segments = [s.decode('utf-8') for s in request.postpath or []]
+        except UnicodeDecodeError:
+            return None
+        for pattern, handler in self.__routes:
+            if len(pattern) == len(segments) and all(p == '*' or p == s for p, s in zip(pattern, segments)):
+                params = [s for p, s in zip(pattern, segments) if p == '*']
+                return EncodingResourceWrapper(JsonEndpoint(handler, params), [GzipEncoderFactory()])
+        return None
+
+    def __devices(self, request: Request) -> defer.Deferred:
+        start = time.time()
+        max_age = _get_arg(request, 'maxAge', float)
+        if max_age is None:
+            max_age = _cache_control_max_age(request)
+
+        def serialise(reads) -> tuple[dict, int]:
+            v = {n: r.serialise() for n, r in reads.items()}
+            logger.debug(f'Loaded device state in {to_millis(start, time.time())}ms')
+            return v, 200
+
+        return self.__device_io.run(self.__bridge.read_all, refresh=True, max_age=max_age).addCallback(serialise)
+
+    def __search(self, request: Request) -> tuple[Any, int] | defer.Deferred:
+        args: dict[str, Any] = {}
+        try:
+            for name, convert in SEARCH_LIST_ARGS.items():
+                values = (request.args or {}).get(name.encode('utf-8'))
+                args[name] = [convert(v.decode('utf-8')) for v in values] if values else None
+        except ValueError as e:
+            return {'message': f'Invalid search: {e}'}, 400
+        for name in SEARCH_ARGS:
+            args[name] = _get_arg(request, name, str)
+        return self.__catalogue_io.run(search, self.__catalogue, args).addCallback(_with_status)
+
+    def __meta(self, request: Request) -> tuple[dict, int]:
+        return catalogue_meta(self.__catalogue), 200
+
+    def __levels(self, request: Request, device_name: str) -> defer.Deferred:
+        def failed(f: Failure):
+            if f.check(InvalidRequestError):
+                logger.error(f'Invalid device {device_name}')
+                return {}, 400
+            logger.error(f'Failed to get levels for {device_name}', exc_info=f.value)
+            return {}, 500
+
+        return self.__device_io.run(self.__bridge.levels, device_name).addCallbacks(_with_status, failed)
+
+    def __levels_history(self, request: Request, device_name: str) -> tuple[dict, int]:
+        return levels_history(self.__bridge, device_name, _get_arg(request, 'seconds', float),
+                              _get_arg(request, 'points', int, 300))
+
+
+def _with_status(result: Any) -> tuple[Any, int]:
+    return result if isinstance(result, tuple) else (result, 200)
+
+
+def _get_arg(request: Request, name: str, convert: Callable[[str], Any], default: Any = None) -> Any:
+    """
+    :return: the first value of the named query arg, or default if it is missing or cannot be converted.
+    """
+    values = (request.args or {}).get(name.encode('utf-8'))
+    if values:
+        try:
+            return convert(values[0].decode('utf-8'))
+        except ValueError:
+            pass
+    return default
+
+
+def _cache_control_max_age(request: Request) -> float | None:
+    """
+    :return: 0 if the request asks for no-cache, the max-age if one is provided, None otherwise.
+    """
+    header = request.getHeader('cache-control')
+    if not header:
+        return None
+    max_age = None
+    for directive in header.split(','):
+        name, _, value = directive.strip().partition('=')
+        name = name.lower()
+        if name == 'no-cache':
+            return 0.0
+        if name == 'max-age':
+            try:
+                max_age = float(value.strip('"'))
+            except ValueError:
+                pass
+    return max_age
@@ -9,6 +9,36 @@ logger = logging.getLogger('ezbeq.catalogue')
 api = Namespace('1/search', description='Provides ability to search the beq catalogue')
 
 
+def search(provider: CatalogueProvider, args: dict) -> list[dict] | tuple[str, int]:
+    """
+    Searches the catalogue.
+    :param provider: the catalogue.
+    :param args: the parsed search args, repeatable args are lists.
+    :return: the matching entries or an error and status code if the args are invalid.
+    """
+    authors = args.get('authors', [])
+    years = args.get('years', [])
+    audio_types = args.get('audiotypes', [])
+    content_types = args.get('contenttypes', [])
+    text = args.get('text', [])
+    tmdb_id = args.get('tmdbid', [])
+    audio_codecs = args.get('audiocodecs', [])
+    audio_channel_counts = args.get('audiochannelcounts', [])
+    fields = args.get('fields', [])
+    limit = args.get('limit')
+    if limit == 'all':
+        limit = None
+    elif limit:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return f'Invalid limit {limit}', 400
+    else:
+        limit = 100
+    return provider.search(authors, years, audio_types, content_types, tmdb_id, text, audio_codecs,
+                           audio_channel_counts, fields, limit=limit)
+
+
 @api.route('')
 class CatalogueSearch(Resource):
 
@@ -37,25 +67,4 @@ class CatalogueSearch(Resource):
     @api.param('audiochannelcounts', 'The audio channel count of the entry, if multiple values provided any match will be returned')
     @api.param('limit', 'max number of results to return, if unset defaults to 200')
     def get(self):
-        args = self.__parser.parse_args()
-        authors = args.get('authors', [])
-        years = args.get('years', [])
-        audio_types = args.get('audiotypes', [])
-        content_types = args.get('contenttypes', [])
-        text = args.get('text', [])
-        tmdb_id = args.get('tmdbid', [])
-        audio_codecs = args.get('audiocodecs', [])
-        audio_channel_counts = args.get('audiochannelcounts', [])
-        fields = args.get('fields', [])
-        limit = args.get('limit')
-        if limit == 'all':
-            limit = None
-        elif limit:
-            try:
-                limit = int(limit)
-            except ValueError:
-                return f'Invalid limit {limit}', 400
-        else:
-            limit = 100
-        return self.__provider.search(authors, years, audio_types, content_types, tmdb_id, text, audio_codecs,
-                                      audio_channel_counts, fields, limit=limit)
+        return search(self.__provider, self.__parser.parse_args())
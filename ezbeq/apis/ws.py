@@ -1,19 +1,155 @@
 import abc
+import functools
 import json
 import logging
-from collections import defaultdict
+import math
+import re
+import struct
+import threading
+import time
+from collections import defaultdict, deque
 from collections.abc import Callable
-from typing import Generic, TypeVar
+from dataclasses import dataclass
+from typing import Any, Generic, TypeVar
 
 from autobahn.exception import Disconnected
 from autobahn.twisted import WebSocketServerFactory, WebSocketServerProtocol
+from autobahn.websocket.compress import (
+    PerMessageDeflateOffer,
+    PerMessageDeflateOfferAccept,
+)
+from autobahn.websocket.protocol import PreparedMessage, WebSocketProtocol
+from prometheus_client import Counter, Gauge, Histogram
+from twisted.internet import defer
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
 
 SUBSCRIBE_LEVELS_CMD = 'subscribe levels'
 
 LOAD_CATALOGUE_CMD = 'load catalogue'
 
+CAPABILITIES_CMD = 'capabilities'
+
+STATE_PATCH_CAPABILITY = 'state-patch'
+
+BINARY_LEVELS = 'binary'
+
+LEVELS_FPS = 'fps='
+
+# how old the latest levels can be and still be sent to a new subscriber
+LATEST_LEVELS_MAX_AGE = 2.0
+
+LEVELS_FRAME_VERSION = 1
+
+_LEVEL_KEY_PATTERN = re.compile(r'^(.*?)(\d+)$')
+
 logger = logging.getLogger('ezbeq.ws')
 
+STATE_BROADCASTS = Counter('ezbeq_ws_state_broadcasts', 'Device state broadcasts by outcome', ['outcome'])
+QUEUED_MESSAGES = Gauge('ezbeq_ws_queued_messages', 'Messages waiting for a paused websocket client')
+DROPPED_MESSAGES = Counter('ezbeq_ws_dropped_messages', 'Messages dropped for a lagging websocket client', ['kind'])
+CLIENT_PAUSES = Counter('ezbeq_ws_client_pauses', 'Times a websocket client transport asked for sends to pause')
+DEFLATE_BYTES = Counter('ezbeq_ws_deflate_bytes', 'Bytes passed through permessage-deflate', ['stage'])
+DEFLATE_RATIO = Histogram('ezbeq_ws_deflate_ratio', 'Compressed size as a fraction of the message size',
+                          buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0))
+DEFLATE_SECONDS = Histogram('ezbeq_ws_deflate_seconds', 'CPU time spent sending a compressed message',
+                            buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+MAX_QUEUED_MESSAGES = 256
+
+
+def make_json_patch(old: Any, new: Any, path: str = '') -> list[dict]:
+    '''
+    Generates a JSON Patch (RFC 6902) which transforms old into new, lists that change length are replaced.
+    :param old: the old value.
+    :param new: the new value.
+    :param path: the JSON pointer to the values.
+    :return: the patch operations.
+    '''
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for k, v in old.items():
+            p = f"{path}/{str(k).replace('~', '~0').replace('/', '~1')}"
+            if k in new:
+                ops.extend(make_json_patch(v, new[k], p))
+            else:
+                ops.append({'op': 'remove', 'path': p})
+        for k, v in new.items():
+            if k not in old:
+                ops.append({'op': 'add', 'path': f"{path}/{str(k).replace('~', '~0').replace('/', '~1')}", 'value': v})
+        return ops
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        ops = []
+        for i, (o, n) in enumerate(zip(old, new)):
+            ops.extend(make_json_patch(o, n, f"{path}/{i}"))
+        return ops
+    if type(old) is type(new) and old == new:
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def pack_levels(levels: dict) -> bytes | None:
+    '''
+    Packs a levels payload into a binary frame, all values are little endian.
+
+    * version (uint8), name length (uint8), name (utf-8), ts (float64), group count (uint8)
+    * per group: prefix length (uint8), prefix (utf-8), value count (uint16), values (float32 * count)
+
+    Each group holds the values for the keys <prefix>0 to <prefix>N in order, e.g. I0..I3 or RMS-0..RMS-1.
+    :param levels: the levels payload as sent in a Levels message.
+    :return: the frame or None if the payload cannot be packed.
+    '''
+    try:
+        name = levels['name'].encode('utf8')
+        groups: list[tuple[bytes, list[float]]] = []
+        prefixes = {}
+        for k, v in levels['levels'].items():
+            m = _LEVEL_KEY_PATTERN.match(k)
+            if not m:
+                return None
+            prefix, idx = m.group(1), int(m.group(2))
+            if prefix not in prefixes:
+                prefixes[prefix] = len(groups)
+                groups.append((prefix.encode('utf8'), []))
+            values = groups[prefixes[prefix]][1]
+            if idx != len(values):
+                return None
+            values.append(v)
+        parts = [struct.pack('<BB', LEVELS_FRAME_VERSION, len(name)), name,
+                 struct.pack('<dB', levels['ts'], len(groups))]
+        for prefix, values in groups:
+            parts.append(struct.pack(f'<B{len(prefix)}sH{len(values)}f', len(prefix), prefix, len(values), *values))
+        return b''.join(parts)
+    except (KeyError, TypeError, AttributeError, struct.error):
+        return None
+
+
+def unpack_levels(frame: bytes) -> dict:
+    '''
+    The inverse of pack_levels.
+    :param frame: the binary frame.
+    :return: the levels payload.
+    '''
+    version, name_len = struct.unpack_from('<BB', frame)
+    if version != LEVELS_FRAME_VERSION:
+        raise ValueError(f'Unsupported levels frame version {version}')
+    offset = 2
+    name = frame[offset:offset + name_len].decode('utf8')
+    offset += name_len
+    ts, group_count = struct.unpack_from('<dB', frame, offset)
+    offset += 9
+    levels = {}
+    for _ in range(group_count):
+        prefix_len = frame[offset]
+        prefix = frame[offset + 1:offset + 1 + prefix_len].decode('utf8')
+        offset += 1 + prefix_len
+        count, = struct.unpack_from('<H', frame, offset)
+        offset += 2
+        for i, v in enumerate(struct.unpack_from(f'<{count}f', frame, offset)):
+            levels[f'{prefix}{i}'] = v
+        offset += 4 * count
+    return {'name': name, 'ts': ts, 'levels': levels}
+
 
 class WsServerFactory(abc.ABC):
     @abc.abstractmethod
@@ -37,9 +173,26 @@ class WsServerFactory(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def init_catalogue_loader(self, loader: Callable[[Callable[[str], None]], None]):
+    def init_catalogue_loader(self, loader: Callable[[Callable[[str], Any]], None]):
         pass
 
+    def levels_fps(self, device: str) -> float | None:
+        '''
+        :param device: the device name.
+        :return: the fastest rate any levels subscriber for the device asked for, inf if one did not ask for a
+        particular rate, or None if there are no subscribers.
+        '''
+        return math.inf if self.has_levels_client(device) else None
+
+    def broadcast_state(self, device: str, msg: str, patch: Callable[[], str | None]):
+        '''
+        Sends a changed device state to every client.
+        :param device: the device name.
+        :param msg: the full DeviceState message.
+        :param patch: supplies a DeviceStatePatch message relative to the previous state, if there is one.
+        '''
+        self.broadcast(msg)
+
 
 class WsProtocol(WebSocketServerProtocol):
 
@@ -60,13 +213,153 @@ class WsProtocol(WebSocketServerProtocol):
             logger.debug(f"Received '{s}'")
             if s.startswith(SUBSCRIBE_LEVELS_CMD):
                 device_name = s[len(SUBSCRIBE_LEVELS_CMD) + 1:].rstrip()
-                self.factory.register_for_levels(device_name, self)
+                options = {}
+                # options follow the device name which may itself contain spaces
+                while True:
+                    head, _, last = device_name.rpartition(' ')
+                    if head and last == BINARY_LEVELS:
+                        options['binary'] = True
+                    elif head and last.startswith(LEVELS_FPS):
+                        options['fps'] = float(last[len(LEVELS_FPS):])
+                    else:
+                        break
+                    device_name = head.rstrip()
+                self.factory.register_for_levels(device_name, self, **options)
             elif s.startswith(LOAD_CATALOGUE_CMD):
                 self.factory.send_catalogue(self)
+            elif s.startswith(CAPABILITIES_CMD):
+                self.factory.set_capabilities(self, s[len(CAPABILITIES_CMD) + 1:].split())
         except Exception:
             logger.exception('Message received failure')
 
 
+@dataclass
+class LevelsSubscription:
+    binary: bool = False
+    fps: float = math.inf
+
+
+@implementer(IPushProducer)
+class ClientSender:
+    '''
+    Sends to a single client, registered as a streaming producer so messages are held back while the client transport
+    is applying backpressure. Levels are latest-wins per device, anything else is queued and the client is dropped
+    if the queue fills up.
+    '''
+
+    def __init__(self, client: 'WsProtocol', max_queued: int = MAX_QUEUED_MESSAGES):
+        self.__client = client
+        self.__max_queued = max_queued
+        self.__lock = threading.RLock()
+        self.__paused = False
+        self.__stopped = False
+        self.__queue: deque[PreparedMessage] = deque()
+        self.__levels: dict[str, PreparedMessage] = {}
+        self.__waiting: list[defer.Deferred] = []
+
+    @property
+    def paused(self) -> bool:
+        return self.__paused
+
+    @property
+    def queued(self) -> int:
+        return len(self.__queue) + len(self.__levels)
+
+    def send(self, msg: PreparedMessage) -> bool:
+        '''
+        Sends the message now or queues it until the client catches up.
+        :param msg: the message.
+        :return: false if the client has fallen too far behind and should be dropped.
+        '''
+        with self.__lock:
+            if self.__stopped:
+                return False
+            if not self.__paused and not self.__queue:
+                self.__write(msg)
+                return True
+            if len(self.__queue) >= self.__max_queued:
+                DROPPED_MESSAGES.labels('overflow').inc()
+                return False
+            self.__queue.append(msg)
+            QUEUED_MESSAGES.inc()
+            return True
+
+    def send_levels(self, device: str, msg: PreparedMessage):
+        '''
+        Sends the levels now or replaces any levels for the device which are still waiting to be sent.
+        :param device: the device name.
+        :param msg: the message.
+        '''
+        with self.__lock:
+            if self.__stopped:
+                return
+            if not self.__paused and not self.__queue:
+                self.__write(msg)
+            else:
+                if device in self.__levels:
+                    DROPPED_MESSAGES.labels('levels').inc()
+                else:
+                    QUEUED_MESSAGES.inc()
+                self.__levels[device] = msg
+
+    def __write(self, msg: PreparedMessage):
+        if msg.doNotCompress or getattr(self.__client, '_perMessageCompress', None) is None:
+            self.__client.sendPreparedMessage(msg)
+        else:
+            stats = self.__client.trafficStats
+            before = stats.outgoingOctetsWebSocketLevel
+            start = time.thread_time()
+            self.__client.sendPreparedMessage(msg)
+            DEFLATE_SECONDS.observe(time.thread_time() - start)
+            compressed = stats.outgoingOctetsWebSocketLevel - before
+            DEFLATE_BYTES.labels('in').inc(len(msg.payload))
+            DEFLATE_BYTES.labels('out').inc(compressed)
+            if msg.payload:
+                DEFLATE_RATIO.observe(compressed / len(msg.payload))
+
+    def when_writable(self) -> defer.Deferred:
+        '''
+        :return: a Deferred which fires once the client is not paused and has nothing queued, it never fires if the
+        client goes away.
+        '''
+        with self.__lock:
+            if not self.__paused and not self.__queue and not self.__levels:
+                return defer.succeed(None)
+            d = defer.Deferred()
+            self.__waiting.append(d)
+            return d
+
+    def pauseProducing(self):
+        with self.__lock:
+            if not self.__paused:
+                CLIENT_PAUSES.inc()
+            self.__paused = True
+
+    def resumeProducing(self):
+        with self.__lock:
+            self.__paused = False
+            while self.__queue and not self.__paused:
+                QUEUED_MESSAGES.dec()
+                self.__write(self.__queue.popleft())
+            while self.__levels and not self.__paused and not self.__queue:
+                QUEUED_MESSAGES.dec()
+                self.__write(self.__levels.pop(next(iter(self.__levels))))
+            if self.__paused or self.__queue or self.__levels:
+                return
+            waiting = self.__waiting
+            self.__waiting = []
+        for d in waiting:
+            d.callback(None)
+
+    def stopProducing(self):
+        with self.__lock:
+            self.__stopped = True
+            QUEUED_MESSAGES.dec(self.queued)
+            self.__queue.clear()
+            self.__levels.clear()
+            self.__waiting = []
+
+
 class AutobahnWsServerFactory(WsServerFactory, WebSocketServerFactory):
     protocol = WsProtocol
 
@@ -76,8 +369,37 @@ class AutobahnWsServerFactory(WsServerFactory, WebSocketServerFactory):
         self.__levels_client: dict[str, list[WsProtocol]] = defaultdict(list)
         self.__state_provider: Callable[[], str] | None = None
         self.__meta_provider: Callable[[], str] | None = None
-        self.__catalogue_loader: Callable[[Callable[[str], None]], None] | None = None
+        self.__catalogue_loader: Callable[[Callable[[str], Any]], None] | None = None
         self.__levels_provider: dict[str, Callable[[], None]] = {}
+        # clients accepting state patches mapped to the devices they have received a full state for
+        self.__patch_clients: dict[WsProtocol, set[str]] = {}
+        self.__senders: dict[WsProtocol, ClientSender] = {}
+        self.__levels_subscriptions: dict[str, dict[WsProtocol, LevelsSubscription]] = defaultdict(dict)
+        # the latest levels message and frame suppliers for each device and when they were sent
+        self.__latest_levels: dict[str, tuple[Callable[[], str], Callable[[], bytes | None], float]] = {}
+        self.__compress_threshold: int | None = None
+        self.__compress_mem_level = 8
+
+    def enable_compression(self, threshold: int, mem_level: int):
+        '''
+        Accepts permessage-deflate offers from clients.
+        :param threshold: messages smaller than this many bytes are sent uncompressed.
+        :param mem_level: the zlib memLevel (1-9), lower values use less memory per client at some cost in ratio.
+        '''
+        self.__compress_threshold = threshold
+        self.__compress_mem_level = mem_level
+        self.setProtocolOptions(perMessageCompressionAccept=self.__accept_compression)
+
+    def __accept_compression(self, offers):
+        for offer in offers:
+            if isinstance(offer, PerMessageDeflateOffer):
+                return PerMessageDeflateOfferAccept(offer, mem_level=self.__compress_mem_level)
+        return None
+
+    def __prepare(self, msg: str) -> PreparedMessage:
+        payload = msg.encode('utf8')
+        small = self.__compress_threshold is None or len(payload) < self.__compress_threshold
+        return self.prepareMessage(payload, isBinary=False, doNotCompress=small)
 
     def init_state_provider(self, state_provider: Callable[[], str]):
         self.__state_provider = state_provider
@@ -85,7 +407,7 @@ class AutobahnWsServerFactory(WsServerFactory, WebSocketServerFactory):
     def init_meta_provider(self, meta_provider: Callable[[], str]):
         self.__meta_provider = meta_provider
 
-    def init_catalogue_loader(self, loader: Callable[[Callable[[str], None]], None]):
+    def init_catalogue_loader(self, loader: Callable[[Callable[[str], Any]], None]):
         self.__catalogue_loader = loader
 
     def set_levels_provider(self, name: str, broadcaster: Callable[[], None]):
@@ -95,17 +417,26 @@ class AutobahnWsServerFactory(WsServerFactory, WebSocketServerFactory):
         if client not in self.__clients:
             logger.debug(f"Registered client {client.peer}")
             self.__clients.append(client)
+            sender = self.__sender(client)
             if self.__meta_provider:
                 msg = self.__meta_provider()
                 if msg:
-                    client.sendMessage(msg.encode('utf8'), isBinary=False)
+                    sender.send(self.__prepare(msg))
             if self.__state_provider:
                 msg = self.__state_provider()
                 if msg:
-                    client.sendMessage(msg.encode('utf8'), isBinary=False)
+                    sender.send(self.__prepare(msg))
         else:
             logger.debug(f"Ignoring duplicate client {client.peer}")
 
+    def __sender(self, client: WsProtocol) -> ClientSender:
+        sender = self.__senders.get(client, None)
+        if sender is None:
+            sender = ClientSender(client)
+            self.__senders[client] = sender
+            client.registerProducer(sender, True)
+        return sender
+
     def send_catalogue(self, client: WsProtocol):
         if client not in self.__clients:
             logger.warning(f'Ignoring request for catalogue from unregistered client {client.peer}')
@@ -113,17 +444,22 @@ class AutobahnWsServerFactory(WsServerFactory, WebSocketServerFactory):
         if self.__catalogue_loader:
             logger.info(f'Sending catalogue to {client.peer}')
 
-            def encode_and_send(msg):
-                if msg:
-                    logger.debug(f'Sending catalogue msg (len {len(msg)}b)')
-                    client.sendMessage(msg.encode('utf8'), isBinary=False)
+            sender = self.__sender(client)
+
+            def encode_and_send(msg: str) -> defer.Deferred:
+                logger.debug(f'Sending catalogue msg (len {len(msg)}b)')
+                if not sender.send(self.__prepare(msg)):
+                    self.__drop(client)
+                # the next chunk is not loaded until this one has been written out
+                return sender.when_writable()
 
             self.__catalogue_loader(encode_and_send)
         else:
             logger.error(f'Unable to send catalogue to {client.peer}, no loader available')
 
-    def register_for_levels(self, device: str, client: WsProtocol):
+    def register_for_levels(self, device: str, client: WsProtocol, binary: bool = False, fps: float = math.inf):
         if device in self.__levels_provider:
+            self.__levels_subscriptions[device][client] = LevelsSubscription(binary, fps)
             if client in self.__clients:
                 logger.debug(f"Removing client {client.peer} from broadcast on level subscription for {device}")
                 self.__clients.remove(client)
@@ -136,11 +472,14 @@ class AutobahnWsServerFactory(WsServerFactory, WebSocketServerFactory):
                     else:
                         logger.debug(f"Client {client.peer} subscribed to levels for {device}")
                         v.append(client)
+            self.__send_latest_levels(device, client)
             self.__levels_provider[device]()
         else:
             logger.warning(f"Unknown device {device} requested by {client.peer}")
 
     def unregister_for_levels(self, client: WsProtocol):
+        for v in self.__levels_subscriptions.values():
+            v.pop(client, None)
         for k, v in self.__levels_client.items():
             try:
                 v.remove(client)
@@ -148,7 +487,20 @@ class AutobahnWsServerFactory(WsServerFactory, WebSocketServerFactory):
             except ValueError:
                 pass
 
+    def set_capabilities(self, client: WsProtocol, capabilities: list[str]):
+        logger.debug(f"Client {client.peer} has capabilities {capabilities}")
+        if STATE_PATCH_CAPABILITY in capabilities:
+            self.__patch_clients.setdefault(client, set())
+        else:
+            self.__patch_clients.pop(client, None)
+
     def unregister(self, client: WsProtocol):
+        self.__patch_clients.pop(client, None)
+        for v in self.__levels_subscriptions.values():
+            v.pop(client, None)
+        sender = self.__senders.pop(client, None)
+        if sender:
+            sender.stopProducing()
         if client in self.__clients:
             logger.debug(f"Unregistering client {client.peer}")
             self.__clients.remove(client)
@@ -163,37 +515,110 @@ class AutobahnWsServerFactory(WsServerFactory, WebSocketServerFactory):
                 logger.debug(f"Ignoring unregistered client {client.peer}")
 
     def broadcast(self, msg: str):
-        logger.debug(f"Broadcasting {msg}")
+        logger.debug('Broadcasting %s', msg)
         self.__send_to_all(self.__clients, msg)
 
-    def __send_to_all(self, clients, msg: str) -> bool:
+    def broadcast_state(self, device: str, msg: str, patch: Callable[[], str | None]):
+        full = []
+        patchable = []
+        for c in self.__clients:
+            (patchable if device in self.__patch_clients.get(c, ()) else full).append(c)
+        patch_msg = patch() if patchable else None
+        if patch_msg is None:
+            full.extend(patchable)
+        else:
+            self.__send_to_all(patchable, patch_msg)
+        self.__send_to_all(full, msg)
+        for c in full:
+            if c in self.__patch_clients:
+                self.__patch_clients[c].add(device)
+
+    def __send_to_all(self, clients, msg: str | bytes, levels_device: str | None = None) -> bool:
         if clients:
+            # frame the message once and send the same bytes to every client
+            if isinstance(msg, bytes):
+                prepared = self.prepareMessage(msg, isBinary=True, doNotCompress=True)
+            else:
+                prepared = self.__prepare(msg)
+            debug = logger.isEnabledFor(logging.DEBUG)
             disconnected_clients = []
+            lagging_clients = []
             for c in clients:
-                logger.debug(f"Sending to {c.peer} - {msg}")
+                if debug:
+                    logger.debug('Sending %d chars to %s', len(msg), c.peer)
                 try:
-                    c.sendMessage(msg.encode('utf8'), isBinary=False)
+                    if c.state != WebSocketProtocol.STATE_OPEN:
+                        raise Disconnected('Attempt to send on a closed protocol')
+                    if levels_device:
+                        self.__sender(c).send_levels(levels_device, prepared)
+                    elif not self.__sender(c).send(prepared):
+                        lagging_clients.append(c)
                 except Disconnected:
                     logger.exception(f"Failed to send to disconnected client {c.peer}, discarding")
                     disconnected_clients.append(c)
             for c in disconnected_clients:
                 self.unregister(c)
-            return len(disconnected_clients) < len(clients)
+            for c in lagging_clients:
+                self.__drop(c)
+            return len(disconnected_clients) + len(lagging_clients) < len(clients)
         else:
-            logger.debug(f"No devices connected, ignoring {msg}")
+            logger.debug('No devices connected, ignoring message of %d chars', len(msg))
             return False
 
-    def send_levels(self, device: str, msg: str):
-        logger.debug(f"Broadcasting levels {msg}")
+    def __drop(self, client: WsProtocol):
+        logger.warning(f"Dropping client {client.peer}, it is too far behind")
+        self.unregister(client)
+        client.dropConnection(abort=True)
+
+    def send_levels(self, device: str, msg: Callable[[], str], frame: Callable[[], bytes | None]) -> bool:
+        '''
+        Sends levels to the subscribers for the device, each form of the message is only created if some subscriber
+        needs it.
+        :param device: the device name.
+        :param msg: supplies the Levels message.
+        :param frame: supplies the binary levels frame, if the levels can be packed.
+        :return: true if any subscriber was sent the levels.
+        '''
+        self.__latest_levels[device] = (msg, frame, time.time())
         clients = self.__levels_client.get(device, None)
         if clients:
-            return self.__send_to_all(clients, msg)
+            subscriptions = self.__levels_subscriptions.get(device, {})
+            binary_clients = {c for c, sub in subscriptions.items() if sub.binary}
+            packed = frame() if binary_clients else None
+            if packed is None:
+                text_clients = clients
+            else:
+                text_clients = [c for c in clients if c not in binary_clients]
+            sent = False
+            if packed is not None:
+                logger.debug('Broadcasting %d byte levels frame for %s', len(packed), device)
+                sent = self.__send_to_all([c for c in clients if c in binary_clients], packed, levels_device=device)
+            if text_clients:
+                text = msg()
+                logger.debug('Broadcasting levels %s', text)
+                sent = self.__send_to_all(text_clients, text, levels_device=device) or sent
+            return sent
         else:
             return False
 
+    def __send_latest_levels(self, device: str, client: WsProtocol):
+        latest = self.__latest_levels.get(device, None)
+        if latest and time.time() - latest[2] <= LATEST_LEVELS_MAX_AGE:
+            msg, frame, _ = latest
+            sub = self.__levels_subscriptions[device][client]
+            packed = frame() if sub.binary else None
+            self.__send_to_all([client], packed if packed is not None else msg(), levels_device=device)
+
     def has_levels_client(self, device: str):
         return len(self.__levels_client.get(device, [])) > 0
 
+    def levels_fps(self, device: str) -> float | None:
+        clients = self.__levels_client.get(device, None)
+        if not clients:
+            return None
+        subscriptions = self.__levels_subscriptions.get(device, {})
+        return max(subscriptions[c].fps if c in subscriptions else math.inf for c in clients)
+
 
 T = TypeVar('T', bound=WsServerFactory)
 
@@ -202,6 +627,8 @@ class WsServer(abc.ABC, Generic[T]):
 
     def __init__(self, factory: T):
         self.__factory = factory
+        self.__lock = threading.Lock()
+        self.__last_state: dict[str, str] = {}
 
     @property
     def factory(self) -> T:
@@ -210,17 +637,52 @@ class WsServer(abc.ABC, Generic[T]):
     def broadcast(self, msg: str):
         self.factory.broadcast(msg)
 
+    def broadcast_state(self, device: str, state: dict) -> bool:
+        '''
+        Broadcasts the device state unless it is identical to the state last broadcast for that device.
+        :param device: the device name.
+        :param state: the serialised state.
+        :return: true if the state was broadcast.
+        '''
+        msg = json.dumps({'message': 'DeviceState', 'data': state}, ensure_ascii=False)
+        # the state is sent while holding the lock so clients receive states, and patches against them, in the order
+        # they were recorded
+        with self.__lock:
+            previous = self.__last_state.get(device)
+            if previous == msg:
+                STATE_BROADCASTS.labels('suppressed').inc()
+                return False
+            self.__last_state[device] = msg
+
+            def patch() -> str | None:
+                if previous is None:
+                    return None
+                ops = make_json_patch(json.loads(previous)['data'], state)
+                return json.dumps({'message': 'DeviceStatePatch', 'data': {'name': device, 'patch': ops}},
+                                  ensure_ascii=False)
+
+            STATE_BROADCASTS.labels('sent').inc()
+            self.factory.broadcast_state(device, msg, patch)
+            return True
+
     def broadcast_error(self, msg: str, persistent: bool = False):
         self.broadcast(json.dumps({'message': 'Error', 'data': msg, 'persistent': persistent}))
 
     def levels(self, device: str, levels: dict) -> bool:
-        return self.factory.send_levels(device, json.dumps({'message': 'Levels', 'data': levels}))
+        return self.factory.send_levels(device,
+                                        functools.cache(lambda: json.dumps({'message': 'Levels', 'data': levels})),
+                                        functools.cache(lambda: pack_levels(levels)))
 
     def has_levels_client(self, device: str) -> bool:
         return self.factory.has_levels_client(device)
 
+    def levels_fps(self, device: str) -> float | None:
+        return self.factory.levels_fps(device)
+
 
 class AutobahnWsServer(WsServer[AutobahnWsServerFactory]):
 
-    def __init__(self):
+    def __init__(self, compress: bool = False, compress_threshold: int = 1024, compress_mem_level: int = 8):
         super().__init__(AutobahnWsServerFactory())
+        if compress:
+            self.factory.enable_compression(compress_threshold, compress_mem_level)
@@ -15,7 +15,7 @@ from twisted.internet.protocol import ReconnectingClientFactory
 
 from ezbeq.apis.ws import WsServer
 from ezbeq.catalogue import CatalogueEntry, CatalogueProvider
-from ezbeq.device import DeviceState, PersistentDevice, SlotState
+from ezbeq.device import DeviceState, LevelsSampler, PersistentDevice, SlotState
 
 BEQ_FILTER_NAME_PATTERN = r"^BEQ_(Gain_\d+|\d+(?:_([a-zA-Z0-9]+))?)$"
 
@@ -84,6 +84,8 @@ class CamillaDsp(PersistentDevice[CamillaDspState]):
         self.__beq_channels: list[int] = [int(c) for c in cfg.get("channels", [])]
         self.__current_config: dict = {}
         self.__levels_interval_ms = round(1000.0 / float(cfg.get("levelsFps", 10)))
+        self.__levels_sampler = LevelsSampler(name, ws_server, self.request_levels, float(cfg.get("levelsFps", 10)))
+        self._keep_levels_history(cfg)
         self.__config_updater: UpdateConfig | None = None
         if not self.__beq_channels:
             raise ValueError(f'No channels supplied for CamillaDSP {name} - {self.__ip}:{self.__port}')
@@ -126,17 +128,7 @@ class CamillaDsp(PersistentDevice[CamillaDspState]):
         self._hydrate_cache_broadcast(upd)
 
     def start_broadcast_levels(self) -> None:
-        from twisted.internet import reactor
-
-        def sched():
-            return reactor.callLater(self.__levels_interval_ms / 1000.0, __send)
-
-        def __send():
-            self.request_levels()
-            if self.ws_server.has_levels_client(self.name):
-                sched()
-
-        sched()
+        self.__levels_sampler.start()
 
     def _load_initial_state(self) -> CamillaDspState:
         return CamillaDspState(self.name)
@@ -454,7 +446,9 @@ class CamillaDsp(PersistentDevice[CamillaDspState]):
             self.__playback_rms = [
                 v if not math.isclose(v, -1000.0) else -144.0 for v in msg["value"]
             ]
-            self.ws_server.levels(self.name, self.levels())
+            levels = self.levels()
+            self._record_levels(levels)
+            self.ws_server.levels(self.name, levels)
 
     def on_get_playback_peak(self, msg):
         if msg["result"] == "Ok":
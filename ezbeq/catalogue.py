@@ -9,13 +9,17 @@ from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import UTC, datetime, timedelta
 from threading import Thread
+from typing import Any
 
 import ijson
 import requests
+from prometheus_client import Counter, Histogram
 
 from ezbeq import to_millis
 from ezbeq.apis.ws import WsServer
 from ezbeq.config import Config
+from ezbeq.iir import FILTER_TYPES, design_biquads, format_designed_biquads
+from ezbeq.pools import WORKER_POOLS
 
 logger = logging.getLogger('ezbeq.catalogue')
 
@@ -118,32 +122,57 @@ META_FIELDS = [
 FIELDS_STR = ','.join(FIELDS)
 UI_FIELDS_STR = ','.join(UI_FIELDS)
 
+# sqlite calls the progress handler every N virtual machine instructions so steps are counted in these units
+VM_STEP_GRANULARITY = 100
+
+QUERY_SECONDS = Histogram('ezbeq_catalogue_query_seconds', 'Catalogue query latency by query shape', ['shape'],
+                          buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+QUERY_ROWS = Histogram('ezbeq_catalogue_query_rows', 'Rows returned by catalogue queries by query shape', ['shape'],
+                       buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000))
+QUERY_VM_STEPS = Histogram('ezbeq_catalogue_query_vm_steps',
+                           'SQLite virtual machine steps executed by catalogue queries by query shape', ['shape'],
+                           buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9))
+SLOW_QUERIES = Counter('ezbeq_catalogue_slow_queries', 'Catalogue queries exceeding the slow query threshold',
+                       ['shape'])
+FULL_SCANS = Counter('ezbeq_catalogue_full_scans', 'Slow catalogue queries whose plan includes a full table scan',
+                     ['shape'])
+
+
+def split_list(v) -> list:
+    """
+    :param v: a list field as stored in the db, i.e. |a|b|, or already a list.
+    :return: the values.
+    """
+    if isinstance(v, str):
+        return [x for x in v[1:-1].split('|') if x] if v else []
+    return v if v else []
+
 
 class CatalogueEntry:
+    """
+    A catalogue entry used to load filters into a device. Filters, list fields, the formatted title and freshness are
+    decoded on first access as most consumers only need the filters, title and mv_adjust.
+    """
+
+    __slots__ = ('_audio_channel_counts', '_audio_codecs', '_audio_types', '_filters', '_formatted_title', '_freshness',
+                 '_genres', '_images', '_warning', 'alt_title', 'author', 'avs_url', 'catalogue_url', 'collection_id',
+                 'collection_name', 'content_type', 'created_at', 'digest', 'edition', 'episodes', 'id', 'language',
+                 'mv_adjust', 'note', 'overview', 'rating', 'runtime', 'season', 'sort_title', 'source', 'the_movie_db',
+                 'title', 'updated_at', 'year')
 
     def __init__(self, idx: str, vals: dict):
         self.id = idx
         self.title = vals.get(TITLE, '')
-        y = 0
-        try:
-            y = int(vals.get(YEAR, 0))
-        except ValueError:
-            logger.error(f"Invalid year {vals.get(YEAR, 0)} in {self.title}")
-        self.year = y
-
-        def split_list(v):
-            return v[1:-1].split('|') if isinstance(v, str) else v
-
-        self.audio_types = split_list(vals.get(AUDIO_TYPES, []))
-        self.audio_codecs = split_list(vals.get(AUDIO_CODECS, []))
-        self.audio_channel_counts = split_list(vals.get(AUDIO_CHANNEL_COUNTS, []))
+        self.year = self.__to_int(vals.get(YEAR, 0), YEAR)
+        self._audio_types = vals.get(AUDIO_TYPES, None)
+        self._audio_codecs = vals.get(AUDIO_CODECS, None)
+        self._audio_channel_counts = vals.get(AUDIO_CHANNEL_COUNTS, None)
         self.content_type = vals.get(CONTENT_TYPE, 'film')
         self.author = vals.get(AUTHOR, '')
         self.catalogue_url = vals.get(CATALOGUE_URL, '')
-        f = vals.get(FILTERS, [])
-        self.filters = json.loads(f) if isinstance(f, str) else f
-        self.images = split_list(vals.get(IMAGES, []))
-        self.warning = split_list(vals.get(WARNING, []))
+        self._filters = vals.get(FILTERS, None)
+        self._images = vals.get(IMAGES, None)
+        self._warning = vals.get(WARNING, None)
         self.season = vals.get(SEASON, '')
         self.episodes = vals.get(EPISODE, '')
         self.avs_url = vals.get(AVS_URL, '')
@@ -155,7 +184,7 @@ class CatalogueEntry:
         self.overview = vals.get(OVERVIEW, '')
         self.the_movie_db = vals.get(THE_MOVIE_DB, '')
         self.rating = vals.get(RATING, '')
-        self.genres = split_list(vals.get(GENRES, []))
+        self._genres = vals.get(GENRES, None)
         self.alt_title = vals.get(ALT_TITLE, '')
         self.created_at = vals.get(CREATED_AT, 0)
         self.updated_at = vals.get(UPDATED_AT, 0)
@@ -170,21 +199,106 @@ class CatalogueEntry:
         else:
             self.collection_id = None
             self.collection_name = None
-        self.formatted_title = self.__format_title()
+        self.runtime = self.__to_int(vals.get(RUNTIME, 0), RUNTIME)
+        self.mv_adjust = self.__to_mv_adjust(vals.get(MV_ADJUST, None))
+        self._formatted_title = None
+        self._freshness = None
+
+    @classmethod
+    def from_row(cls, row: tuple) -> 'CatalogueEntry':
+        """
+        Creates an entry from a catalogue_entry row selected in FIELDS order, values are taken as is and only decoded
+        on access.
+        """
+        e = cls.__new__(cls)
+        (e.id, e.title, e.year, e._audio_types, e.content_type, e.author, e.catalogue_url, e._filters, e._images,
+         e._warning, e.season, e.episodes, e.avs_url, e.sort_title, e.edition, e.note, e.language, e.source, e.overview,
+         e.the_movie_db, e.rating, e._genres, e.alt_title, e.created_at, e.updated_at, e.digest, e.collection_id,
+         e.collection_name, e.runtime, e.mv_adjust, e._formatted_title, e._audio_codecs,
+         e._audio_channel_counts) = row
+        e.title = e.title or ''
+        e.year = e.year or 0
+        e.content_type = e.content_type or 'film'
+        for a in ('author', 'catalogue_url', 'season', 'episodes', 'avs_url', 'sort_title', 'edition', 'note',
+                  'language', 'source', 'overview', 'the_movie_db', 'rating', 'alt_title', 'digest'):
+            if getattr(e, a) is None:
+                setattr(e, a, '')
+        e.created_at = e.created_at or 0
+        e.updated_at = e.updated_at or 0
+        if not e.collection_name:
+            e.collection_id = None
+            e.collection_name = None
+        e.runtime = e.runtime or 0
+        e.mv_adjust = e.mv_adjust or 0.0
+        e._freshness = None
+        return e
+
+    def __to_int(self, v, field: str) -> int:
         try:
-            r = int(vals.get(RUNTIME, 0))
-        except ValueError:
-            logger.error(f"Invalid runtime {vals.get('runtime', 0)} in {self.title}")
-            r = 0
-        self.runtime = r
-        self.mv_adjust = 0.0
-        if 'mv' in vals:
-            v = vals['mv']
-            try:
-                self.mv_adjust = float(v)
-            except (ValueError, TypeError):
-                logger.error(f"Unknown mv_adjust value in {self.title} - {vals['mv']}")
-        self.freshness = compute_freshness(self.created_at, self.updated_at)
+            return int(v)
+        except (ValueError, TypeError):
+            logger.error(f"Invalid {field} {v} in {self.title}")
+            return 0
+
+    def __to_mv_adjust(self, v) -> float:
+        if v is None:
+            return 0.0
+        try:
+            return float(v)
+        except (ValueError, TypeError):
+            logger.error(f"Unknown mv_adjust value in {self.title} - {v}")
+            return 0.0
+
+    @property
+    def filters(self) -> list:
+        f = self._filters
+        if isinstance(f, str):
+            f = self._filters = json.loads(f) if f else []
+        elif f is None:
+            f = self._filters = []
+        return f
+
+    @property
+    def audio_types(self) -> list[str]:
+        v = self._audio_types = split_list(self._audio_types)
+        return v
+
+    @property
+    def audio_codecs(self) -> list[str]:
+        v = self._audio_codecs = split_list(self._audio_codecs)
+        return v
+
+    @property
+    def audio_channel_counts(self) -> list[str]:
+        v = self._audio_channel_counts = split_list(self._audio_channel_counts)
+        return v
+
+    @property
+    def images(self) -> list[str]:
+        v = self._images = split_list(self._images)
+        return v
+
+    @property
+    def warning(self) -> list[str]:
+        v = self._warning = split_list(self._warning)
+        return v
+
+    @property
+    def genres(self) -> list[str]:
+        v = self._genres = split_list(self._genres)
+        return v
+
+    @property
+    def formatted_title(self) -> str:
+        if self._formatted_title is None:
+            self._formatted_title = self.__format_title()
+        return self._formatted_title
+
+    @property
+    def freshness(self) -> 'Freshness':
+        if self._freshness is None:
+            self._freshness = compute_freshness(self.created_at, self.updated_at)
+        return self._freshness
 
     @staticmethod
     def __format_episodes(formatted, working):
@@ -242,7 +356,7 @@ class CatalogueEntry:
             self.content_type,  # 5
             self.author,
             self.catalogue_url,
-            json.dumps(self.filters),  # json
+            self._filters if isinstance(self._filters, str) else json.dumps(self.filters),  # json
             format_list(self.images),
             format_list(self.warning),  # 10
             self.season,
@@ -300,12 +414,15 @@ class Catalogue:
 
 class Catalogues:
     def __init__(self, config_path: str, catalogue_url: str, ws: WsServer, refresh_seconds: float,
-                 first_chunk_size: int, chunk_size: int, sync_load: bool, mmap_mb: int = 0):
+                 first_chunk_size: int, chunk_size: int, sync_load: bool, mmap_mb: int = 0,
+                 slow_query_millis: float = 0, sample_rates: list[int] | None = None):
         self.__catalogue_url = catalogue_url
         self.__version_file = os.path.join(config_path, 'version.txt')
         self.__catalogue_file = os.path.join(config_path, 'database.json')
         self.__db = os.path.join(config_path, 'ezbeq.db')
         self.__mmap_mb = mmap_mb
+        self.__slow_query_millis = slow_query_millis
+        self.__sample_rates = tuple(sample_rates) if sample_rates else ()
         self.__chunk_sizes = (first_chunk_size, chunk_size)
         logger.info(f'[{self.__db}] Using database')
         self.__ensure_db()
@@ -349,34 +466,44 @@ class Catalogues:
             self.__prune_pool = pool
         return self.__prune_pool
 
-    def __send_chunked_catalogue(self, sender: Callable[[str], None]):
+    def __send_chunked_catalogue(self, sender: Callable[[str], Any]):
         catalogue = self.latest
         if not catalogue:
             return
-        vals = {'count': catalogue.count, 'limit': self.__chunk_sizes[0], 'offset': 0, 'start': time.time()}
-        from twisted.internet import threads
-        threads.deferToThread(lambda: self.__load_next_chunk(sender, catalogue.version, **vals)).addCallback(sender)
+        self.__send_next_chunk(sender, catalogue.version, catalogue.count, self.__chunk_sizes[0], 0, time.time())
 
-    def __load_next_chunk(self, publisher: Callable[[str], None], version: str, count: int = 100, limit: int = 500,
-                          offset: int = 0, start: float = 0) -> str | None:
+    def __send_next_chunk(self, publisher: Callable[[str], Any], version: str, count: int, limit: int, offset: int,
+                          start: float):
+        '''
+        Loads the next chunk off the reactor thread and publishes it, the chunk after is not loaded until the Deferred
+        returned by the publisher (if any) has fired so a slow client is not sent chunks faster than it can take them.
+        '''
         if offset >= count:
             logger.info(f'[{version}] Load complete in {to_millis(start, time.time())}ms')
-            return None
-        else:
+            return
+
+        def load() -> str:
             begin = time.time()
-            next_offset = offset + limit
-            select = f"SELECT {UI_FIELDS_STR} FROM catalogue_entry WHERE version = '{version}'"
-            msg = json.dumps({
-                'message': 'CatalogueEntries',
-                'data': self.__fetch_entries(select, UI_FIELDS, limit, offset)
-            }, ensure_ascii=False)
-            end = time.time()
-            logger.debug(f'Loaded chunk from {offset} to {next_offset} in {to_millis(begin, end)}ms')
-            vals = {'count': count, 'limit': self.__chunk_sizes[1], 'offset': next_offset, 'start': start}
-            from twisted.internet import threads
-            threads.deferToThread(lambda: self.__load_next_chunk(publisher, version, **vals)).addCallback(publisher)
+            msg = self.__load_chunk(version, limit, offset)
+            logger.debug(f'Loaded chunk from {offset} to {offset + limit} in {to_millis(begin, time.time())}ms')
             return msg
 
+        def publish(msg: str):
+            d = defer.maybeDeferred(publisher, msg)
+            d.addCallback(lambda _: self.__send_next_chunk(publisher, version, count, self.__chunk_sizes[1],
+                                                           offset + limit, start))
+            d.addErrback(lambda f: logger.warning(f'[{version}] Load abandoned at {offset}: {f.getErrorMessage()}'))
+
+        from twisted.internet import defer
+        WORKER_POOLS['catalogue-io'].run(load).addCallback(publish)
+
+    def __load_chunk(self, version: str, limit: int, offset: int) -> str:
+        select = f"SELECT {UI_FIELDS_STR} FROM catalogue_entry WHERE version = '{version}'"
+        return json.dumps({
+            'message': 'CatalogueEntries',
+            'data': self.__fetch_entries('chunk', select, UI_FIELDS, limit, offset)
+        }, ensure_ascii=False)
+
     def __ensure_db(self):
         def add_column(column_name: str):
             try:
@@ -487,8 +614,13 @@ class Catalogues:
             s2 = time.time()
             logger.info(f'[{self.__db} / {version}] Inserted {len(v)} (of {c}) entries in {to_millis(s1, s2)}ms')
 
+        def flush(pending: list[CatalogueEntry], c: int, sql: str):
+            if self.__sample_rates:
+                add_biquads([f for e in pending for f in e.filters], self.__sample_rates)
+            insert_commit([e.values + extra_vals for e in pending], c, sql)
+
         with open(self.__catalogue_file, 'rb') as infile, db_ops(self.__db) as cur:
-            values = []
+            entries: list[CatalogueEntry] = []
             count = 0
             insert_sql = f"INSERT INTO catalogue_entry({FIELDS_STR},version,loaded_at) VALUES({', '.join(['?'] * (len(FIELDS) + 2))})"
             start = time.time()
@@ -506,16 +638,17 @@ class Catalogues:
                     languages.add(entry.language)
                 if entry.year:
                     years.add(entry.year)
-                values.append(entry.values + extra_vals)
-                if len(values) % 1000 == 0 and not meta_only:
-                    t2 = time.time()
-                    logger.info(
-                        f'[{self.__db} / {version}] Parsed {len(v)} (of {c}) entries in {to_millis(t1, t2)}ms')
-                    insert_commit(values, count, insert_sql)
-                    values = []
-                    t1 = time.time()
-            if values and not meta_only:
-                insert_commit(values, count, insert_sql)
+                if not meta_only:
+                    entries.append(entry)
+                    if len(entries) == 1000:
+                        t2 = time.time()
+                        logger.info(
+                            f'[{self.__db} / {version}] Parsed {len(entries)} (of {count}) entries in {to_millis(t1, t2)}ms')
+                        flush(entries, count, insert_sql)
+                        entries = []
+                        t1 = time.time()
+            if entries:
+                flush(entries, count, insert_sql)
             if not meta_only:
                 logger.info(
                     f'[{self.__db} / {version}] Inserted {count} entries in {to_millis(start, time.time())}ms')
@@ -580,8 +713,7 @@ class Catalogues:
             return
         logger.info(f'Triggering reload check, {since_last:.3g}s since last check')
         self.__last_refresh_check = now
-        from twisted.internet import reactor
-        reactor.callInThread(self.__do_reload)
+        WORKER_POOLS['background'].call_in_thread(self.__do_reload)
 
     def __do_reload(self):
         prefix = 'Rel' if self.loaded else 'L'
@@ -594,8 +726,7 @@ class Catalogues:
                     if c:
                         self.__on_catalogue_update(c)
 
-                from twisted.internet import threads
-                threads.deferToThread(lambda: self.__insert_catalogue(version)).addCallback(on_cat)
+                WORKER_POOLS['catalogue-io'].run(self.__insert_catalogue, version).addCallback(on_cat)
             else:
                 raise ValueError(f"No catalogue available at {self.__catalogue_file}")
         else:
@@ -653,21 +784,21 @@ class Catalogues:
                 logger.exception("Failed to refresh catalogue")
 
     def find_by_id(self, entry_id: str, as_dict: bool = False) -> CatalogueEntry | dict | None:
-        return self.__find(f"{ID} = '{entry_id}'", as_dict)
+        return self.__find('find_by_id', f"{ID} = '{entry_id}'", as_dict)
 
     def find_by_digest(self, digest: str, as_dict: bool = False) -> CatalogueEntry | dict | None:
-        return self.__find(f"{DIGEST} = '{digest}'", as_dict)
+        return self.__find('find_by_digest', f"{DIGEST} = '{digest}'", as_dict)
 
-    def __find(self, clause: str, as_dict: bool) -> CatalogueEntry | dict | None:
+    def __find(self, shape: str, clause: str, as_dict: bool) -> CatalogueEntry | dict | None:
         catalogue = self.latest
         if not catalogue:
             return None
         sql = f"SELECT {FIELDS_STR} FROM catalogue_entry WHERE {clause}"
-        results = self.__fetch_entries(sql, FIELDS, 1)
-        if results:
-            return results[0] if as_dict else CatalogueEntry(results[0][ID], results[0])
-        else:
-            return None
+        if as_dict:
+            results = self.__fetch_entries(shape, sql, FIELDS, 1)
+            return results[0] if results else None
+        rows = self.__fetch_rows(shape, sql, 1)
+        return CatalogueEntry.from_row(rows[0]) if rows else None
 
     def whats_new(self, since: int, limit: int = 50) -> list[dict]:
         # Queried the same way as search()/find() rather than kept in memory - the
@@ -685,7 +816,7 @@ class Catalogues:
             f"AND ({CREATED_AT} >= {since} OR {UPDATED_AT} >= {since}) "
             f"ORDER BY MAX({CREATED_AT}, {UPDATED_AT}) DESC"
         )
-        return self.__fetch_entries(sql, fields, limit)
+        return self.__fetch_entries('whats_new', sql, fields, limit)
 
     def search(self, authors: list[str], years: list[int], audio_types: list[str], content_types: list[str],
                tmdb_id: str, text: str | None, audio_codecs: list[str], audio_channel_counts: list[str],
@@ -738,15 +869,21 @@ class Catalogues:
         if audio_channel_counts:
             sql = f'{sql} {list_clause(audio_channel_counts, AUDIO_CHANNEL_COUNTS)}'
 
-        return self.__fetch_entries(sql, fields, limit)
-
-    def __fetch_entries(self, select: str, fields: list[str], limit: int | None, offset: int | None = None) -> \
-            list[dict]:
-        if limit:
-            select = f'{select} LIMIT {limit}'
-        if offset:
-            select = f'{select} OFFSET {offset}'
+        facets = {
+            'author': authors,
+            'year': years,
+            'audio_type': audio_types,
+            'content_type': content_types,
+            'tmdb_id': tmdb_id,
+            'text': text,
+            'audio_codec': audio_codecs,
+            'audio_channel_count': audio_channel_counts
+        }
+        shape = f"search:{'+'.join(k for k, v in facets.items() if v) or 'all'}"
+        return self.__fetch_entries(shape, sql, fields, limit)
 
+    def __fetch_entries(self, shape: str, select: str, fields: list[str], limit: int | None,
+                        offset: int | None = None) -> list[dict]:
         def reformat(i, v):
             f = fields[i]
             if f in LIST_FIELDS:
@@ -756,34 +893,95 @@ class Catalogues:
             else:
                 return v if v is not None else ''
 
+        rows = self.__fetch_rows(shape, select, limit, offset)
+        before = time.time()
+        entries: list[dict] = []
+        for row in rows:
+            vals = {k: v for k, v in {fields[i]: reformat(i, r) for i, r in enumerate(row)}.items() if v}
+            if UPDATED_AT in vals and CREATED_AT in vals:
+                vals[FRESHNESS] = compute_freshness(vals[CREATED_AT], vals[UPDATED_AT])
+            else:
+                vals[FRESHNESS] = 'Unknown'
+            # compatibility hacks
+            if CONTENT_TYPE in vals:
+                vals['contentType'] = vals[CONTENT_TYPE]
+            if MV_ADJUST in vals:
+                vals['mvAdjust'] = vals[MV_ADJUST]
+            entries.append(vals)
+        after = time.time()
+        logger.debug(f'Parsed {len(entries)} entries from db in {to_millis(before, after)} ms')
+        return entries
+
+    def __fetch_rows(self, shape: str, select: str, limit: int | None, offset: int | None = None) -> list[tuple]:
+        if limit:
+            select = f'{select} LIMIT {limit}'
+        if offset:
+            select = f'{select} OFFSET {offset}'
+
         with db_ops(self.__db, mmap_size=self.__mmap_mb * 1024 * 1024) as cur:
             before = time.time()
             logger.debug(f'>>> {select}')
-            entries: list[dict] = []
+            steps = 0
+
+            def count_steps():
+                nonlocal steps
+                steps += 1
+
+            cur.connection.set_progress_handler(count_steps, VM_STEP_GRANULARITY)
             res = cur.execute(select)
             rows = res.fetchmany(size=limit if limit else 20000)
+            cur.connection.set_progress_handler(None, VM_STEP_GRANULARITY)
             after_load = time.time()
             logger.debug(f'Loaded {len(rows)} entries from db in {to_millis(before, after_load)} ms')
-            for row in rows:
-                vals = {k: v for k, v in {fields[i]: reformat(i, r) for i, r in enumerate(row)}.items() if v}
-                if UPDATED_AT in vals and CREATED_AT in vals:
-                    vals[FRESHNESS] = compute_freshness(vals[CREATED_AT], vals[UPDATED_AT])
-                else:
-                    vals[FRESHNESS] = 'Unknown'
-                # compatibility hacks
-                if CONTENT_TYPE in vals:
-                    vals['contentType'] = vals[CONTENT_TYPE]
-                if MV_ADJUST in vals:
-                    vals['mvAdjust'] = vals[MV_ADJUST]
-                entries.append(vals)
-            after = time.time()
-            logger.debug(f'Parsed {len(entries)} entries from db in {to_millis(after_load, after)} ms, total time {to_millis(before, after)} ms')
-            return entries
+            self.__record_query(cur, shape, select, after_load - before, len(rows), steps * VM_STEP_GRANULARITY)
+            return rows
+
+    def __record_query(self, cur: sqlite3.Cursor, shape: str, select: str, elapsed: float, rows: int, steps: int):
+        QUERY_SECONDS.labels(shape).observe(elapsed)
+        QUERY_ROWS.labels(shape).observe(rows)
+        QUERY_VM_STEPS.labels(shape).observe(steps)
+        if self.__slow_query_millis and elapsed * 1000 >= self.__slow_query_millis:
+            SLOW_QUERIES.labels(shape).inc()
+            plan = [row[-1] for row in cur.execute(f'EXPLAIN QUERY PLAN {select}').fetchall()]
+            if is_full_scan(plan):
+                FULL_SCANS.labels(shape).inc()
+            logger.warning(f'[{shape}] Slow query took {round(elapsed * 1000, 1)}ms, returned {rows} rows in ~{steps} '
+                           f'steps, plan: {" / ".join(plan)} sql: {select}')
+
+
+def is_full_scan(plan: list[str]) -> bool:
+    """
+    :param plan: the detail column of each row of EXPLAIN QUERY PLAN.
+    :return: true if any step in the plan scans the entire catalogue_entry table.
+    """
+    return any(p.startswith('SCAN catalogue_entry') and 'INDEX' not in p for p in plan)
+
+
+def add_biquads(filters: list[dict], sample_rates: tuple[int, ...]):
+    """
+    Adds coefficients for each sample rate to the filters if the catalogue does not already provide them so a filter
+    load can use them as is. All filters are designed in a single pass.
+    """
+    valid = []
+    for f in filters:
+        try:
+            if f['type'] in FILTER_TYPES:
+                valid.append((f, float(f['freq']), float(f['q']), float(f['gain'])))
+        except (KeyError, ValueError, TypeError):
+            continue
+    for fs in sample_rates:
+        key = str(fs)
+        todo = [v for v in valid if key not in v[0].setdefault('biquads', {})]
+        if todo:
+            a, b = design_biquads([v[0]['type'] for v in todo], [v[1] for v in todo], [v[2] for v in todo],
+                                  [v[3] for v in todo], [fs])
+            for v, bq in zip(todo, format_designed_biquads(a, b)[0], strict=True):
+                v[0]['biquads'][key] = {'b': list(bq[:3]), 'a': list(bq[3:])}
 
 
 class CatalogueProvider:
 
-    def __init__(self, config: Config, ws: WsServer):
+    def __init__(self, config: Config, ws: WsServer, sample_rates: list[int] | None = None):
         self.__catalogues: Catalogues = Catalogues(config.config_path,
                                                    config.beqcatalogue_url,
                                                    ws,
@@ -791,7 +989,9 @@ class CatalogueProvider:
                                                    config.first_chunk_size,
                                                    config.chunk_size,
                                                    config.load_catalogue_at_startup,
-                                                   config.db_mmap_mb)
+                                                   config.db_mmap_mb,
+                                                   config.slow_query_millis,
+                                                   sample_rates)
 
     def find(self, entry_id: str, match_on_idx: bool | None = None, as_dict: bool = False) -> (
                                                                                                   CatalogueEntry | dict) | None:
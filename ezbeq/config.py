@@ -8,6 +8,18 @@ import yaml
 
 MIN_SUPPORTED_PYTHON = (3, 11)  # keep in sync with pyproject.toml's `requires-python`
 
+# default max threads for each named worker pool, see ezbeq.pools
+THREAD_POOL_SIZES = {
+    # WSGI requests, i.e. every api call not served by the native api
+    'http': 10,
+    # catalogue ingest and the catalogue queries behind search and streaming the catalogue to the UI
+    'catalogue-io': 2,
+    # blocking device reads
+    'device-io': 4,
+    # catalogue downloads and update checks
+    'background': 2,
+}
+
 
 class Config:
 
@@ -329,6 +341,97 @@ class Config:
             self.logger.exception('Unable to get total physical memory, will default to 0')
         return self.config.get('db_mmap_mb', mmap_mb)
 
+    @property
+    def response_cache_size(self) -> int:
+        """
+        :return: the number of frequency responses to cache, defaults to 256.
+        """
+        return max(self.config.get('responseCacheSize', 256), 1)
+
+    @property
+    def slow_query_millis(self) -> float:
+        """
+        :return: catalogue queries slower than this are logged with their query plan, 0 disables, defaults to 250ms.
+        """
+        return self.config.get('slowQueryMillis', 250)
+
+    @property
+    def device_state_timeout(self) -> float:
+        """
+        :return: how long to wait, in seconds, for all devices to report their state before returning the last known
+        state of any that have not responded, defaults to 10s.
+        """
+        return self.config.get('deviceStateTimeout', 10.0)
+
+    @property
+    def device_state_max_age(self) -> float:
+        """
+        :return: how long, in seconds, a device state read can be reused for before the device is read again, defaults
+        to 2s.
+        """
+        return self.config.get('deviceStateMaxAge', 2.0)
+
+    @property
+    def device_state_stale_while_revalidate(self) -> float:
+        """
+        :return: how long, in seconds, after deviceStateMaxAge an old device state read can be returned while the device
+        is read again in the background, defaults to 30s.
+        """
+        return self.config.get('deviceStateStaleWhileRevalidate', 30.0)
+
+    @property
+    def state_persist_delay(self) -> float:
+        """
+        :return: how long, in seconds, device state changes are held before being written to disk so that a burst of
+        changes results in a single write, 0 writes immediately, defaults to 1s.
+        """
+        return self.config.get('statePersistDelay', 1.0)
+
+    @property
+    def ws_compress(self) -> bool:
+        """
+        :return: true if websocket clients may negotiate permessage-deflate compression.
+        """
+        return self.config.get('wsCompress', True)
+
+    @property
+    def ws_compress_threshold(self) -> int:
+        """
+        :return: the size, in bytes, below which websocket messages are sent uncompressed, defaults to 1024.
+        """
+        return self.config.get('wsCompressThreshold', 1024)
+
+    @property
+    def ws_compress_mem_level(self) -> int:
+        """
+        :return: the zlib memLevel (1-9) used for websocket compression, lower values use less memory per client,
+        defaults to 8.
+        """
+        return self.config.get('wsCompressMemLevel', 8)
+
+    @property
+    def native_api(self) -> bool:
+        """
+        :return: true if the hot read endpoints (device state, search, catalogue meta and levels) are served directly
+        by twisted rather than via the WSGI app.
+        """
+        return self.config.get('nativeApi', True)
+
+    @property
+    def thread_pool_sizes(self) -> dict[str, int]:
+        """
+        :return: the max number of threads in each named pool.
+        """
+        return {name: self.thread_pool_size(name) for name in THREAD_POOL_SIZES}
+
+    def thread_pool_size(self, name: str) -> int:
+        """
+        :param name: the pool name.
+        :return: the max number of threads in the named pool, set via threadPools.<name>, defaults are given in
+        THREAD_POOL_SIZES.
+        """
+        return max(int((self.config.get('threadPools') or {}).get(name, THREAD_POOL_SIZES[name])), 1)
+
     @staticmethod
     def __migrate(cfg):
         changed = False
@@ -1,15 +1,173 @@
 import json
 import logging
+import math
 import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import ClassVar, Generic, TypeVar
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from typing import Any, ClassVar, Generic, TypeVar
 
+from prometheus_client import Counter, Histogram
+
+from ezbeq import to_millis
 from ezbeq.apis.ws import WsServer
 from ezbeq.catalogue import CatalogueEntry, CatalogueProvider
 from ezbeq.config import Config
+from ezbeq.levels import LevelsHistory
 
 logger = logging.getLogger('ezbeq.device')
 
+STATE_FLUSH_SECONDS = Histogram('ezbeq_device_state_flush_seconds', 'Time taken to write device state to disk',
+                                ['device'], buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0))
+STATE_WRITES_SKIPPED = Counter('ezbeq_device_state_writes_skipped',
+                               'Device state writes skipped because the state was unchanged', ['device'])
+STATE_WRITES_COALESCED = Counter('ezbeq_device_state_writes_coalesced',
+                                 'Device state writes replaced by a later write before they were flushed', ['device'])
+
+
+class StatePersister:
+    """
+    Writes device state to disk in the background. Writes to the same file within window seconds of each other are
+    coalesced so only the latest state is written, and a write is skipped if the file still holds that state.
+    """
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self.__cond = threading.Condition()
+        self.__write_lock = threading.Lock()
+        self.__pending: dict[str, tuple[str, str, float]] = {}
+        self.__written: dict[str, tuple[str, int | None]] = {}
+        self.__thread: threading.Thread | None = None
+
+    def persist(self, name: str, file_name: str, content: str) -> None:
+        if self.window <= 0:
+            with self.__write_lock:
+                self.__write(name, file_name, content)
+            return
+        with self.__cond:
+            if file_name in self.__pending:
+                STATE_WRITES_COALESCED.labels(name).inc()
+                due = self.__pending[file_name][2]
+            else:
+                due = time.monotonic() + self.window
+            self.__pending[file_name] = (name, content, due)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='state-persister', daemon=True)
+                self.__thread.start()
+            self.__cond.notify()
+
+    def flush(self, file_name: str | None = None) -> None:
+        '''
+        Writes pending state immediately.
+        :param file_name: the file to write, all pending files if not set.
+        '''
+        # the write lock is held from taking the pending state until it is written so a concurrent write of an older
+        # state cannot overwrite it
+        with self.__write_lock:
+            with self.__cond:
+                if file_name is None:
+                    ready, self.__pending = self.__pending, {}
+                else:
+                    ready = {file_name: self.__pending.pop(file_name)} if file_name in self.__pending else {}
+            for f, (name, content, _) in ready.items():
+                self.__write(name, f, content)
+
+    def __run(self) -> None:
+        while True:
+            with self.__cond:
+                while not self.__pending:
+                    self.__cond.wait()
+                now = time.monotonic()
+                due = min(v[2] for v in self.__pending.values())
+                if due > now:
+                    self.__cond.wait(due - now)
+                    continue
+            with self.__write_lock:
+                with self.__cond:
+                    now = time.monotonic()
+                    ready = {f: v for f, v in self.__pending.items() if v[2] <= now}
+                    for f in ready:
+                        del self.__pending[f]
+                for f, (name, content, _) in ready.items():
+                    try:
+                        self.__write(name, f, content)
+                    except Exception:
+                        logger.exception(f'[{name}] Failed to write state to {f}')
+
+    def __write(self, name: str, file_name: str, content: str) -> None:
+        '''
+        Writes the content to the file unless this persister wrote the same content and the file has not been changed
+        since. Must be called with the write lock held.
+        '''
+        modified_at = self.__modified_at(file_name)
+        if modified_at is not None and self.__written.get(file_name) == (content, modified_at):
+            STATE_WRITES_SKIPPED.labels(name).inc()
+            return
+        start = time.time()
+        tmp = file_name + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.replace(tmp, file_name)
+        STATE_FLUSH_SECONDS.labels(name).observe(time.time() - start)
+        self.__written[file_name] = (content, self.__modified_at(file_name))
+
+    @staticmethod
+    def __modified_at(file_name: str) -> int | None:
+        try:
+            return os.stat(file_name).st_mtime_ns
+        except OSError:
+            return None
+
+
+STATE_PERSISTER = StatePersister()
+
+
+class LevelsSampler:
+    """
+    Samples levels from a device on behalf of all of its levels subscribers. Only one sample is scheduled at any time,
+    the rate follows the fastest subscriber up to max_fps and sampling stops once the last subscriber has gone.
+    """
+
+    def __init__(self, name: str, ws_server: WsServer, sample: Callable[[], Any], max_fps: float, clock=None):
+        self.__name = name
+        self.__ws_server = ws_server
+        self.__sample = sample
+        self.__max_fps = max_fps
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__scheduled = None
+
+    @property
+    def running(self) -> bool:
+        return self.__scheduled is not None
+
+    def start(self) -> None:
+        with self.__lock:
+            if self.__scheduled is None:
+                self.__schedule()
+
+    def __schedule(self):
+        fps = self.__ws_server.levels_fps(self.__name)
+        if fps is None:
+            logger.debug(f"[{self.__name}] No levels subscribers, sampling stopped")
+            self.__scheduled = None
+        else:
+            if self.__clock is None:
+                from twisted.internet import reactor
+                self.__clock = reactor
+            self.__scheduled = self.__clock.callLater(1.0 / min(fps, self.__max_fps), self.__tick)
+
+    def __tick(self):
+        try:
+            self.__sample()
+        except Exception:
+            logger.exception(f"[{self.__name}] Unable to sample levels")
+        with self.__lock:
+            self.__schedule()
+
 
 S = TypeVar('S', bound='SlotState')
 
@@ -82,6 +240,14 @@ class Device(ABC, Generic[T]):
     SUPPORTED_OPS: ClassVar[frozenset[str]] = ALL_OPS
     FIXED_SLOT_ID: ClassVar[str | None] = None
 
+    @classmethod
+    def filter_sample_rates(cls, cfg: dict) -> frozenset[int]:
+        """
+        :param cfg: the device config.
+        :return: the sample rates at which this device needs biquad coefficients for catalogue filters, if any.
+        """
+        return frozenset()
+
     @property
     @abstractmethod
     def name(self) -> str:
@@ -136,6 +302,27 @@ class Device(ABC, Generic[T]):
     def levels(self) -> dict:
         pass
 
+    @property
+    def levels_history(self) -> LevelsHistory | None:
+        """
+        :return: the recent levels from this device, if it keeps them.
+        """
+        return None
+
+
+@dataclass
+class DeviceRead:
+    """
+    The state of a device as returned by DeviceRepository.read_all along with how long it took to read. A stale read is
+    the last known state of a device that did not respond in time.
+    """
+    state: DeviceState
+    latency_millis: float
+    stale: bool = False
+
+    def serialise(self) -> dict:
+        return self.state.serialise() | {'stale': self.stale, 'latencyMillis': self.latency_millis}
+
 
 class DeviceRepository:
 
@@ -147,6 +334,14 @@ class DeviceRepository:
         for device in self.__devices.values():
             if device.device_type == 'composite' and not device.expose_members:
                 self.__hidden.update(device.member_names)
+        self.__timeout = cfg.device_state_timeout
+        self.__max_age = cfg.device_state_max_age
+        self.__stale_while_revalidate = cfg.device_state_stale_while_revalidate
+        self.__executor = ThreadPoolExecutor(max_workers=max(len(self.__devices), 1),
+                                             thread_name_prefix='device-state')
+        self.__lock = threading.Lock()
+        self.__in_flight: dict[tuple[str, bool], Future] = {}
+        self.__last_known: dict[str, tuple[DeviceRead, float]] = {}
 
     def device_type(self, name: str) -> str:
         return self.__get_device(name).device_type
@@ -161,20 +356,80 @@ class DeviceRepository:
         return self.__get_device(name).state()
 
     def all_devices(self, refresh: bool = False) -> dict[str, DeviceState]:
-        result: dict[str, DeviceState] = {}
-        for n, d in self.__devices.items():
-            if n in self.__hidden:
+        return {n: r.state for n, r in self.read_all(refresh=refresh).items()}
+
+    def read_all(self, refresh: bool = False, max_age: float | None = None) -> dict[str, DeviceRead]:
+        """
+        Reads every visible device in parallel, all sharing a single deadline so one slow device (e.g. a minidsp cli
+        timeout or an unresponsive MCWS) does not add to the time taken to report on the others. A device that misses
+        the deadline is reported with its last known state, marked as stale, while one that fails is omitted entirely.
+
+        When refreshing, a state read within max_age seconds is reused as is. An older state read within the stale
+        while revalidate window is returned immediately, marked as stale, while the device is refreshed in the
+        background. Anything older is read from the device.
+        :param refresh: whether to refresh the state from the device.
+        :param max_age: the max age, in seconds, of a reusable state read, defaults to deviceStateMaxAge. If provided,
+        stale state reads are never returned.
+        """
+        start = time.time()
+        swr = self.__stale_while_revalidate if max_age is None else 0.0
+        max_age = self.__max_age if max_age is None else max_age
+        result: dict[str, DeviceRead] = {}
+        futures: dict[str, Future] = {}
+        with self.__lock:
+            visible = [n for n in self.__devices if n not in self.__hidden]
+            for n in visible:
+                cached = self.__last_known.get(n) if refresh else None
+                age = start - cached[1] if cached else math.inf
+                if cached and age <= max_age:
+                    result[n] = cached[0]
+                elif cached and age <= max_age + swr:
+                    result[n] = replace(cached[0], stale=True)
+                    self.__read(n, refresh)
+                else:
+                    futures[n] = self.__read(n, refresh)
+        if futures:
+            _done, not_done = wait(futures.values(), timeout=self.__timeout)
+        else:
+            not_done = set()
+        for n, fut in futures.items():
+            if fut in not_done:
+                last_known = self.__last_known.get(n)
+                logger.warning(f"State read for device '{n}' timed out after {self.__timeout}s, "
+                               f"{'returning last known state' if last_known else 'excluding it from this response'}")
+                if last_known:
+                    result[n] = DeviceRead(last_known[0].state, to_millis(start, time.time()), stale=True)
                 continue
-            try:
-                result[n] = d.state(refresh=refresh)
-            except Exception:
+            exc = fut.exception()
+            if exc is not None:
                 # A device that is unreachable (e.g. jriver with MCWS down) must not take every
                 # other device down with it - state() for a PersistentDevice retries from scratch
                 # on the next call (see PersistentDevice._hydrate), so simply omitting it here
                 # keeps this device recoverable on a later poll instead of raising and leaving
                 # every device - including healthy ones - unresolved for this call.
-                logger.exception(f"Failed to load state for device '{n}', excluding it from this response")
-        return result
+                logger.error(f"Failed to load state for device '{n}', excluding it from this response", exc_info=exc)
+                continue
+            result[n] = fut.result()
+        return {n: result[n] for n in visible if n in result}
+
+    def __read(self, name: str, refresh: bool) -> Future:
+        # a device still working on a previous read is not asked again, the caller shares the read in flight unless it
+        # wants a refresh and that read is not one
+        key = (name, refresh)
+        in_flight = self.__in_flight.get(key)
+        if in_flight is None or in_flight.done():
+            in_flight = self.__executor.submit(self.__timed_state, name, refresh)
+            self.__in_flight[key] = in_flight
+        return in_flight
+
+    def __timed_state(self, name: str, refresh: bool) -> DeviceRead:
+        start = time.time()
+        state = self.__devices[name].state(refresh=refresh)
+        end = time.time()
+        read = DeviceRead(state, to_millis(start, end))
+        with self.__lock:
+            self.__last_known[name] = (read, end)
+        return read
 
     def activate(self, name: str, slot: str) -> None:
         self.__get_device(name).activate(slot)
@@ -207,6 +462,18 @@ class DeviceRepository:
     def levels(self, device_name: str) -> dict:
         return self.__get_device(device_name).levels()
 
+    def levels_history(self, device_name: str, seconds: float | None = None, points: int | None = None) -> dict | None:
+        """
+        :param device_name: the device.
+        :param seconds: how far back to go, defaults to everything held.
+        :param points: the maximum number of points to return.
+        :return: the levels history or None if the device does not keep one.
+        """
+        history = self.__get_device(device_name).levels_history
+        if history is None:
+            return None
+        return {'name': device_name, **history.query(None if seconds is None else time.time() - seconds, points)}
+
 
 def _composite_member_names(values: dict) -> list[str]:
     members = values.get('members')
@@ -347,6 +614,17 @@ def create_devices(cfg: Config, ws_server: WsServer, catalogue: CatalogueProvide
         return [devices[name] for name in cfg.devices]
 
 
+def filter_sample_rates(cfg: Config) -> list[int]:
+    """
+    The sample rates at which biquad coefficients are precomputed when a catalogue is loaded.
+    """
+    rates: set[int] = set()
+    for values in cfg.devices.values():
+        if values['type'] != 'composite':
+            rates.update(_device_class_for_type(values['type']).filter_sample_rates(values))
+    return sorted(rates)
+
+
 class InvalidRequestError(Exception):
     pass
 
@@ -363,11 +641,28 @@ class PersistentDevice(Device, ABC, Generic[T]):
         self.__hydrated = False
         self._current_state: T | None = None
         self.__ws_server = ws_server
+        self.__levels_history: LevelsHistory | None = None
 
     @property
     def name(self) -> str:
         return self.__name
 
+    @property
+    def levels_history(self) -> LevelsHistory | None:
+        return self.__levels_history
+
+    def _keep_levels_history(self, cfg: dict) -> None:
+        """
+        Holds levelsHistory seconds (default 600, 0 to disable) of levels at levelsFps.
+        :param cfg: the device config.
+        """
+        capacity = int(float(cfg.get('levelsHistory', 600)) * float(cfg.get('levelsFps', 10)))
+        self.__levels_history = LevelsHistory(capacity) if capacity > 0 else None
+
+    def _record_levels(self, levels: dict) -> None:
+        if self.__levels_history is not None and levels:
+            self.__levels_history.append(levels['ts'], levels['levels'])
+
     def state(self, refresh: bool = False) -> T:
         self._hydrate(refresh=refresh)
         return self._current_state
@@ -375,6 +670,7 @@ class PersistentDevice(Device, ABC, Generic[T]):
     def _hydrate(self, refresh: bool = False) -> bool:
         if not self.__hydrated or refresh is True:
             self._current_state = self._load_initial_state()
+            STATE_PERSISTER.flush(self.__file_name)
             if os.path.exists(self.__file_name):
                 try:
                     with open(self.__file_name) as f:
@@ -401,14 +697,12 @@ class PersistentDevice(Device, ABC, Generic[T]):
 
     def _persist(self):
         assert self._current_state, 'hydrate cannot return None'
-        tmp = self.__file_name + '.tmp'
-        with open(tmp, 'w') as f:
-            json.dump(self._current_state.serialise(), f, sort_keys=True)
-        os.replace(tmp, self.__file_name)
+        STATE_PERSISTER.persist(self.name, self.__file_name, json.dumps(self._current_state.serialise(), sort_keys=True))
 
     def _broadcast(self):
         if self.ws_server:
-            self.ws_server.broadcast(self.__get_state_msg())
+            assert self._current_state, 'hydrate cannot return None'
+            self.ws_server.broadcast_state(self.name, self._current_state.serialise())
 
     def __get_state_msg(self):
         assert self._current_state, 'hydrate cannot return None'
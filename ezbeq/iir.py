@@ -2,6 +2,10 @@ import decimal
 import logging
 import math
 from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from functools import lru_cache
+
+import numpy as np
 
 ctx = decimal.Context()
 ctx.prec = 17
@@ -13,7 +17,11 @@ def float_to_str(f):
     """
     Convert the given float to a string without scientific notation or in the correct hex format.
     """
-    d1 = ctx.create_decimal(repr(f))
+    r = repr(float(f))
+    if 'e' not in r and 'n' not in r:
+        # repr is already the shortest round trip form (at most 17 significant digits) so only an exponent needs decimal
+        return r
+    d1 = ctx.create_decimal(r)
     return format(d1, 'f')
 
 
@@ -133,3 +141,129 @@ class HighShelf(Biquad):
             A * ((A + 1) + ((A - 1) * cos_w0) - (2.0 * math.sqrt(A) * alpha))
         ]
         return [a1 / a[0] for a1 in a], [b1 / a[0] for b1 in b]
+
+
+FILTER_TYPES: dict[str, type[Biquad]] = {
+    'PeakingEQ': PeakingEQ,
+    'LowShelf': LowShelf,
+    'HighShelf': HighShelf
+}
+
+
+def make_biquad(filter_type: str, fs: int, freq: float, q: float, gain: float) -> Biquad:
+    """
+    :param filter_type: the catalogue filter type.
+    :return: the biquad, raises ValueError if the type is unknown.
+    """
+    t = FILTER_TYPES.get(filter_type, None)
+    if t is None:
+        raise ValueError(f"Unknown filter type {filter_type}")
+    return t(fs, freq, q, gain)
+
+
+@lru_cache(maxsize=4096)
+def coefficients(filter_type: str, fs: int, freq: float, q: float, gain: float) -> tuple[tuple[float, ...], tuple[float, ...]]:
+    """
+    Designs the filter once per distinct set of params, catalogue filters are heavily reused across entries.
+    :return: the normalised (a, b) coefficients.
+    """
+    f = make_biquad(filter_type, fs, freq, q, gain)
+    return tuple(f.a), tuple(f.b)
+
+
+@lru_cache(maxsize=4096)
+def formatted_coefficients(filter_type: str, fs: int, freq: float, q: float, gain: float) -> tuple[str, ...]:
+    """
+    :return: b0, b1, b2, a1, a2 as strings in the same form as Biquad.format_biquads.
+    """
+    a, b = coefficients(filter_type, fs, freq, q, gain)
+    return tuple(float_to_str(x) for x in b) + tuple(float_to_str(-x) for x in a[1:])
+
+
+def design_biquads(filter_types: Sequence[str], freqs: Sequence[float], qs: Sequence[float], gains: Sequence[float],
+                   sample_rates: Sequence[int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Designs N filters at each of F sample rates in one pass using the same formulae as the Biquad subclasses.
+    :param filter_types: the type of each filter, must be a key of FILTER_TYPES.
+    :param freqs: the centre/corner frequency of each filter.
+    :param qs: the q of each filter.
+    :param gains: the gain of each filter.
+    :param sample_rates: the sample rates to design at.
+    :return: the normalised a and b coefficients, each with shape (F, N, 3).
+    """
+    unknown = {t for t in filter_types if t not in FILTER_TYPES}
+    if unknown:
+        raise ValueError(f"Unknown filter type {', '.join(sorted(unknown))}")
+    # rounded like Biquad.__init__ so results match the scalar path
+    q = np.array([round(float(x), 4) for x in qs], dtype=np.float64)
+    gain = np.array([round(float(x), 3) for x in gains], dtype=np.float64)
+    freq = np.array(freqs, dtype=np.float64)
+    fs = np.array(sample_rates, dtype=np.float64).reshape(-1, 1)
+    types = np.array(filter_types, dtype=object)
+
+    w0 = 2.0 * math.pi * freq / fs
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2.0 * q)
+    A = np.array([10.0 ** (g / 40.0) for g in gain], dtype=np.float64)
+    sqrt_a_alpha = 2.0 * np.sqrt(A) * alpha
+
+    a = np.empty((fs.shape[0], freq.shape[0], 3))
+    b = np.empty_like(a)
+    pk = types == 'PeakingEQ'
+    if pk.any():
+        a[:, pk, 0] = 1.0 + alpha[:, pk] / A[pk]
+        a[:, pk, 1] = -2.0 * cos_w0[:, pk]
+        a[:, pk, 2] = 1.0 - alpha[:, pk] / A[pk]
+        b[:, pk, 0] = 1.0 + alpha[:, pk] * A[pk]
+        b[:, pk, 1] = -2.0 * cos_w0[:, pk]
+        b[:, pk, 2] = 1.0 - alpha[:, pk] * A[pk]
+    ls = types == 'LowShelf'
+    if ls.any():
+        ap1 = A[ls] + 1
+        am1 = A[ls] - 1
+        c = cos_w0[:, ls]
+        sa = sqrt_a_alpha[:, ls]
+        a[:, ls, 0] = ap1 + (am1 * c) + sa
+        a[:, ls, 1] = -2.0 * (am1 + (ap1 * c))
+        a[:, ls, 2] = ap1 + (am1 * c) - sa
+        b[:, ls, 0] = A[ls] * (ap1 - (am1 * c) + sa)
+        b[:, ls, 1] = 2.0 * A[ls] * (am1 - (ap1 * c))
+        b[:, ls, 2] = A[ls] * (ap1 - (am1 * c) - sa)
+    hs = types == 'HighShelf'
+    if hs.any():
+        ap1 = A[hs] + 1
+        am1 = A[hs] - 1
+        c = cos_w0[:, hs]
+        sa = sqrt_a_alpha[:, hs]
+        a[:, hs, 0] = ap1 - (am1 * c) + sa
+        a[:, hs, 1] = 2.0 * (am1 - (ap1 * c))
+        a[:, hs, 2] = ap1 - (am1 * c) - sa
+        b[:, hs, 0] = A[hs] * (ap1 + (am1 * c) + sa)
+        b[:, hs, 1] = -2.0 * A[hs] * (am1 + (ap1 * c))
+        b[:, hs, 2] = A[hs] * (ap1 + (am1 * c) - sa)
+    a0 = a[:, :, :1].copy()
+    return a / a0, b / a0
+
+
+def format_designed_biquads(a: np.ndarray, b: np.ndarray) -> list[list[tuple[str, ...]]]:
+    """
+    Formats the output of design_biquads.
+    :return: per sample rate, per filter, b0, b1, b2, a1, a2 as strings in the same form as Biquad.format_biquads.
+    """
+    coeffs = np.concatenate((b, -a[:, :, 1:]), axis=2).tolist()
+    return [[tuple(float_to_str(x) for x in f) for f in per_fs] for per_fs in coeffs]
+
+
+def magnitude_response(a: np.ndarray, b: np.ndarray, freqs: np.ndarray, fs: int) -> np.ndarray:
+    """
+    Evaluates |H(e^jw)| for normalised biquads.
+    :param a: the a coefficients, shape (N, 3).
+    :param b: the b coefficients, shape (N, 3).
+    :param freqs: the frequencies to evaluate at.
+    :param fs: the sample rate the biquads were designed at.
+    :return: the magnitude response of each biquad in dB, shape (N, len(freqs)).
+    """
+    z = np.exp(-1j * 2.0 * math.pi * np.asarray(freqs, dtype=np.float64) / fs)
+    powers = np.stack((np.ones_like(z), z, z * z))
+    h = (b @ powers) / (a @ powers)
+    return 20.0 * np.log10(np.maximum(np.abs(h), 1e-12))
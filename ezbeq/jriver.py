@@ -1,7 +1,11 @@
+import hashlib
 import logging
+import threading
+import time
 import xml.etree.ElementTree as et
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from ezbeq.apis.ws import WsServer
 from ezbeq.catalogue import CatalogueEntry, CatalogueProvider
@@ -9,6 +13,8 @@ from ezbeq.device import DeviceState, PersistentDevice, SlotState
 
 logger = logging.getLogger('ezbeq.jriver')
 
+VERIFY_MODES = ('full', 'hash')
+
 JRIVER_CHANNELS = [None, None, 'L', 'R', 'C', 'SW', 'SL', 'SR', 'RL', 'RR', None, 'U1', 'U2'] + [f"C{i + 9}" for i in
                                                                                                  range(24)]
 
@@ -81,7 +87,8 @@ class JRiver(PersistentDevice[JRiverState]):
         self.__peq_block: str = get_peq_key_name(int(cfg['block']) - 1)
         if not self.__peq_block:
             raise ValueError('No peq block for jriver')
-        self.__mcws = MediaServer(address, auth, secure)
+        self.__mcws = MediaServer(address, auth, secure, verify=cfg.get('verify', 'full'),
+                                  zones_ttl=float(cfg.get('zoneCacheSeconds', 300)))
 
     def device_type(self) -> str:
         return self.__class__.__name__.lower()
@@ -413,14 +420,62 @@ def get_peq_key_name(block):
         raise ValueError(f"Unknown PEQ block {block}")
 
 
-class MediaServer:
+def dsp_wildcards(dsp) -> frozenset[tuple[int, str]]:
+    '''
+    :param dsp: the parsed DSP xml.
+    :return: the positions, as the index of the element in document order and text or tail, which hold the * wildcard.
+    '''
+    return frozenset((i, k) for i, e in enumerate(dsp.iter()) for k, v in (('text', e.text), ('tail', e.tail))
+                     if v == '*')
+
+
+def dsp_digest(dsp, wildcards: frozenset[tuple[int, str]] = frozenset()) -> str:
+    '''
+    :param dsp: the parsed DSP xml.
+    :param wildcards: positions, see dsp_wildcards, whose text is ignored as it was a wildcard in another DSP.
+    :return: a digest of the DSP which ignores the whitespace around text and the order of attributes, i.e. the
+    formatting differences between the DSP sent to MCWS and the DSP read back from it. As in a full comparison, text
+    which is the * wildcard matches anything.
+    '''
+    h = hashlib.sha1()
+
+    def text(i: int, kind: str, value: str | None) -> str:
+        return '*' if value == '*' or (i, kind) in wildcards else (value or '').strip()
 
-    def __init__(self, ip: str, auth: tuple[str, str] | None = None, secure: bool = False):
+    for i, e in enumerate(dsp.iter()):
+        h.update(e.tag.encode())
+        for name, value in sorted(e.attrib.items()):
+            h.update(f"\0{name}={value}".encode())
+        h.update(f"\0{text(i, 'text', e.text)}\0{text(i, 'tail', e.tail)}\0{len(e)}\1".encode())
+    return h.hexdigest()
+
+
+class MediaServer:
+    """
+    A client for MCWS which reuses one token for every call, reauthenticating only if the token is rejected, and one
+    keep alive connection per calling thread as sessions are not thread safe. The zone list is cached for zones_ttl
+    seconds.
+
+    A DSP load is verified according to verify, full (the default) reads the DSP back after every load and raises
+    DSPMismatchError if it differs from what was sent while hash keeps what was sent and compares its digest to the DSP
+    the next time it is read from that zone (which every load or clear does anyway), so a load is two round trips
+    rather than three at the cost of a mismatch only being logged.
+    """
+
+    def __init__(self, ip: str, auth: tuple[str, str] | None = None, secure: bool = False, verify: str = 'full',
+                 zones_ttl: float = 300.0):
+        if verify not in VERIFY_MODES:
+            raise ValueError(f"Unknown jriver verify mode {verify}, must be one of {', '.join(VERIFY_MODES)}")
         self.__ip = ip
         self.__auth = auth
         self.__secure = secure
+        self.__verify = verify
+        self.__zones_ttl = zones_ttl
         self.__base_url = f"http{'s' if secure else ''}://{ip}/MCWS/v1"
         self.__token = None
+        self.__zones: tuple[float, dict[str, dict]] | None = None
+        self.__last_loaded: dict[str, et.Element] = {}
+        self.__local = threading.local()
 
     def as_dict(self) -> dict:
         return {self.__ip: (self.__auth, self.__secure)}
@@ -429,10 +484,22 @@ class MediaServer:
         suffix = f" [{self.__auth[0]}]" if self.__auth else ' [Unauthenticated]'
         return f"{self.__ip}{suffix}"
 
+    @property
+    def __session(self) -> requests.Session:
+        session = getattr(self.__local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.__local.session = session
+        return session
+
     def authenticate(self) -> bool:
-        self.__token = None
+        # the token is only replaced once the response arrives so calls from other threads are not sent without one
+        token = None
         url = f"{self.__base_url}/Authenticate"
-        r = requests.get(url, auth=self.__auth, timeout=(1, 5))
+        r = self.__session.get(url, auth=self.__auth, timeout=(1, 5))
         if r.status_code == 200:
             response = et.fromstring(r.content)
             if response:
@@ -440,7 +507,8 @@ class MediaServer:
                 if r_status == 'OK':
                     for item in response:
                         if item.attrib['Name'] == 'Token':
-                            self.__token = item.text
+                            token = item.text
+        self.__token = token
         if self.connected:
             return True
         else:
@@ -450,9 +518,26 @@ class MediaServer:
     def connected(self) -> bool:
         return self.__token is not None
 
-    def get_zones(self) -> dict[str, dict]:
+    def __call(self, method: str, path: str, params: dict | None = None, **kwargs) -> requests.Response:
+        """
+        Calls MCWS with the current token, authenticating first if there is no token and once more if the token is
+        rejected.
+        """
         self.__auth_if_required()
-        r = requests.get(f"{self.__base_url}/Playback/Zones", params={'Token': self.__token}, timeout=(1, 5))
+        url = f"{self.__base_url}/{path}"
+        r = self.__session.request(method, url, params={'Token': self.__token, **(params or {})}, timeout=(1, 5),
+                                   **kwargs)
+        if r.status_code == 401:
+            logger.info(f"MCWS token rejected by {self.__ip}, reauthenticating")
+            self.authenticate()
+            r = self.__session.request(method, url, params={'Token': self.__token, **(params or {})}, timeout=(1, 5),
+                                       **kwargs)
+        return r
+
+    def get_zones(self) -> dict[str, dict]:
+        if self.__zones and time.time() - self.__zones[0] < self.__zones_ttl:
+            return self.__zones[1]
+        r = self.__call('GET', 'Playback/Zones')
         if r.status_code == 200:
             response = et.fromstring(r.content)
             if response:
@@ -478,7 +563,9 @@ class MediaServer:
                             elif attrib.startswith('ZoneDLNA'):
                                 if child.text == '1':
                                     remote_zones.append(attrib[8:])
-                    return {v['id']: v for k, v in zones.items() if k not in remote_zones}
+                    local_zones = {v['id']: v for k, v in zones.items() if k not in remote_zones}
+                    self.__zones = (time.time(), local_zones)
+                    return local_zones
         raise MCWSError('No zones loaded', r.url, r.status_code, r.text)
 
     def get_zone_id(self, zone_name: str) -> str:
@@ -490,34 +577,45 @@ class MediaServer:
             self.authenticate()
 
     def get_dsp(self, zone_id: str) -> str | None:
-        self.__auth_if_required()
-        r = requests.get(f"{self.__base_url}/Playback/SaveDSPPreset",
-                         params={'Token': self.__token, 'Zone': zone_id, 'ZoneType': 'ID'},
-                         timeout=(1, 5))
+        r = self.__call('GET', 'Playback/SaveDSPPreset', params={'Zone': zone_id, 'ZoneType': 'ID'})
         if r.status_code == 200:
             response = et.fromstring(r.text)
             if response:
+                dsp = None
                 if response.tag == 'DSP':
-                    return r.text
+                    dsp = r.text
                 elif response.tag == 'Response':
                     r_status = response.attrib.get('Status', None)
                     if r_status == 'OK':
                         for child in response:
                             if child.tag == 'Item' and 'Name' in child.attrib and child.attrib['Name'] == 'Preset':
-                                return child.text
+                                dsp = child.text
+                if dsp is not None:
+                    self.__check_last_load(zone_id, dsp)
+                    return dsp
         raise MCWSError('No DSP loaded', r.url, r.status_code, r.text)
 
+    def __check_last_load(self, zone_id: str, dsp: str) -> None:
+        expected = self.__last_loaded.pop(zone_id, None)
+        if expected is None:
+            return
+        actual = et.fromstring(dsp)
+        wildcards = dsp_wildcards(expected) | dsp_wildcards(actual)
+        if dsp_digest(expected, wildcards) != dsp_digest(actual, wildcards):
+            logger.warning(f"DSP in zone {zone_id} does not match the DSP last loaded by ezbeq, either the load did "
+                           f"not take or the DSP has since been changed in Media Center")
+
     def set_dsp(self, zone_id: str, dsp: str) -> bool:
-        self.__auth_if_required()
         dsp = dsp.replace('\n', '\r\n')
         if not dsp.endswith('\r\n'):
             dsp = dsp + '\r\n'
-        r = requests.post(f"{self.__base_url}/Playback/LoadDSPPreset",
-                          params={'Token': self.__token, 'Zone': zone_id, 'ZoneType': 'ID'},
-                          files={'Name': (None, dsp)},
-                          timeout=(1, 5))
+        r = self.__call('POST', 'Playback/LoadDSPPreset', params={'Zone': zone_id, 'ZoneType': 'ID'},
+                        files={'Name': (None, dsp)})
         if r.status_code == 200:
             logger.info(f"LoadDSPPreset/{zone_id} success {r.url}")
+            if self.__verify == 'hash':
+                self.__last_loaded[zone_id] = et.fromstring(dsp)
+                return True
             loaded_dsp = self.get_dsp(zone_id)
             if self.__compare_xml(et.fromstring(dsp), et.fromstring(loaded_dsp)):
                 return True
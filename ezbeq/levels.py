@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+
+
+class LevelsHistory:
+    """
+    A fixed size ring buffer of the most recent levels read from a device. The buffer starts again if the device
+    starts reporting a different set of series.
+    """
+
+    def __init__(self, capacity: int):
+        self.__capacity = capacity
+        self.__lock = threading.Lock()
+        self.__series: tuple[str, ...] = ()
+        self.__ts = np.zeros(capacity, dtype=np.float64)
+        self.__values = np.zeros((capacity, 0), dtype=np.float32)
+        self.__next = 0
+        self.__count = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.__capacity
+
+    def __len__(self):
+        return self.__count
+
+    def append(self, ts: float, levels: dict[str, float]) -> None:
+        series = tuple(levels.keys())
+        with self.__lock:
+            if series != self.__series:
+                self.__series = series
+                self.__values = np.zeros((self.__capacity, len(series)), dtype=np.float32)
+                self.__next = 0
+                self.__count = 0
+            self.__ts[self.__next] = ts
+            self.__values[self.__next] = [levels[s] for s in series]
+            self.__next = (self.__next + 1) % self.__capacity
+            self.__count = min(self.__count + 1, self.__capacity)
+
+    def query(self, since: float | None = None, points: int | None = None) -> dict:
+        """
+        :param since: the earliest timestamp to include.
+        :param points: the maximum number of points to return, older levels are downsampled into this many buckets.
+        :return: the timestamps and, for each series, the min, max and mean level in each bucket.
+        """
+        with self.__lock:
+            idx = np.arange(self.__next - self.__count, self.__next) % self.__capacity
+            series = self.__series
+            ts = self.__ts[idx]
+            values = self.__values[idx].astype(np.float64)
+        if since is not None:
+            keep = ts >= since
+            ts = ts[keep]
+            values = values[keep]
+        if points is not None and 0 < points < len(ts):
+            starts = (np.arange(points) * len(ts)) // points
+            counts = np.diff(np.append(starts, len(ts)))
+            ts = np.add.reduceat(ts, starts) / counts
+            mins = np.minimum.reduceat(values, starts, axis=0)
+            maxs = np.maximum.reduceat(values, starts, axis=0)
+            means = np.add.reduceat(values, starts, axis=0) / counts[:, None]
+        else:
+            mins = maxs = means = values
+        return {
+            'ts': ts.tolist(),
+            'levels': {
+                s: {
+                    'min': np.round(mins[:, i], 2).tolist(),
+                    'max': np.round(maxs[:, i], 2).tolist(),
+                    'mean': np.round(means[:, i], 2).tolist(),
+                } for i, s in enumerate(series)
+            }
+        }
@@ -23,10 +23,13 @@ from ezbeq.apis import (
     years,
 )
 from ezbeq.apis import catalogue as cat_api
+from ezbeq.apis.native import NativeApi
 from ezbeq.apis.ws import AutobahnWsServer, WsServer
 from ezbeq.catalogue import CatalogueProvider, LoadTester
 from ezbeq.config import Config
-from ezbeq.device import DeviceRepository
+from ezbeq.device import STATE_PERSISTER, DeviceRepository, filter_sample_rates
+from ezbeq.pools import WORKER_POOLS
+from ezbeq.response import FrequencyResponseService
 from ezbeq.update import UpdateChecker
 
 faulthandler.enable()
@@ -37,14 +40,17 @@ if hasattr(faulthandler, 'register'):
 
 
 def create_app(config: Config, ws: WsServer | None = None) -> tuple[Flask, WsServer]:
-    ws_server = ws if ws is not None else AutobahnWsServer()
-    catalogue = CatalogueProvider(config, ws_server)
+    WORKER_POOLS.configure(config.thread_pool_sizes)
+    ws_server = ws if ws is not None else AutobahnWsServer(config.ws_compress, config.ws_compress_threshold,
+                                                            config.ws_compress_mem_level)
+    catalogue = CatalogueProvider(config, ws_server, filter_sample_rates(config))
     update_checker = UpdateChecker(config.version, config.update_check_interval, config.check_for_updates)
     resource_args = {
         'config': config,
         'ws_server': ws_server,
         'device_bridge': DeviceRepository(config, ws_server, catalogue),
         'catalogue': catalogue,
+        'response': FrequencyResponseService(catalogue, config.response_cache_size),
         'version': config.version,
         'git_info': config.git_info,
         'update_checker': update_checker,
@@ -55,6 +61,8 @@ def create_app(config: Config, ws: WsServer | None = None) -> tuple[Flask, WsSer
     }
     app = Flask('ezbeq')
     app.config['APP_CONFIG'] = config
+    app.extensions['native_api'] = NativeApi(resource_args['device_bridge'], catalogue, WORKER_POOLS['device-io'],
+                                             WORKER_POOLS['catalogue-io'])
     Compress(app)
     api = Api(app, prefix='/api', doc='/api/doc/', version=resource_args['version'], title='ezbeq',
               description='Backend api for ezbeq')
@@ -112,11 +120,13 @@ def main(args=None):
             logger.warning(f'  device [{dev_name}]  type={dev_type}')
     logger.warning('=' * 60)
 
+    STATE_PERSISTER.window = cfg.state_persist_delay
     app, ws_server = create_app(cfg)
 
     import logging
     logger = logging.getLogger('twisted')
     from twisted.internet import endpoints, reactor
+    reactor.addSystemEventTrigger('before', 'shutdown', STATE_PERSISTER.flush)
     from twisted.web import server, static
     from twisted.web.resource import Resource
     from twisted.web.wsgi import WSGIResource
@@ -219,7 +229,7 @@ def main(args=None):
 
         def __init__(self):
             super().__init__()
-            self.wsgi = WSGIResource(reactor, reactor.getThreadPool(), app)
+            self.wsgi = WSGIResource(reactor, WORKER_POOLS['http'].thread_pool, app)
             import sys
             if getattr(sys, 'frozen', False):
                 # pyinstaller lets you copy files to arbitrary locations under the _MEIPASS root dir
@@ -235,14 +245,16 @@ def main(args=None):
             else:
                 logger.error(f'No UI available in {uiRoot}')
             self.metrics = None
+            self.native: NativeApi | None = app.extensions['native_api'] if cfg.native_api else None
             ws_server.factory.startFactory()
             self.ws_resource = WebSocketResource(ws_server.factory)
 
         def getChild(self, path, request):
             """
-            Overrides getChild to allow the request to be routed to the wsgi app (i.e. flask for the rest api
-            calls), the static dir (i.e. for the packaged css/js etc), the various concrete files (i.e. the public
-            dir from react-app), the command icons or to index.html (i.e. the react app) for everything else.
+            Overrides getChild to allow the request to be routed to the native api (for the hot read endpoints), the
+            wsgi app (i.e. flask for the rest of the api calls), the static dir (i.e. for the packaged css/js etc), the
+            various concrete files (i.e. the public dir from react-app), the command icons or to index.html (i.e. the
+            react app) for everything else.
             :param path:
             :param request:
             :return:
@@ -255,6 +267,10 @@ def main(args=None):
             logger.debug(f"Handling {path}")
             if path == b'ws':
                 return self.ws_resource
+            if path == b'api' and self.native:
+                native = self.native.resource(request)
+                if native is not None:
+                    return native
             if path == b'api' or path == b'doc' or path == b'swaggerui':
                 request.prepath.pop()
                 request.postpath.insert(0, path)
@@ -3,15 +3,21 @@ import logging
 import math
 import os
 import re
+import threading
 import time
+from collections.abc import Callable
+from concurrent.futures import Future
 from concurrent.futures.thread import ThreadPoolExecutor
 from contextlib import contextmanager
 from typing import Any
 
+import requests
 import yaml
 from autobahn.exception import Disconnected
 from autobahn.twisted import WebSocketClientFactory, WebSocketClientProtocol
 from plumbum import ProcessExecutionError
+from prometheus_client import Counter, Gauge, Histogram
+from requests.adapters import HTTPAdapter
 from twisted.internet.protocol import ReconnectingClientFactory
 
 from ezbeq import to_millis
@@ -20,6 +26,7 @@ from ezbeq.catalogue import CatalogueEntry, CatalogueProvider
 from ezbeq.device import (
     DeviceState,
     InvalidRequestError,
+    LevelsSampler,
     PersistentDevice,
     SlotState,
     UnableToPatchDeviceError,
@@ -31,8 +38,27 @@ CROSSOVER_NAME = 'crossover'
 
 logger = logging.getLogger('ezbeq.minidsp')
 
+# how long before a failed, or empty, probe is retried
+FAILED_PROBE_RETRY_SECONDS = 10.0
+
 _CONFIG_PATTERN = re.compile(r'config ([0-3])')
 _GAIN_PATTERN = re.compile(r'gain -- ([-+]?\d*\.\d+|\d+)')
+_MASTER_MUTE_PATTERN = re.compile(r'^mute (on|off)$')
+_MASTER_GAIN_PATTERN = re.compile(r'^gain -- ([-+]?\d*\.?\d+)$')
+_CHANNEL_MUTE_PATTERN = re.compile(r'^(input|output) (\d+) mute (on|off)$')
+_CHANNEL_GAIN_PATTERN = re.compile(r'^(input|output) (\d+) gain -- ([-+]?\d*\.?\d+)$')
+_PEQ_SET_PATTERN = re.compile(r'^(input|output) (\d+) peq (\d+) set -- (.+)$')
+_PEQ_BYPASS_PATTERN = re.compile(r'^(input|output) (\d+) peq (\d+) bypass (on|off)$')
+_BIQUAD_PATTERN = re.compile(r'^((?:input|output) \d+ (?:peq|crossover \d+) \d+) (set|bypass) (.+)$')
+
+QUEUE_DEPTH = Gauge('ezbeq_minidsp_command_queue_depth', 'Command submissions waiting to be sent to the device',
+                    ['device'])
+BATCH_SUBMISSIONS = Histogram('ezbeq_minidsp_command_batch_submissions',
+                              'Command submissions merged into each batch sent to the device', ['device'],
+                              buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+COMMANDS_SUBMITTED = Counter('ezbeq_minidsp_commands_submitted', 'Commands submitted to the device command queue',
+                             ['device'])
+COMMANDS_SENT = Counter('ezbeq_minidsp_commands_sent', 'Commands sent to the device after merging', ['device'])
 
 
 class MinidspStubRunner:
@@ -596,8 +622,155 @@ def make_peq_layout(cfg: dict, cmd_runner) -> MinidspDescriptor:
     return Minidsp24HD(slot_names=slot_names)
 
 
+def merge_key(cmd: str) -> str | None:
+    '''
+    Only the master, input and output gain and mute and the per index peq bypass commands generated by ezbeq are
+    merged, anything else (e.g. a raw command such as input 0 peq all bypass on) is always sent as is.
+    :param cmd: a minidsp command.
+    :return: the parameter the command sets (e.g. input 0 gain), None if the command cannot be merged with others.
+    '''
+    if _MASTER_GAIN_PATTERN.match(cmd):
+        return 'gain'
+    if _MASTER_MUTE_PATTERN.match(cmd):
+        return 'mute'
+    if m := _CHANNEL_GAIN_PATTERN.match(cmd):
+        return f"{m.group(1)} {m.group(2)} gain"
+    if m := _CHANNEL_MUTE_PATTERN.match(cmd):
+        return f"{m.group(1)} {m.group(2)} mute"
+    if m := _PEQ_BYPASS_PATTERN.match(cmd):
+        return f"{m.group(1)} {m.group(2)} peq {m.group(3)} bypass"
+    return None
+
+
+class _PendingBatch:
+
+    def __init__(self, slot: int | None):
+        self.slot = slot
+        self.cmds: dict[Any, str] = {}
+        self.futures: list[Future] = []
+
+    def accepts(self, slot: int | None) -> bool:
+        return self.slot is None or slot is None or self.slot == slot
+
+    def add(self, slot: int | None, cmds: list[str], future: Future) -> None:
+        if self.slot is None:
+            self.slot = slot
+        for cmd in cmds:
+            key = merge_key(cmd)
+            if key is None:
+                key = object()
+            else:
+                # the latest command for a parameter is sent after anything submitted before it
+                self.cmds.pop(key, None)
+            self.cmds[key] = cmd
+        self.futures.append(future)
+
+
+class MinidspCommandQueue:
+    """
+    Coalesces the commands submitted while the device is busy (or within window seconds of the first pending
+    submission) into a single batch. Later commands for the same parameter replace earlier ones, and take their place in
+    the order sent, commands for different slots are never merged.
+    """
+
+    def __init__(self, name: str, executor: ThreadPoolExecutor, send: Callable[[list[str], int | None], None],
+                 window: float = 0.0):
+        self.__name = name
+        self.__executor = executor
+        self.__send = send
+        self.__window = window
+        self.__lock = threading.Lock()
+        self.__pending: list[_PendingBatch] = []
+
+    def submit(self, slot: int | None, cmds: list[str]) -> Future:
+        future = Future()
+        with self.__lock:
+            schedule = not self.__pending
+            if self.__pending and self.__pending[-1].accepts(slot):
+                batch = self.__pending[-1]
+            else:
+                batch = _PendingBatch(slot)
+                self.__pending.append(batch)
+            batch.add(slot, cmds, future)
+            QUEUE_DEPTH.labels(self.__name).inc()
+        COMMANDS_SUBMITTED.labels(self.__name).inc(len(cmds))
+        if schedule:
+            self.__executor.submit(self.__flush)
+        return future
+
+    def __flush(self) -> None:
+        if self.__window > 0:
+            time.sleep(self.__window)
+        with self.__lock:
+            batches, self.__pending = self.__pending, []
+        for batch in batches:
+            cmds = list(batch.cmds.values())
+            QUEUE_DEPTH.labels(self.__name).dec(len(batch.futures))
+            BATCH_SUBMISSIONS.labels(self.__name).observe(len(batch.futures))
+            COMMANDS_SENT.labels(self.__name).inc(len(cmds))
+            if len(batch.futures) > 1:
+                logger.info(f"[{self.__name}] Merged {len(batch.futures)} submissions into {len(cmds)} commands")
+            try:
+                self.__send(cmds, batch.slot)
+            except Exception as e:
+                logger.exception(f"[{self.__name}] Failed to send {len(cmds)} commands")
+                for f in batch.futures:
+                    f.set_exception(e)
+            else:
+                for f in batch.futures:
+                    f.set_result(None)
+
+
+class BiquadWriteCache:
+    """
+    Remembers the coefficients and bypass state last written to each biquad of each slot so that commands which would
+    not change anything on the device can be dropped. Any command that might change a biquad in an unknown way
+    invalidates the slot.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__written: dict[tuple[int, str, str], str] = {}
+
+    def diff(self, slot: int, cmds: list[str]) -> list[str]:
+        with self.__lock:
+            return [c for c in cmds if not (m := _BIQUAD_PATTERN.match(c))
+                    or self.__written.get((slot, m.group(1), m.group(2))) != m.group(3)]
+
+    def record(self, slot: int, cmds: list[str]) -> None:
+        with self.__lock:
+            for c in cmds:
+                if m := _BIQUAD_PATTERN.match(c):
+                    self.__written[(slot, m.group(1), m.group(2))] = m.group(3)
+                elif not self.__is_known(c):
+                    self.__invalidate(slot)
+
+    @staticmethod
+    def __is_known(cmd: str) -> bool:
+        return any(p.match(cmd) for p in (_CONFIG_PATTERN, _MASTER_MUTE_PATTERN, _MASTER_GAIN_PATTERN,
+                                          _CHANNEL_MUTE_PATTERN, _CHANNEL_GAIN_PATTERN))
+
+    def __invalidate(self, slot: int | None) -> None:
+        if slot is None:
+            self.__written.clear()
+        else:
+            for k in [k for k in self.__written if k[0] == slot]:
+                del self.__written[k]
+
+    def invalidate(self, slot: int | None = None) -> None:
+        with self.__lock:
+            self.__invalidate(slot)
+
+
 class Minidsp(PersistentDevice[MinidspState]):
 
+    @classmethod
+    def filter_sample_rates(cls, cfg: dict) -> frozenset[int]:
+        try:
+            return frozenset({int(make_peq_layout(cfg, lambda *args: '').fs)})
+        except (ValueError, KeyError, TypeError):
+            return frozenset()
+
     def __init__(self, name: str, config_path: str, cfg: dict, ws_server: WsServer, catalogue: CatalogueProvider):
         super().__init__(config_path, name, ws_server)
         self.__catalogue = catalogue
@@ -605,14 +778,31 @@ class Minidsp(PersistentDevice[MinidspState]):
         self.__cmd_timeout = cfg.get('cmdTimeout', 10)
         self.__ignore_retcode = cfg.get('ignoreRetcode', False)
         self.__slot_change_delay: bool | int | float = cfg.get('slotChangeDelay', False)
-        self.__levels_interval = 1.0 / float(cfg.get('levelsFps', 10))
+        self.__levels_sampler = LevelsSampler(name, ws_server, lambda: self.ws_server.levels(self.name, self.levels()),
+                                              float(cfg.get('levelsFps', 10)))
+        self._keep_levels_history(cfg)
+        self.__active_slot_ttl = float(cfg.get('activeSlotTtl', 5))
+        self.__known_slot: tuple[int, float] | None = None
+        self.__probe_interval = float(cfg.get('probeInterval', 3600))
+        self.__serials: tuple[list[str], float] | None = None
         self.__runner = cfg['make_runner'](cfg['exe'], cfg.get('options', ''))
+        self.__biquads = BiquadWriteCache() if cfg.get('diffBiquads', False) else None
+        self.__batch_window = float(cfg.get('commandBatchWindow', 0.0))
+        self.__queue = MinidspCommandQueue(name, self.__executor,
+                                           lambda cmds, slot: self.__do_run(cmds, slot, self.__slot_change_delay),
+                                           window=self.__batch_window)
         ws_device_id = cfg.get('wsDeviceId', None)
         ws_ip = cfg.get('wsIp', '127.0.0.1:5380')
         if ws_device_id is not None and ws_ip:
             self.__ws_client = MinidspRsClient(self, ws_ip, ws_device_id)
         else:
             self.__ws_client = None
+        if cfg.get('transport', 'cli') == 'http' and ws_ip:
+            self.__http: MinidspRsHttpTransport | None = MinidspRsHttpTransport(
+                name, ws_ip, ws_device_id if ws_device_id is not None else 0, self.__cmd_timeout)
+            logger.info(f"[{name}] Using {self.__http} with cli fallback")
+        else:
+            self.__http = None
         self.__descriptor: MinidspDescriptor = make_peq_layout(cfg, self.__runner)
         logger.info(f"[{name}] Minidsp descriptor is loaded.... exe is {self.__runner}")
         logger.debug(yaml.dump(self.__descriptor, indent=2, default_flow_style=False, sort_keys=False))
@@ -630,34 +820,21 @@ class Minidsp(PersistentDevice[MinidspState]):
         output = None
         try:
             kwargs = {'retcode': None} if self.__ignore_retcode else {}
-            output = self.__runner['-o', 'jsonline'](timeout=self.__cmd_timeout, **kwargs)
-            lines = output.splitlines()
-            if lines:
-                status = json.loads(lines[0])
+            status = self.__http.status() if self.__http else None
+            if status is None:
+                output = self.__runner['-o', 'jsonline'](timeout=self.__cmd_timeout, **kwargs)
+                lines = output.splitlines()
+                status = json.loads(lines[0]) if lines else None
+            if status:
+                self.__track_slot(status['master']['preset'])
                 values = {
                     'active_slot': str(status['master']['preset'] + 1),
                     'mute': status['master']['mute'],
                     'mv': status['master']['volume']
                 }
-                try:
-                    output = self.__runner['probe'](timeout=self.__cmd_timeout, **kwargs)
-                    lines = output.splitlines()
-                    serials = []
-                    if lines:
-                        # 0: Found 2x4HD with serial 911111 at ws://localhost/devices/0/ws [hw_id: 10, dsp_version: 100]
-                        import re
-                        p = re.compile(
-                            r'(?P<device_idx>\d+): Found (?P<device_type>.*) with serial (?P<serial>.*) at.*')
-                        for line in lines:
-                            m = p.match(line)
-                            if m:
-                                serials.append(m.group('serial'))
-                            else:
-                                logger.debug(f'[{self.name}] Unexpected output from probe : {line}')
-                    if serials:
-                        values['serials'] = serials
-                except Exception:
-                    logger.warning(f'[{self.name}] Unable to probe')
+                serials = self.__discover_serials(kwargs)
+                if serials:
+                    values['serials'] = serials
                 return MinidspState(self.name, self.__descriptor, **values)
             else:
                 msg = f"[{self.name}] No output returned from device"
@@ -667,6 +844,55 @@ class Minidsp(PersistentDevice[MinidspState]):
             msg = f"[{self.name}] Unable to parse device state {output}"
             logger.exception(msg)
             self.ws_server.broadcast_error(msg, persistent=True)
+        if self.__biquads is not None:
+            self.__biquads.invalidate()
+        return None
+
+    def __discover_serials(self, kwargs: dict) -> list[str]:
+        '''
+        Serials do not change at runtime so the probe result is reused for probeInterval seconds, a failed or empty probe
+        is retried after FAILED_PROBE_RETRY_SECONDS instead.
+        :return: the serials.
+        '''
+        cached = self.__serials
+        if cached and time.monotonic() < cached[1]:
+            return cached[0]
+        serials: list[str] = []
+        try:
+            found = self.__http.serials() if self.__http else None
+            serials = found if found is not None else self.__probe_serials(kwargs)
+        except Exception:
+            logger.warning(f'[{self.name}] Unable to probe')
+        ttl = self.__probe_interval if serials else min(self.__probe_interval, FAILED_PROBE_RETRY_SECONDS)
+        self.__serials = (serials, time.monotonic() + ttl)
+        return serials
+
+    def __probe_serials(self, kwargs: dict) -> list[str]:
+        output = self.__runner['probe'](timeout=self.__cmd_timeout, **kwargs)
+        lines = output.splitlines()
+        serials = []
+        if lines:
+            # 0: Found 2x4HD with serial 911111 at ws://localhost/devices/0/ws [hw_id: 10, dsp_version: 100]
+            p = re.compile(r'(?P<device_idx>\d+): Found (?P<device_type>.*) with serial (?P<serial>.*) at.*')
+            for line in lines:
+                m = p.match(line)
+                if m:
+                    serials.append(m.group('serial'))
+                else:
+                    logger.debug(f'[{self.name}] Unexpected output from probe : {line}')
+        return serials
+
+    def __track_slot(self, slot_idx: int | None) -> None:
+        self.__known_slot = None if slot_idx is None else (slot_idx, time.monotonic())
+
+    def __tracked_slot(self) -> int | None:
+        '''
+        :return: the last known active slot idx if it was seen (from the device, a command or the minidsp-rs
+        websocket) within the last activeSlotTtl seconds.
+        '''
+        known = self.__known_slot
+        if known and time.monotonic() - known[1] < self.__active_slot_ttl:
+            return known[0]
         return None
 
     @staticmethod
@@ -674,8 +900,7 @@ class Minidsp(PersistentDevice[MinidspState]):
         return int(idx) - 1
 
     def __send_cmds(self, target_slot_idx: int | None, cmds: list[str]) -> Any:
-        return self.__executor.submit(self.__do_run, cmds, target_slot_idx, self.__slot_change_delay).result(
-            timeout=self.__cmd_timeout)
+        return self.__queue.submit(target_slot_idx, cmds).result(timeout=self.__cmd_timeout + self.__batch_window)
 
     def activate(self, slot: str) -> None:
         def __do_it():
@@ -825,12 +1050,21 @@ class Minidsp(PersistentDevice[MinidspState]):
         return target_channel_idx, target_slot_idx
 
     def __do_run(self, config_cmds: list[str], slot: int | None, slot_change_delay: bool | float):
+        unchanged = False
+        if self.__biquads is not None and slot is not None and config_cmds:
+            changed = self.__biquads.diff(slot, config_cmds)
+            if len(changed) != len(config_cmds):
+                logger.info(f"[{self.name}] Skipping {len(config_cmds) - len(changed)} unchanged biquad commands "
+                            f"for slot {slot}")
+                unchanged = not changed
+                config_cmds = changed
         if slot is not None:
-            change_slot = True
-            current_state = self.__read_state_from_device()
-            if current_state and current_state.active_slot == str(slot + 1):
-                change_slot = False
-            if change_slot is True:
+            active_slot_idx = self.__tracked_slot()
+            if active_slot_idx is None:
+                current_state = self.__read_state_from_device()
+                if current_state and current_state.active_slot:
+                    active_slot_idx = self.__as_idx(current_state.active_slot)
+            if active_slot_idx != slot:
                 if slot_change_delay:
                     self.__do_run([], slot, False)
                     if slot_change_delay is not True and slot_change_delay > 0:
@@ -839,10 +1073,20 @@ class Minidsp(PersistentDevice[MinidspState]):
                         sleep(slot_change_delay)
                 else:
                     logger.info(
-                        f"[{self.name}] Activating slot {slot}, current is {current_state.active_slot if current_state else 'UNKNOWN'}")
+                        f"[{self.name}] Activating slot {slot}, current is {'UNKNOWN' if active_slot_idx is None else active_slot_idx}")
                     config_cmds.insert(0, MinidspBeqCommandGenerator.activate(slot))
+        if unchanged and not config_cmds:
+            return
         formatted = '\n'.join(config_cmds)
         logger.debug(f"\n{formatted}")
+        if self.__http is not None:
+            start = time.time()
+            if self.__http.apply(config_cmds):
+                end = time.time()
+                self.__on_sent(slot, config_cmds, True)
+                logger.info(
+                    f"[{self.name}] Sent {len(config_cmds)} commands to slot {slot} via {self.__http} in {to_millis(start, end)}ms")
+                return
         with tmp_file(config_cmds) as file_name:
             kwargs = {'retcode': None} if self.__ignore_retcode else {}
             exe = self.__runner['-f', file_name]
@@ -852,12 +1096,29 @@ class Minidsp(PersistentDevice[MinidspState]):
             try:
                 code, _stdout, _stderr = exe.run(timeout=self.__cmd_timeout, **kwargs)
             except ProcessExecutionError as e:
+                self.__on_sent(slot, config_cmds, False)
                 logger.info(f'Failed commands: {config_cmds}')
                 raise UnableToPatchDeviceError(f'minidsp cmd failed due to : {e.stderr}', False) from e
+            except Exception:
+                self.__on_sent(slot, config_cmds, False)
+                raise
             end = time.time()
+            self.__on_sent(slot, config_cmds, code == 0)
             logger.info(
                 f"[{self.name}] Sent {len(config_cmds)} commands to slot {slot} in {to_millis(start, end)}ms - result is {code}")
 
+    def __on_sent(self, slot: int | None, cmds: list[str], success: bool) -> None:
+        if success:
+            if slot is not None:
+                self.__track_slot(slot)
+                if self.__biquads is not None:
+                    self.__biquads.record(slot, cmds)
+        else:
+            # the device state is unknown after a failure
+            self.__track_slot(None)
+            if self.__biquads is not None:
+                self.__biquads.invalidate()
+
     def _load_initial_state(self) -> MinidspState:
         return self.__load_state()
 
@@ -896,7 +1157,9 @@ class Minidsp(PersistentDevice[MinidspState]):
 
     def __update_slot(self, slot: dict) -> bool:
         any_update = False
-        current_slot = self._current_state.get_slot(slot['id'])
+        state = self._current_state
+        assert state, 'hydrate cannot return None'
+        current_slot = state.get_slot(slot['id'])
         if not current_slot:
             raise UnableToPatchDeviceError(f'Unknown device slot {slot["id"]}', True)
         match: CatalogueEntry | None = None
@@ -904,28 +1167,34 @@ class Minidsp(PersistentDevice[MinidspState]):
             match = self.__catalogue.find(slot['entry'])
             if not match:
                 raise UnableToPatchDeviceError(f'Unknown catalogue entry {slot["entry"]}', True)
-        if 'gains' in slot:
-            for gain in slot['gains']:
-                self.set_gain(current_slot.slot_id, int(gain['id']), gain['value'])
-                any_update = True
-        if 'mutes' in slot:
-            for mute in slot['mutes']:
-                if mute['value'] is True:
-                    self.mute(current_slot.slot_id, int(mute['id']))
-                else:
-                    self.unmute(current_slot.slot_id, int(mute['id']))
-                any_update = True
-        if 'outputGains' in slot:
-            for gain in slot['outputGains']:
-                self.set_output_gain(current_slot.slot_id, int(gain['id']), gain['value'])
-                any_update = True
-        if 'outputMutes' in slot:
-            for mute in slot['outputMutes']:
-                if mute['value'] is True:
-                    self.output_mute(current_slot.slot_id, int(mute['id']))
-                else:
-                    self.output_unmute(current_slot.slot_id, int(mute['id']))
-                any_update = True
+        # send every gain and mute change for the slot as a single batch
+        cmds: list[str] = []
+        updates: list[Callable[[], None]] = []
+        slot_id = current_slot.slot_id
+        for gain in slot.get('gains', []):
+            channel_idx, slot_idx = self.__as_idxes(int(gain['id']), slot_id)
+            cmds.extend(MinidspBeqCommandGenerator.gain(gain['value'], slot_idx, channel_idx))
+            updates.append(lambda c=int(gain['id']), v=gain['value']: state.gain(slot_id, c, v))
+        for mute in slot.get('mutes', []):
+            channel_idx, slot_idx = self.__as_idxes(int(mute['id']), slot_id)
+            cmds.extend(MinidspBeqCommandGenerator.mute(mute['value'] is True, slot_idx, channel_idx))
+            updates.append(lambda c=int(mute['id']), v=mute['value'] is True: state.toggle_mute(slot_id, c, v))
+        for gain in slot.get('outputGains', []):
+            channel_idx, slot_idx = self.__as_idxes(int(gain['id']), slot_id)
+            cmds.extend(MinidspBeqCommandGenerator.gain(gain['value'], slot_idx, channel_idx, side=OUTPUT_NAME))
+            updates.append(lambda c=int(gain['id']), v=gain['value']: state.output_gain(slot_id, c, v))
+        for mute in slot.get('outputMutes', []):
+            channel_idx, slot_idx = self.__as_idxes(int(mute['id']), slot_id)
+            cmds.extend(MinidspBeqCommandGenerator.mute(mute['value'] is True, slot_idx, channel_idx,
+                                                        side=OUTPUT_NAME))
+            updates.append(lambda c=int(mute['id']), v=mute['value'] is True: state.toggle_output_mute(slot_id, c, v))
+        if updates:
+            self.__validate_slot_idx(self.__as_idx(slot_id))
+            if cmds:
+                self.__send_cmds(self.__as_idx(slot_id), cmds)
+            for u in updates:
+                u()
+            any_update = True
         if 'entry' in slot:
             if slot['entry']:
                 self.load_filter(current_slot.slot_id, match)
@@ -945,36 +1214,35 @@ class Minidsp(PersistentDevice[MinidspState]):
         try:
             kwargs = {'retcode': None} if self.__ignore_retcode else {}
             start = time.time()
-            lines = self.__runner['-o', 'jsonline'](timeout=self.__cmd_timeout, **kwargs)
+            levels = self.__http.status() if self.__http else None
+            if levels is None:
+                lines = self.__runner['-o', 'jsonline'](timeout=self.__cmd_timeout, **kwargs)
+                levels = json.loads(lines)
             end = time.time()
-            levels = json.loads(lines)
             ts = time.time()
             logger.debug(f"{self.name},readlevels,{ts},{to_millis(start, end)}")
-            return {
+            result = {
                 'name': self.name,
                 'ts': ts,
                 'levels': format_levels(levels)
             }
+            self._record_levels(result)
+            return result
         except Exception:
             logger.exception(f"[{self.name}] Unable to load levels {lines}")
             return {}
 
     def start_broadcast_levels(self) -> None:
         if self.__ws_client is None:
-            from twisted.internet import reactor
-            sched = lambda: reactor.callLater(self.__levels_interval, __send)
-
-            def __send():
-                if self.ws_server.levels(self.name, self.levels()):
-                    sched()
-
-            sched()
+            self.__levels_sampler.start()
 
     def on_ws_message(self, msg: dict[str, Any]) -> None:
         logger.debug(f"[{self.name}] Received {msg}")
         if 'master' in msg:
             master = msg['master']
             if master:
+                self.__track_slot(master['preset'])
+
                 def do_it():
                     preset = str(master['preset'] + 1)
                     mv = master['volume']
@@ -988,11 +1256,13 @@ class Minidsp(PersistentDevice[MinidspState]):
 
                 self._hydrate_cache_broadcast(do_it)
         if 'input_levels' in msg and 'output_levels' in msg:
-            self.ws_server.levels(self.name, {
+            levels = {
                 'name': self.name,
                 'ts': time.time(),
                 'levels': format_levels(msg)
-            })
+            }
+            self._record_levels(levels)
+            self.ws_server.levels(self.name, levels)
 
 
 class MinidspBeqCommandGenerator:
@@ -1032,23 +1302,14 @@ class MinidspBeqCommandGenerator:
 
     @staticmethod
     def as_bq(f: dict, fs: str) -> list[str]:
-        if fs in f['biquads']:
+        if fs in f.get('biquads', {}):
             bq = f['biquads'][fs]['b'] + f['biquads'][fs]['a']
         else:
             t = f['type']
-            freq = f['freq']
-            gain = f['gain']
-            q = f['q']
-            from ezbeq.iir import HighShelf, LowShelf, PeakingEQ
-            if t == 'PeakingEQ':
-                f = PeakingEQ(int(fs), freq, q, gain)
-            elif t == 'LowShelf':
-                f = LowShelf(int(fs), freq, q, gain)
-            elif t == 'HighShelf':
-                f = HighShelf(int(fs), freq, q, gain)
-            else:
+            from ezbeq.iir import FILTER_TYPES, formatted_coefficients
+            if t not in FILTER_TYPES:
                 raise InvalidRequestError(f"Unknown filt_type {t}")
-            bq = list(f.format_biquads().values())
+            bq = list(formatted_coefficients(t, int(fs), f['freq'], f['q'], f['gain']))
         if len(bq) != 5:
             raise ValueError(f"Invalid coeff count {len(bq)}")
         return bq
@@ -1164,6 +1425,153 @@ def tmp_file(cmds: list[str]):
             os.unlink(tmp_name)
 
 
+def to_rs_configs(cmds: list[str]) -> list[dict] | None:
+    '''
+    Translates minidsp cli commands into the equivalent minidsp-rs http config payloads. A new payload is started
+    whenever the config slot changes so that subsequent commands are applied to the newly activated slot.
+    :param cmds: the commands.
+    :return: the payloads in the order they should be sent or None if any command has no http equivalent.
+    '''
+    configs: list[dict] = []
+    master: dict = {}
+    channels: dict[tuple[str, int], dict] = {}
+
+    def flush():
+        if master or channels:
+            payload: dict = {}
+            if master:
+                payload['master_status'] = dict(master)
+            for (side, _), channel in channels.items():
+                payload.setdefault(f'{side}s', []).append({
+                    **{k: v for k, v in channel.items() if k != 'peq'},
+                    'peq': list(channel['peq'].values())
+                })
+            configs.append(payload)
+            master.clear()
+            channels.clear()
+
+    def channel_of(side: str, idx: str) -> dict:
+        key = (side, int(idx))
+        if key not in channels:
+            channels[key] = {'index': int(idx), 'peq': {}}
+        return channels[key]
+
+    def peq_of(side: str, idx: str, peq_idx: str) -> dict:
+        peqs = channel_of(side, idx)['peq']
+        if int(peq_idx) not in peqs:
+            peqs[int(peq_idx)] = {'index': int(peq_idx)}
+        return peqs[int(peq_idx)]
+
+    for cmd in cmds:
+        if m := _CONFIG_PATTERN.fullmatch(cmd):
+            flush()
+            master['preset'] = int(m.group(1))
+        elif m := _MASTER_MUTE_PATTERN.match(cmd):
+            master['mute'] = m.group(1) == 'on'
+        elif m := _MASTER_GAIN_PATTERN.match(cmd):
+            master['volume'] = float(m.group(1))
+        elif m := _CHANNEL_MUTE_PATTERN.match(cmd):
+            channel_of(m.group(1), m.group(2)).setdefault('gate', {})['mute'] = m.group(3) == 'on'
+        elif m := _CHANNEL_GAIN_PATTERN.match(cmd):
+            channel_of(m.group(1), m.group(2)).setdefault('gate', {})['gain'] = float(m.group(3))
+        elif m := _PEQ_SET_PATTERN.match(cmd):
+            coeffs = m.group(4).split()
+            if len(coeffs) != 5:
+                return None
+            peq_of(m.group(1), m.group(2), m.group(3))['coeff'] = dict(zip(('b0', 'b1', 'b2', 'a1', 'a2'),
+                                                                           map(float, coeffs)))
+        elif m := _PEQ_BYPASS_PATTERN.match(cmd):
+            peq_of(m.group(1), m.group(2), m.group(3))['bypass'] = m.group(4) == 'on'
+        else:
+            return None
+    flush()
+    return configs
+
+
+class MinidspRsHttpTransport:
+    '''
+    Talks to a running minidsp-rs daemon via its http api over keep alive connections, avoiding the cost of spawning a
+    minidsp process for every command batch, state read or levels sample. Sessions are not thread safe and this is
+    called from the levels sampler, the command queue and the device-io pool so each thread gets its own session, and
+    hence its own connection. Callers are expected to fall back to the cli if a method returns None (or False), the
+    transport is not retried for retry_after seconds after a failure.
+    '''
+
+    def __init__(self, name: str, ip: str, device_id: int | str, timeout: float, retry_after: float = 30.0):
+        self.__name = name
+        self.__devices_url = f"http://{ip}/devices"
+        self.__device_url = f"{self.__devices_url}/{device_id}"
+        self.__timeout = timeout
+        self.__retry_after = retry_after
+        self.__unavailable_until = 0.0
+        self.__local = threading.local()
+
+    def __repr__(self) -> str:
+        return f"MinidspRsHttpTransport({self.__device_url})"
+
+    @property
+    def __session(self) -> requests.Session:
+        session = getattr(self.__local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self.__local.session = session
+        return session
+
+    @property
+    def available(self) -> bool:
+        return time.time() >= self.__unavailable_until
+
+    def __failed(self, action: str, e: Exception) -> None:
+        self.__unavailable_until = time.time() + self.__retry_after
+        logger.warning(f"[{self.__name}] Unable to {action} via {self.__device_url}, using cli for the next "
+                       f"{self.__retry_after}s : {e}")
+
+    def status(self) -> dict[str, Any] | None:
+        '''
+        :return: the status summary (master, input_levels, output_levels) in the same format as minidsp -o jsonline.
+        '''
+        if self.available:
+            try:
+                r = self.__session.get(self.__device_url, timeout=self.__timeout)
+                r.raise_for_status()
+                return r.json()
+            except (requests.RequestException, ValueError) as e:
+                self.__failed('read status', e)
+        return None
+
+    def serials(self) -> list[str] | None:
+        if self.available:
+            try:
+                r = self.__session.get(self.__devices_url, timeout=self.__timeout)
+                r.raise_for_status()
+                return [str(d['version']['serial']) for d in r.json() if d.get('version')]
+            except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+                self.__failed('probe', e)
+        return None
+
+    def apply(self, cmds: list[str]) -> bool:
+        '''
+        Sends the commands to the device.
+        :param cmds: the commands.
+        :return: true if the commands were applied, false if the cli must be used instead.
+        '''
+        if not self.available:
+            return False
+        configs = to_rs_configs(cmds)
+        if configs is None:
+            logger.info(f"[{self.__name}] Commands not supported by the http api, using cli")
+            return False
+        try:
+            for config in configs:
+                r = self.__session.post(f"{self.__device_url}/config", json=config, timeout=self.__timeout)
+                r.raise_for_status()
+            return True
+        except requests.RequestException as e:
+            self.__failed('send commands', e)
+            return False
+
+
 class MinidspRsClient:
 
     def __init__(self, listener: 'Minidsp', ip: str, device_id: int | str):
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from threading import Thread
+from typing import Any
+
+from prometheus_client import Gauge, Histogram
+from twisted.internet import defer
+from twisted.python.threadpool import ThreadPool
+
+from ezbeq.config import THREAD_POOL_SIZES
+
+logger = logging.getLogger('ezbeq.pools')
+
+POOL_QUEUED = Gauge('ezbeq_thread_pool_queued', 'Tasks waiting for a thread', ['pool'])
+POOL_BUSY = Gauge('ezbeq_thread_pool_busy', 'Tasks running', ['pool'])
+POOL_MAX_THREADS = Gauge('ezbeq_thread_pool_max_threads', 'The max number of threads', ['pool'])
+POOL_WAIT_SECONDS = Histogram('ezbeq_thread_pool_wait_seconds', 'Time a task waited for a thread', ['pool'],
+                              buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0))
+
+
+class _DaemonThread(Thread):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.daemon = True
+
+
+class InstrumentedThreadPool(ThreadPool):
+    """
+    A ThreadPool of daemon threads which reports how many tasks are queued and running and how long each task waited
+    for a thread.
+    """
+    threadFactory = _DaemonThread
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kw):
+        if self.joined:
+            return
+        queued = POOL_QUEUED.labels(self.name)
+        busy = POOL_BUSY.labels(self.name)
+        wait = POOL_WAIT_SECONDS.labels(self.name)
+        submitted = time.monotonic()
+
+        def timed(*a, **k):
+            queued.dec()
+            wait.observe(time.monotonic() - submitted)
+            busy.inc()
+            try:
+                return func(*a, **k)
+            finally:
+                busy.dec()
+
+        queued.inc()
+        super().callInThreadWithCallback(onResult, timed, *args, **kw)
+
+
+class WorkerPool:
+    """
+    A named, bounded pool of daemon threads for one class of blocking work, kept apart from the other pools so that,
+    for example, a slow catalogue reload cannot hold up http requests. The pool is started on first use and stopped
+    when the reactor shuts down, it cannot be restarted once stopped.
+    """
+
+    def __init__(self, name: str, max_threads: int):
+        self.__name = name
+        self.__max_threads = max(max_threads, 1)
+        self.__lock = threading.Lock()
+        self.__pool: ThreadPool | None = None
+        self.__stopped = False
+        POOL_MAX_THREADS.labels(name).set(self.__max_threads)
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def max_threads(self) -> int:
+        return self.__max_threads
+
+    def resize(self, max_threads: int) -> None:
+        with self.__lock:
+            self.__max_threads = max(max_threads, 1)
+            POOL_MAX_THREADS.labels(self.__name).set(self.__max_threads)
+            if self.__pool is not None:
+                self.__pool.adjustPoolsize(maxthreads=self.__max_threads)
+
+    @property
+    def thread_pool(self) -> ThreadPool:
+        """
+        :return: the underlying twisted ThreadPool, started if necessary.
+        """
+        with self.__lock:
+            if self.__stopped:
+                raise RuntimeError(f'{self.__name} pool has been stopped')
+            if self.__pool is None:
+                from twisted.internet import reactor
+
+                pool = InstrumentedThreadPool(minthreads=0, maxthreads=self.__max_threads, name=self.__name)
+                pool.start()
+                reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+                logger.info(f'Started {self.__name} pool with up to {self.__max_threads} threads')
+                self.__pool = pool
+            return self.__pool
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> defer.Deferred:
+        """
+        Calls fn in this pool.
+        :return: a Deferred which fires, on the reactor thread, with the result.
+        """
+        from twisted.internet import reactor, threads
+        return threads.deferToThreadPool(reactor, self.thread_pool, fn, *args, **kwargs)
+
+    def call_in_thread(self, fn: Callable[..., Any], *args, **kwargs) -> None:
+        """
+        Calls fn in this pool, ignoring the result.
+        """
+        self.thread_pool.callInThread(fn, *args, **kwargs)
+
+    def stop(self) -> None:
+        with self.__lock:
+            pool, self.__pool = self.__pool, None
+            self.__stopped = True
+        if pool is not None:
+            pool.stop()
+            # tasks still queued when the pool stopped never run
+            POOL_QUEUED.labels(self.__name).set(0)
+            POOL_BUSY.labels(self.__name).set(0)
+
+
+class WorkerPools:
+    """
+    The named worker pools, see THREAD_POOL_SIZES for the names.
+    """
+
+    def __init__(self, sizes: dict[str, int]):
+        self.__pools = {name: WorkerPool(name, size) for name, size in sizes.items()}
+
+    def configure(self, sizes: dict[str, int]) -> None:
+        for name, size in sizes.items():
+            if self[name].max_threads != size:
+                logger.info(f'Resizing {name} pool to {size} threads')
+                self[name].resize(size)
+
+    def __getitem__(self, name: str) -> WorkerPool:
+        return self.__pools[name]
+
+    def __iter__(self):
+        return iter(self.__pools.values())
+
+
+WORKER_POOLS = WorkerPools(THREAD_POOL_SIZES)
@@ -38,6 +38,10 @@ class Qsys(PersistentDevice[QsysState]):
     SUPPORTED_OPS = frozenset({'activate', 'load_filter', 'clear_filter'})
     FIXED_SLOT_ID = SLOT_NAME
 
+    @classmethod
+    def filter_sample_rates(cls, cfg: dict) -> frozenset[int]:
+        return frozenset({PEQ.DEFAULT_FS})
+
     def __init__(self, name: str, config_path: str, cfg: dict, ws_server: WsServer, catalogue: CatalogueProvider):
         super().__init__(config_path, name, ws_server)
         self.__name = name
@@ -227,8 +231,9 @@ class Qsys(PersistentDevice[QsysState]):
 
 
 class PEQ:
+    DEFAULT_FS = 48000
 
-    def __init__(self, fc: float, q: float, gain: float, filter_type_name: str, fs: int = 48000):
+    def __init__(self, fc: float, q: float, gain: float, filter_type_name: str, fs: int = DEFAULT_FS):
         self.fs = fs
         self.fc = fc
         self.q = q
@@ -246,18 +251,11 @@ class PEQ:
 
     @property
     def coeffs(self) -> list[float]:
-        if self.filter_type_name == 'LowShelf':
-            from ezbeq.iir import LowShelf
-            filt = LowShelf(self.fs, self.fc, self.q, self.gain)
-        elif self.filter_type_name == 'PeakingEQ':
-            from ezbeq.iir import PeakingEQ
-            filt = PeakingEQ(self.fs, self.fc, self.q, self.gain)
-        elif self.filter_type_name == 'HighShelf':
-            from ezbeq.iir import HighShelf
-            filt = HighShelf(self.fs, self.fc, self.q, self.gain)
-        else:
+        from ezbeq.iir import FILTER_TYPES, coefficients
+        if self.filter_type_name not in FILTER_TYPES:
             raise ValueError(f"Filter type {self.filter_type_name} not supported")
-        return filt.b + filt.a
+        a, b = coefficients(self.filter_type_name, self.fs, self.fc, self.q, self.gain)
+        return list(b + a)
 
     def __repr__(self):
         return f"{self.filter_type_name} {self.fc} Hz {self.gain} dB {self.q}"
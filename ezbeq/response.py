@@ -0,0 +1,89 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from prometheus_client import Counter
+
+from ezbeq.catalogue import CatalogueEntry, CatalogueProvider
+from ezbeq.iir import FILTER_TYPES, design_biquads, magnitude_response
+
+logger = logging.getLogger('ezbeq.response')
+
+CACHE_REQUESTS = Counter('ezbeq_response_cache_requests', 'Frequency response cache lookups', ['result'])
+
+MAX_POINTS = 2000
+
+
+class InvalidGridError(ValueError):
+    pass
+
+
+class FrequencyResponseService:
+    """
+    Computes the combined magnitude response of the filters in a catalogue entry on a log spaced frequency grid. The
+    response only depends on the filters so is cached by (digest, fs, grid) with least recently used eviction.
+    """
+
+    def __init__(self, catalogue: CatalogueProvider, cache_size: int = 256):
+        self.__catalogue = catalogue
+        self.__cache_size = cache_size
+        self.__cache: OrderedDict[tuple, dict] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def response(self, digest: str, fs: int = 48000, f_min: float = 1.0, f_max: float = 200.0,
+                 points: int = 200) -> dict | None:
+        """
+        :param digest: the entry digest.
+        :param fs: the sample rate to design the filters at.
+        :param f_min: the lowest frequency in the grid.
+        :param f_max: the highest frequency in the grid.
+        :param points: the number of points in the grid.
+        :return: the response or None if there is no such entry, raises InvalidGridError if the grid is invalid.
+        """
+        if fs <= 0:
+            raise InvalidGridError(f'fs must be positive, was {fs}')
+        if not 0 < f_min < f_max < fs / 2:
+            raise InvalidGridError(f'Require 0 < fmin < fmax < fs/2, was {f_min} / {f_max} / {fs}')
+        if not 2 <= points <= MAX_POINTS:
+            raise InvalidGridError(f'points must be between 2 and {MAX_POINTS}, was {points}')
+        key = (digest, fs, f_min, f_max, points)
+        with self.__lock:
+            cached = self.__cache.get(key, None)
+            if cached is not None:
+                self.__cache.move_to_end(key)
+        if cached is not None:
+            CACHE_REQUESTS.labels('hit').inc()
+            return cached
+        CACHE_REQUESTS.labels('miss').inc()
+        entry = self.__catalogue.find(digest, match_on_idx=False)
+        if not isinstance(entry, CatalogueEntry):
+            return None
+        result = {
+            'digest': entry.digest,
+            'title': entry.formatted_title,
+            'fs': fs,
+            **compute_response(entry, fs, f_min, f_max, points)
+        }
+        with self.__lock:
+            self.__cache[key] = result
+            while len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+        return result
+
+
+def compute_response(entry: CatalogueEntry, fs: int, f_min: float, f_max: float, points: int) -> dict:
+    freqs = np.geomspace(f_min, f_max, points)
+    total = np.zeros(points)
+    filters = [f for f in entry.filters if f.get('type') in FILTER_TYPES]
+    if len(filters) != len(entry.filters):
+        logger.warning(f'Ignoring {len(entry.filters) - len(filters)} unsupported filters in {entry.formatted_title}')
+    if filters:
+        a, b = design_biquads([f['type'] for f in filters], [f['freq'] for f in filters], [f['q'] for f in filters],
+                              [f['gain'] for f in filters], [fs])
+        counts = np.array([f.get('count', 1) for f in filters], dtype=np.float64)
+        total = counts @ magnitude_response(a[0], b[0], freqs, fs)
+    return {
+        'freqs': np.round(freqs, 3).tolist(),
+        'magnitude': np.round(total, 3).tolist()
+    }
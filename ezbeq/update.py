@@ -3,6 +3,8 @@ import logging
 import requests
 import semver
 
+from ezbeq.pools import WORKER_POOLS
+
 logger = logging.getLogger('ezbeq.update')
 
 GITHUB_LATEST_RELEASE_URL = 'https://api.github.com/repos/3ll3d00d/ezbeq/releases/latest'
@@ -56,8 +58,7 @@ class UpdateChecker:
             self.__task.stop()
 
     def __check(self):
-        from twisted.internet import reactor
-        reactor.callInThread(self.__do_check)
+        WORKER_POOLS['background'].call_in_thread(self.__do_check)
 
     def __do_check(self):
         result = self.__checker.run(self.__current_version)
@@ -28,11 +28,17 @@ def test_mute_master(single_camilladsp3_client, single_camilladsp3_app, mute_op)
 
     wait().at_most(2 * SECOND).poll_interval(10 * MILLISECOND).with_description('was_muted').until_asserted(was_muted)
 
-    def ui_updated():
-        device_states = take_device_states(config)
-        assert device_states[-1]['mute'] is mute_op
+    if mute_op is True:
+        def ui_updated():
+            device_states = take_device_states(config)
+            assert device_states[-1]['mute'] is mute_op
 
-    wait().at_most(2 * SECOND).poll_interval(10 * MILLISECOND).with_description('ui_updated').until_asserted(ui_updated)
+        wait().at_most(2 * SECOND).poll_interval(10 * MILLISECOND).with_description('ui_updated').until_asserted(
+            ui_updated)
+    else:
+        # the device was not muted so the state is unchanged and is not broadcast again
+        r = single_camilladsp3_client.get("/api/1/devices")
+        assert r.json['mute'] is False
 
 
 @pytest.mark.parametrize("volume", [-10, -15, -20])
@@ -1,3 +1,4 @@
+import copy
 import json
 import logging
 import sqlite3
@@ -7,35 +8,21 @@ import types
 from datetime import UTC, datetime, timedelta
 
 import pytest
+from prometheus_client import REGISTRY
 from pytest_httpserver import HTTPServer
 
+from benchmarks.synthetic import make_catalogues
 from ezbeq.catalogue import (
     DB_BUSY_TIMEOUT_MILLIS,
     TWO_WEEKS_AGO_SECONDS,
     Catalogue,
-    Catalogues,
+    CatalogueEntry,
     DatabaseDownloader,
     compute_freshness,
     db_ops,
+    is_full_scan,
 )
-
-
-def make_catalogues(tmp_path, mmap_mb: int = 0) -> Catalogues:
-    """
-    Build a Catalogues instance without going through __init__, which requires a live
-    WsServer, network access and a running reactor. Tests exercise the private SQL/threading
-    methods directly instead.
-    """
-    cat = Catalogues.__new__(Catalogues)
-    cat._Catalogues__db = str(tmp_path / 'ezbeq.db')
-    cat._Catalogues__catalogue_file = str(tmp_path / 'database.json')
-    cat._Catalogues__version_file = str(tmp_path / 'version.txt')
-    cat._Catalogues__mmap_mb = mmap_mb
-    cat._Catalogues__chunk_sizes = (100, 100)
-    cat._Catalogues__catalogues = []
-    cat._Catalogues__prune_pool = None
-    cat._Catalogues__ensure_db()
-    return cat
+from ezbeq.iir import LowShelf
 
 
 def write_catalogue_json(path, entries):
@@ -134,6 +121,70 @@ class TestInsertAndFind:
         entry = cat.find_by_id('v1_0')
         assert entry.title == 'Alpha One'
 
+    def test_find_matches_entry_built_from_dict(self, tmp_path):
+        cat = self._load(tmp_path)
+        for idx in range(3):
+            from_row = cat.find_by_id(f'v1_{idx}')
+            from_dict = CatalogueEntry(f'v1_{idx}', cat.find_by_id(f'v1_{idx}', as_dict=True))
+            assert from_row.values == from_dict.values
+            assert from_row.freshness == from_dict.freshness
+
+    def test_insert_adds_biquads_for_sample_rates(self, tmp_path):
+        cat = make_catalogues(tmp_path)
+        cat._Catalogues__sample_rates = (48000, 96000)
+        write_catalogue_json(cat._Catalogues__catalogue_file, [{
+            **SAMPLE_ENTRIES[0],
+            'filters': [{'type': 'LowShelf', 'freq': 33.0, 'gain': 5.0, 'q': 0.9,
+                         'biquads': {'96000': {'b': ['1', '0', '0'], 'a': ['0', '0']}}}]
+        }])
+        cat._Catalogues__catalogues = [cat._Catalogues__insert_catalogue('v1')]
+        biquads = cat.find_by_digest('digest-1').filters[0]['biquads']
+        assert biquads['96000'] == {'b': ['1', '0', '0'], 'a': ['0', '0']}
+        expected = LowShelf(48000, 33.0, 0.9, 5.0).format_biquads()
+        assert biquads['48000'] == {'b': [expected['b0'], expected['b1'], expected['b2']],
+                                    'a': [expected['a1'], expected['a2']]}
+
+    def test_find_formats_tv_title(self, tmp_path):
+        cat = self._load(tmp_path)
+        assert cat.find_by_digest('digest-3').formatted_title == 'Gamma Three S1E1-3'
+
+
+class TestCatalogueEntry:
+
+    ROW = ('v1_0', 'Alpha One', 2001, '|DTS-HD MA 5.1|', 'film', 'authorA', None,
+           '[{"type": "PeakingEQ", "freq": 20.0, "gain": 3.0, "q": 1.0}]', '', None, '', '', None, None, '', None,
+           'English', None, None, 'tt001', None, '|Action|Drama|', None, 1611984156, 1611984156, 'digest-1', None, None,
+           120, 1.5, 'Alpha One', '|DTS-HD MA|', '|5.1|')
+
+    def test_has_no_instance_dict(self):
+        assert not hasattr(CatalogueEntry.from_row(self.ROW), '__dict__')
+
+    def test_from_row_decodes_lazily(self):
+        entry = CatalogueEntry.from_row(self.ROW)
+        assert isinstance(entry._filters, str)
+        assert entry.filters == [{'type': 'PeakingEQ', 'freq': 20.0, 'gain': 3.0, 'q': 1.0}]
+        assert entry.filters is entry.filters
+        assert entry.audio_types == ['DTS-HD MA 5.1']
+        assert entry.genres == ['Action', 'Drama']
+        assert entry.images == []
+        assert entry.warning == []
+        assert entry.author == 'authorA'
+        assert entry.catalogue_url == ''
+        assert entry.collection_name is None
+        assert entry.mv_adjust == 1.5
+
+    def test_copy_keeps_mv_adjust_independent(self):
+        entry = CatalogueEntry.from_row(self.ROW)
+        copied = copy.copy(entry)
+        copied.mv_adjust = -2.0
+        assert entry.mv_adjust == 1.5
+        assert copied.filters == entry.filters
+        assert copied.formatted_title == 'Alpha One'
+
+    def test_values_round_trip(self):
+        entry = CatalogueEntry.from_row(self.ROW)
+        assert CatalogueEntry.from_row(entry.values).values == entry.values
+
 
 class TestSearch:
 
@@ -190,6 +241,53 @@ class TestSearch:
         assert results[0]['title'] == 'Alpha One'
 
 
+class TestQueryMetrics:
+
+    def _load(self, tmp_path, slow_query_millis=0):
+        cat = make_catalogues(tmp_path)
+        cat._Catalogues__slow_query_millis = slow_query_millis
+        write_catalogue_json(cat._Catalogues__catalogue_file, SAMPLE_ENTRIES)
+        cat._Catalogues__catalogues = [cat._Catalogues__insert_catalogue('v1')]
+        return cat
+
+    @staticmethod
+    def _sample(name, shape):
+        return REGISTRY.get_sample_value(name, {'shape': shape}) or 0
+
+    def test_search_shape_is_the_facet_combination(self, tmp_path):
+        cat = self._load(tmp_path)
+        before = self._sample('ezbeq_catalogue_query_seconds_count', 'search:author+text')
+        rows_before = self._sample('ezbeq_catalogue_query_rows_sum', 'search:author+text')
+        cat.search(['authorA'], [], [], [], None, 'alpha', [], [], None, None)
+        assert self._sample('ezbeq_catalogue_query_seconds_count', 'search:author+text') == before + 1
+        assert self._sample('ezbeq_catalogue_query_rows_sum', 'search:author+text') == rows_before + 1
+
+    def test_find_records_vm_steps(self, tmp_path):
+        cat = self._load(tmp_path)
+        before = self._sample('ezbeq_catalogue_query_vm_steps_count', 'find_by_digest')
+        assert cat.find_by_digest('digest-2') is not None
+        assert self._sample('ezbeq_catalogue_query_vm_steps_count', 'find_by_digest') == before + 1
+
+    def test_slow_query_captures_plan(self, tmp_path, caplog):
+        cat = self._load(tmp_path, slow_query_millis=1e-6)
+        before = self._sample('ezbeq_catalogue_slow_queries_total', 'whats_new')
+        with caplog.at_level(logging.WARNING, logger='ezbeq.catalogue'):
+            cat.whats_new(0)
+        assert self._sample('ezbeq_catalogue_slow_queries_total', 'whats_new') == before + 1
+        assert any('plan: ' in r.getMessage() and 'entry_version' in r.getMessage() for r in caplog.records)
+
+    def test_no_plan_captured_when_disabled(self, tmp_path, caplog):
+        cat = self._load(tmp_path)
+        with caplog.at_level(logging.WARNING, logger='ezbeq.catalogue'):
+            cat.whats_new(0)
+        assert not [r for r in caplog.records if 'Slow query' in r.getMessage()]
+
+    def test_is_full_scan(self):
+        assert is_full_scan(['SCAN catalogue_entry'])
+        assert not is_full_scan(['SEARCH catalogue_entry USING INDEX entry_version (version=?)'])
+        assert not is_full_scan(['SCAN catalogue_entry USING COVERING INDEX entry_version'])
+
+
 class TestPruneEntries:
 
     def _load_two_versions(self, tmp_path):
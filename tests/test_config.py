@@ -5,7 +5,7 @@ import pytest
 from conftest import StubConfig
 
 from ezbeq.config import MIN_SUPPORTED_PYTHON, Config
-from ezbeq.device import create_devices
+from ezbeq.device import create_devices, filter_sample_rates
 
 EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples')
 
@@ -122,3 +122,15 @@ def test_composite_example_config_rejects_mutations(mutation, match):
     raw_cfg = _RawDevicesConfig(devices)
     with pytest.raises(ValueError, match=match):
         create_devices(raw_cfg, None, None)
+
+
+def test_filter_sample_rates_come_from_configured_devices():
+    raw_cfg = _RawDevicesConfig({
+        'sub': {'type': 'minidsp', 'exe': 'stub'},
+        'ddrc': {'type': 'minidsp', 'exe': 'stub', 'device_type': 'DDRC24'},
+        'htx': {'type': 'minidsp', 'exe': 'stub', 'device_type': 'HTx'},
+        'qsys': {'type': 'qsys', 'ip': '127.0.0.1', 'port': 1710},
+        'jr': {'type': 'jriver', 'address': '127.0.0.1:52199'},
+        'both': {'type': 'composite', 'members': ['sub', 'ddrc']},
+    })
+    assert filter_sample_rates(raw_cfg) == [48000, 96000]
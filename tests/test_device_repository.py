@@ -1,4 +1,20 @@
-from ezbeq.device import Device, DeviceRepository, DeviceState
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from busypie import SECOND, wait
+from prometheus_client import REGISTRY
+from twisted.internet.task import Clock
+
+from ezbeq.device import (
+    Device,
+    DeviceRepository,
+    DeviceState,
+    LevelsSampler,
+    StatePersister,
+)
 
 
 class _FakeState(DeviceState):
@@ -17,9 +33,12 @@ class _FakeDevice(Device):
     degrading gracefully the way minidsp does (see MinidspState(..., connected=False)).
     """
 
-    def __init__(self, name: str, exc: Exception | None = None):
+    def __init__(self, name: str, exc: Exception | None = None, delay: float = 0.0):
         self.__name = name
         self.__exc = exc
+        self.delay = delay
+        self.calls = 0
+        self.refreshes = []
 
     def recover(self):
         self.__exc = None
@@ -33,6 +52,10 @@ class _FakeDevice(Device):
         return 'fake'
 
     def state(self, refresh: bool = False):
+        self.calls += 1
+        self.refreshes.append(refresh)
+        if self.delay:
+            time.sleep(self.delay)
         if self.__exc:
             raise self.__exc
         return _FakeState(self.__name)
@@ -58,12 +81,20 @@ class _FakeDevice(Device):
     def levels(self): raise NotImplementedError
 
 
-def _repo_with(devices: dict[str, Device]) -> DeviceRepository:
+def _repo_with(devices: dict[str, Device], timeout: float = 5.0, max_age: float = 0.0,
+               stale_while_revalidate: float = 0.0) -> DeviceRepository:
     # Bypasses __init__ (which needs a full Config and real create_devices() wiring) to unit test
     # all_devices()'s per-device error isolation directly against hand-built fakes.
     repo = DeviceRepository.__new__(DeviceRepository)
     repo._DeviceRepository__devices = devices
     repo._DeviceRepository__hidden = set()
+    repo._DeviceRepository__timeout = timeout
+    repo._DeviceRepository__max_age = max_age
+    repo._DeviceRepository__stale_while_revalidate = stale_while_revalidate
+    repo._DeviceRepository__executor = ThreadPoolExecutor(max_workers=max(len(devices), 1))
+    repo._DeviceRepository__lock = threading.Lock()
+    repo._DeviceRepository__in_flight = {}
+    repo._DeviceRepository__last_known = {}
     return repo
 
 
@@ -92,3 +123,252 @@ def test_all_devices_recovers_a_previously_failing_device_once_it_stops_raising(
     result = repo.all_devices()
 
     assert set(result.keys()) == {'jriver1'}
+
+
+def test_read_all_reads_devices_in_parallel():
+    repo = _repo_with({n: _FakeDevice(n, delay=0.3) for n in ('sub1', 'sub2', 'jriver1')})
+
+    start = time.time()
+    result = repo.read_all(refresh=True)
+
+    assert time.time() - start < 0.6
+    assert list(result.keys()) == ['sub1', 'sub2', 'jriver1']
+    assert all(r.stale is False and r.latency_millis >= 300 for r in result.values())
+
+
+def test_read_all_returns_last_known_state_of_a_slow_device_as_stale():
+    jriver = _FakeDevice('jriver1')
+    repo = _repo_with({'jriver1': jriver, 'sub1': _FakeDevice('sub1')}, timeout=0.1)
+    assert repo.read_all()['jriver1'].stale is False
+
+    jriver.delay = 0.5
+    result = repo.read_all()
+
+    assert result['jriver1'].stale is True
+    assert result['jriver1'].serialise() == {'name': 'jriver1', 'stale': True,
+                                             'latencyMillis': result['jriver1'].latency_millis}
+    assert result['sub1'].stale is False
+
+
+def test_read_all_excludes_a_slow_device_with_no_known_state():
+    repo = _repo_with({'jriver1': _FakeDevice('jriver1', delay=0.5), 'sub1': _FakeDevice('sub1')}, timeout=0.1)
+
+    assert set(repo.read_all().keys()) == {'sub1'}
+
+
+def test_read_all_does_not_pile_up_reads_on_a_slow_device():
+    jriver = _FakeDevice('jriver1', delay=0.3)
+    repo = _repo_with({'jriver1': jriver}, timeout=0.05)
+
+    repo.read_all()
+    repo.read_all()
+    time.sleep(0.4)
+
+    assert jriver.calls == 1
+
+
+def test_refresh_does_not_share_a_read_without_refresh():
+    jriver = _FakeDevice('jriver1', delay=0.2)
+    repo = _repo_with({'jriver1': jriver})
+    plain = threading.Thread(target=repo.read_all)
+    plain.start()
+    wait().at_most(2, SECOND).until(lambda: jriver.calls == 1)
+
+    repo.read_all(refresh=True)
+    plain.join(2)
+
+    assert jriver.refreshes == [False, True]
+
+
+def test_read_all_reuses_a_recent_read():
+    sub = _FakeDevice('sub1')
+    repo = _repo_with({'sub1': sub}, max_age=10.0)
+
+    repo.read_all(refresh=True)
+    result = repo.read_all(refresh=True)
+
+    assert sub.calls == 1
+    assert result['sub1'].stale is False
+
+
+def test_read_all_returns_an_old_read_while_revalidating():
+    sub = _FakeDevice('sub1')
+    repo = _repo_with({'sub1': sub}, max_age=0.0, stale_while_revalidate=10.0)
+    repo.read_all(refresh=True)
+    sub.delay = 0.3
+
+    start = time.time()
+    concurrent = [repo.read_all(refresh=True) for _ in range(3)]
+
+    assert time.time() - start < 0.2
+    assert all(r['sub1'].stale is True for r in concurrent)
+    time.sleep(0.4)
+    assert sub.calls == 2
+    assert repo.read_all(refresh=True, max_age=1.0)['sub1'].stale is False
+    assert sub.calls == 2
+
+
+def test_read_all_with_max_age_never_returns_an_old_read():
+    sub = _FakeDevice('sub1')
+    repo = _repo_with({'sub1': sub}, max_age=10.0, stale_while_revalidate=10.0)
+    repo.read_all(refresh=True)
+
+    result = repo.read_all(refresh=True, max_age=0.0)
+
+    assert sub.calls == 2
+    assert result['sub1'].stale is False
+
+
+class TestStatePersister:
+
+    def test_writes_within_window_are_coalesced(self, tmp_path):
+        persister = StatePersister(window=0.2)
+        state_file = str(tmp_path / 'd1.json')
+        for i in range(5):
+            persister.persist('d1', state_file, f'{{"v": {i}}}')
+        assert not os.path.exists(state_file)
+
+        wait().at_most(2, SECOND).until(lambda: os.path.exists(state_file))
+        with open(state_file) as f:
+            assert f.read() == '{"v": 4}'
+        assert REGISTRY.get_sample_value('ezbeq_device_state_writes_coalesced_total', {'device': 'd1'}) >= 4
+
+    def test_flush_writes_pending_state_immediately(self, tmp_path):
+        persister = StatePersister(window=60)
+        state_file = str(tmp_path / 'd2.json')
+        persister.persist('d2', state_file, '{}')
+
+        persister.flush()
+
+        assert os.path.exists(state_file)
+        assert not os.path.exists(state_file + '.tmp')
+        assert REGISTRY.get_sample_value('ezbeq_device_state_flush_seconds_count', {'device': 'd2'}) == 1
+
+    def test_unchanged_state_is_not_rewritten(self, tmp_path):
+        persister = StatePersister(window=0)
+        state_file = str(tmp_path / 'd3.json')
+        persister.persist('d3', state_file, '{}')
+
+        persister.persist('d3', state_file, '{}')
+
+        assert REGISTRY.get_sample_value('ezbeq_device_state_writes_skipped_total', {'device': 'd3'}) == 1
+        assert REGISTRY.get_sample_value('ezbeq_device_state_flush_seconds_count', {'device': 'd3'}) == 1
+
+    def test_state_is_rewritten_if_file_changed_externally(self, tmp_path):
+        persister = StatePersister(window=0)
+        state_file = str(tmp_path / 'd4.json')
+        persister.persist('d4', state_file, '{}')
+        os.remove(state_file)
+
+        persister.persist('d4', state_file, '{}')
+        assert os.path.exists(state_file)
+
+        with open(state_file, 'w') as f:
+            f.write('{"other": true}')
+        os.utime(state_file, ns=(0, 0))
+        persister.persist('d4', state_file, '{}')
+
+        with open(state_file) as f:
+            assert f.read() == '{}'
+        assert REGISTRY.get_sample_value('ezbeq_device_state_writes_skipped_total', {'device': 'd4'}) is None
+
+    def test_flush_is_not_overwritten_by_an_older_background_write(self, tmp_path):
+        persister = StatePersister(window=0.01)
+        state_file = str(tmp_path / 'd5.json')
+        write = persister._StatePersister__write
+        writing = threading.Event()
+        release = threading.Event()
+
+        def slow_write(name, file_name, content):
+            if content == 'A':
+                writing.set()
+                release.wait(5)
+            write(name, file_name, content)
+
+        persister._StatePersister__write = slow_write
+        persister.persist('d5', state_file, 'A')
+        assert writing.wait(5)
+        persister.persist('d5', state_file, 'B')
+        flusher = threading.Thread(target=persister.flush)
+        flusher.start()
+        release.set()
+        flusher.join(5)
+
+        with open(state_file) as f:
+            assert f.read() == 'B'
+
+
+class _FakeLevelsServer:
+
+    def __init__(self):
+        self.fps: float | None = None
+
+    def levels_fps(self, device: str) -> float | None:
+        return self.fps
+
+
+class TestLevelsSampler:
+
+    def test_repeated_starts_share_one_sampler(self):
+        clock = Clock()
+        ws = _FakeLevelsServer()
+        ws.fps = float('inf')
+        samples = []
+        sampler = LevelsSampler('d1', ws, lambda: samples.append(clock.seconds()), 10, clock=clock)
+
+        for _ in range(5):
+            sampler.start()
+        clock.advance(1.0)
+        for _ in range(9):
+            clock.advance(0.1)
+
+        assert len(clock.getDelayedCalls()) == 1
+        assert len(samples) == 10
+
+    def test_rate_follows_the_fastest_subscriber(self):
+        clock = Clock()
+        ws = _FakeLevelsServer()
+        ws.fps = 2
+        samples = []
+        sampler = LevelsSampler('d1', ws, lambda: samples.append(clock.seconds()), 10, clock=clock)
+
+        sampler.start()
+        clock.pump([0.5] * 4)
+        assert samples == [0.5, 1.0, 1.5, 2.0]
+
+        # the sample already scheduled at the old rate goes first
+        ws.fps = 5
+        clock.pump([0.5] + [0.2] * 3)
+        assert samples[4:] == pytest.approx([2.5, 2.7, 2.9, 3.1])
+
+    def test_stops_when_the_last_subscriber_leaves(self):
+        clock = Clock()
+        ws = _FakeLevelsServer()
+        ws.fps = 10
+        samples = []
+        sampler = LevelsSampler('d1', ws, lambda: samples.append(clock.seconds()), 10, clock=clock)
+
+        sampler.start()
+        clock.advance(0.1)
+        ws.fps = None
+        clock.advance(0.1)
+        clock.advance(1.0)
+
+        assert len(samples) == 2
+        assert not sampler.running
+        assert not clock.getDelayedCalls()
+
+    def test_keeps_sampling_after_a_failure(self):
+        clock = Clock()
+        ws = _FakeLevelsServer()
+        ws.fps = 10
+        calls = []
+
+        def sample():
+            calls.append(1)
+            raise ValueError('boom')
+
+        LevelsSampler('d1', ws, sample, 10, clock=clock).start()
+        clock.pump([0.1] * 3)
+
+        assert len(calls) == 3
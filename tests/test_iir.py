@@ -0,0 +1,58 @@
+import decimal
+import random
+
+import pytest
+
+from ezbeq.iir import (
+    FILTER_TYPES,
+    coefficients,
+    design_biquads,
+    float_to_str,
+    format_designed_biquads,
+    formatted_coefficients,
+    make_biquad,
+)
+
+
+def test_float_to_str_matches_decimal_formatting():
+    ctx = decimal.Context()
+    ctx.prec = 17
+    rng = random.Random(1)
+    vals = [rng.uniform(-3, 3) * 10 ** rng.randint(-20, 5) for _ in range(10000)] + [0.0, -0.0, 1.0, 1e-7, 1e17]
+    for v in vals:
+        assert float_to_str(v) == format(ctx.create_decimal(repr(v)), 'f')
+
+
+def test_float_to_str_never_uses_exponent():
+    assert float_to_str(1.5e-7) == '0.00000015'
+
+
+@pytest.mark.parametrize('filter_type', FILTER_TYPES.keys())
+def test_cached_coefficients_match_biquad(filter_type):
+    f = make_biquad(filter_type, 48000, 33.0, 0.9, 5.0)
+    assert coefficients(filter_type, 48000, 33.0, 0.9, 5.0) == (tuple(f.a), tuple(f.b))
+    assert formatted_coefficients(filter_type, 48000, 33.0, 0.9, 5.0) == tuple(f.format_biquads().values())
+
+
+def test_unknown_filter_type():
+    with pytest.raises(ValueError):
+        make_biquad('Notch', 48000, 33.0, 0.9, 5.0)
+    with pytest.raises(ValueError):
+        design_biquads(['PeakingEQ', 'Notch'], [10, 20], [1, 1], [1, 1], [48000])
+
+
+def test_batch_design_matches_scalar_design():
+    rng = random.Random(2)
+    filters = [(rng.choice(list(FILTER_TYPES)), round(rng.uniform(5, 200), 1), rng.choice([0.5, 0.707, 1.23456]),
+                round(rng.uniform(-12, 12), 2)) for _ in range(500)]
+    sample_rates = [48000, 96000]
+    a, b = design_biquads(*[list(x) for x in zip(*filters, strict=True)], sample_rates)
+    assert a.shape == (2, 500, 3)
+    formatted = format_designed_biquads(a, b)
+    for i, fs in enumerate(sample_rates):
+        for j, (t, freq, q, gain) in enumerate(filters):
+            scalar = make_biquad(t, fs, freq, q, gain)
+            assert a[i, j].tolist() == pytest.approx(scalar.a, rel=1e-12)
+            assert b[i, j].tolist() == pytest.approx(scalar.b, rel=1e-12)
+            expected = [float(x) for x in scalar.format_biquads().values()]
+            assert [float(x) for x in formatted[i][j]] == pytest.approx(expected, rel=1e-12)
@@ -0,0 +1,196 @@
+import logging
+import threading
+import xml.etree.ElementTree as et
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug import Request, Response
+
+from ezbeq.jriver import DSPMismatchError, MediaServer, dsp_digest, dsp_wildcards
+
+MCWS = '/MCWS/v1'
+DSP = '<DSP Version="1"><Item Name="Parametric Equalizer"><Item Name="Enabled">1</Item></Item></DSP>'
+OTHER_DSP = '<DSP Version="1"><Item Name="Parametric Equalizer"><Item Name="Enabled">0</Item></Item></DSP>'
+ZONES = '<Response Status="OK"><Item Name="NumberZones">2</Item>' \
+        '<Item Name="ZoneID0">10001</Item><Item Name="ZoneName0">Player</Item><Item Name="ZoneDLNA0">0</Item>' \
+        '<Item Name="ZoneID1">10002</Item><Item Name="ZoneName1">Remote</Item><Item Name="ZoneDLNA1">1</Item>' \
+        '</Response>'
+
+
+class FakeMCWS:
+    """
+    Just enough of MCWS to authenticate, list zones and save and load a DSP preset.
+    """
+
+    def __init__(self, httpserver: HTTPServer):
+        self.tokens = 0
+        self.dsp = DSP
+        self.expire_token = False
+        self.ignore_loads = False
+        httpserver.expect_request(f'{MCWS}/Authenticate').respond_with_handler(self.__authenticate)
+        httpserver.expect_request(f'{MCWS}/Playback/Zones').respond_with_handler(self.__authorised(lambda r: ZONES))
+        httpserver.expect_request(f'{MCWS}/Playback/SaveDSPPreset').respond_with_handler(
+            self.__authorised(lambda r: self.dsp))
+        httpserver.expect_request(f'{MCWS}/Playback/LoadDSPPreset', method='POST').respond_with_handler(
+            self.__authorised(self.__load))
+        self.__httpserver = httpserver
+
+    def __authenticate(self, request: Request) -> Response:
+        self.tokens += 1
+        return Response(f'<Response Status="OK"><Item Name="Token">t{self.tokens}</Item></Response>')
+
+    def __authorised(self, handler):
+        def handle(request: Request) -> Response:
+            if self.expire_token or request.args.get('Token') != f't{self.tokens}':
+                self.expire_token = False
+                return Response('Unauthorized', status=401)
+            return Response(handler(request))
+
+        return handle
+
+    def __load(self, request: Request) -> str:
+        if not self.ignore_loads:
+            self.dsp = request.form['Name']
+        return '<Response Status="OK"/>'
+
+    @property
+    def calls(self) -> list[str]:
+        return [req.path[len(MCWS) + 1:] for req, _ in self.__httpserver.log if req.path.startswith(MCWS)]
+
+
+@pytest.fixture
+def mcws(httpserver: HTTPServer) -> FakeMCWS:
+    return FakeMCWS(httpserver)
+
+
+def make_server(httpserver: HTTPServer, **kwargs) -> MediaServer:
+    return MediaServer(f'{httpserver.host}:{httpserver.port}', **kwargs)
+
+
+def test_reuses_token(httpserver, mcws):
+    server = make_server(httpserver)
+
+    for _ in range(3):
+        assert server.get_dsp('10001') == DSP
+
+    assert mcws.calls == ['Authenticate'] + ['Playback/SaveDSPPreset'] * 3
+
+
+def test_reauthenticates_when_token_rejected(httpserver, mcws):
+    server = make_server(httpserver)
+    server.get_dsp('10001')
+    mcws.expire_token = True
+
+    assert server.get_dsp('10001') == DSP
+
+    assert mcws.calls == ['Authenticate', 'Playback/SaveDSPPreset', 'Playback/SaveDSPPreset', 'Authenticate',
+                          'Playback/SaveDSPPreset']
+    assert mcws.tokens == 2
+
+
+def test_calls_from_many_threads(httpserver, mcws):
+    server = make_server(httpserver)
+    server.authenticate()
+    barrier = threading.Barrier(4)
+    results = {}
+
+    def read(i: int):
+        barrier.wait(5)
+        results[i] = (server.get_dsp('10001'), server._MediaServer__session)
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    assert [dsp for dsp, _ in results.values()] == [DSP] * 4
+    assert len({id(session) for _, session in results.values()}) == 4
+    assert mcws.tokens == 1
+
+
+@pytest.mark.parametrize('ttl,zone_calls', [(300.0, 1), (0.0, 2)])
+def test_caches_zones(httpserver, mcws, ttl, zone_calls):
+    server = make_server(httpserver, zones_ttl=ttl)
+
+    for _ in range(2):
+        assert server.get_zones() == {'10001': {'id': '10001', 'name': 'Player'}}
+
+    assert mcws.calls.count('Playback/Zones') == zone_calls
+
+
+def test_hash_verify_loads_in_two_calls(httpserver, mcws, caplog):
+    server = make_server(httpserver, verify='hash')
+    server.authenticate()
+    current = server.get_dsp('10001')
+
+    assert server.set_dsp('10001', current.replace('>1<', '>0<')) is True
+
+    assert mcws.calls == ['Authenticate', 'Playback/SaveDSPPreset', 'Playback/LoadDSPPreset']
+    with caplog.at_level(logging.WARNING, logger='ezbeq.jriver'):
+        server.get_dsp('10001')
+    assert not [r for r in caplog.records if 'does not match' in r.message]
+
+
+def test_hash_verify_warns_on_next_read_if_load_did_not_take(httpserver, mcws, caplog):
+    server = make_server(httpserver, verify='hash')
+    mcws.ignore_loads = True
+    server.set_dsp('10001', OTHER_DSP)
+
+    with caplog.at_level(logging.WARNING, logger='ezbeq.jriver'):
+        server.get_dsp('10001')
+        server.get_dsp('10001')
+
+    assert len([r for r in caplog.records if 'does not match' in r.message]) == 1
+
+
+def test_full_verify_is_the_default(httpserver, mcws):
+    server = make_server(httpserver)
+
+    assert server.set_dsp('10001', OTHER_DSP) is True
+
+    assert mcws.calls == ['Authenticate', 'Playback/LoadDSPPreset', 'Playback/SaveDSPPreset']
+
+
+def test_full_verify_raises_on_mismatch(httpserver, mcws):
+    server = make_server(httpserver, verify='full')
+    mcws.ignore_loads = True
+
+    with pytest.raises(DSPMismatchError):
+        server.set_dsp('10001', OTHER_DSP)
+
+
+def test_unknown_verify_mode():
+    with pytest.raises(ValueError):
+        MediaServer('127.0.0.1:52199', verify='maybe')
+
+
+def test_dsp_digest_ignores_formatting():
+    a = et.fromstring('<DSP Version="1" Other="2"><Item Name="x"> 1 </Item></DSP>')
+    b = et.fromstring('<DSP Other="2" Version="1">\r\n  <Item Name="x">1</Item>\r\n</DSP>')
+    c = et.fromstring('<DSP Other="2" Version="1"><Item Name="x">2</Item></DSP>')
+
+    assert dsp_digest(a) == dsp_digest(b)
+    assert dsp_digest(a) != dsp_digest(c)
+
+
+def test_dsp_digest_honours_wildcards():
+    sent = et.fromstring('<DSP Version="1"><Item Name="x">*</Item><Item Name="y">1</Item></DSP>')
+    read = et.fromstring('<DSP Version="1"><Item Name="x">5</Item><Item Name="y">1</Item></DSP>')
+    other = et.fromstring('<DSP Version="1"><Item Name="x">5</Item><Item Name="y">2</Item></DSP>')
+    wildcards = dsp_wildcards(sent)
+
+    assert wildcards == {(1, 'text')}
+    assert dsp_digest(sent, wildcards) == dsp_digest(read, wildcards)
+    assert dsp_digest(sent, wildcards) != dsp_digest(other, wildcards)
+
+
+def test_hash_verify_honours_wildcards(httpserver, mcws, caplog):
+    server = make_server(httpserver, verify='hash')
+    mcws.ignore_loads = True
+
+    with caplog.at_level(logging.WARNING, logger='ezbeq.jriver'):
+        server.set_dsp('10001', DSP.replace('>1<', '>*<'))
+        server.get_dsp('10001')
+
+    assert not [r for r in caplog.records if 'does not match' in r.message]
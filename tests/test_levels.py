@@ -0,0 +1,54 @@
+import pytest
+
+from ezbeq.levels import LevelsHistory
+
+
+def test_empty_history():
+    assert LevelsHistory(10).query() == {'ts': [], 'levels': {}}
+
+
+def test_oldest_levels_are_overwritten():
+    history = LevelsHistory(3)
+    for i in range(5):
+        history.append(float(i), {'I0': -float(i), 'O0': -10.0 - i})
+
+    assert len(history) == 3
+    assert history.query() == {
+        'ts': [2.0, 3.0, 4.0],
+        'levels': {
+            'I0': {'min': [-2.0, -3.0, -4.0], 'max': [-2.0, -3.0, -4.0], 'mean': [-2.0, -3.0, -4.0]},
+            'O0': {'min': [-12.0, -13.0, -14.0], 'max': [-12.0, -13.0, -14.0], 'mean': [-12.0, -13.0, -14.0]},
+        }
+    }
+
+
+def test_query_since():
+    history = LevelsHistory(10)
+    for i in range(5):
+        history.append(float(i), {'I0': -float(i)})
+
+    assert history.query(since=3.0)['ts'] == [3.0, 4.0]
+
+
+def test_downsampling():
+    history = LevelsHistory(100)
+    for i in range(10):
+        history.append(float(i), {'I0': float(i % 4)})
+
+    result = history.query(points=3)
+
+    # buckets of 3, 3 and 4 samples
+    assert result['ts'] == pytest.approx([1.0, 4.0, 7.5])
+    assert result['levels']['I0'] == {'min': [0.0, 0.0, 0.0], 'max': [2.0, 3.0, 3.0], 'mean': [1.0, 1.33, 1.5]}
+
+
+def test_new_series_start_again():
+    history = LevelsHistory(10)
+    history.append(1.0, {'I0': -1.0})
+    history.append(2.0, {'I0': -2.0, 'I1': -3.0})
+
+    assert history.query() == {
+        'ts': [2.0],
+        'levels': {'I0': {'min': [-2.0], 'max': [-2.0], 'mean': [-2.0]},
+                   'I1': {'min': [-3.0], 'max': [-3.0], 'mean': [-3.0]}}
+    }
@@ -2,6 +2,7 @@ import json
 import os
 
 import pytest
+from busypie import SECOND, wait
 from conftest import MinidspSpy, MinidspSpyConfig
 
 
@@ -48,6 +49,32 @@ def test_devices(minidsp_client, minidsp_app):
     verify_default_device_state(r.json)
 
 
+def test_devices_v2_reuses_recent_state(minidsp_client, minidsp_app, monkeypatch):
+    reads = []
+    get_item = MinidspSpy.__getitem__
+
+    def counting_get_item(self, item):
+        if item == ('-o', 'jsonline'):
+            reads.append(item)
+        return get_item(self, item)
+
+    monkeypatch.setattr(MinidspSpy, '__getitem__', counting_get_item)
+    r = minidsp_client.get("/api/2/devices")
+    assert r.status_code == 200
+    assert r.json['master']['stale'] is False
+    assert 'latencyMillis' in r.json['master']
+    initial_reads = len(reads)
+
+    assert minidsp_client.get("/api/2/devices").status_code == 200
+    assert len(reads) == initial_reads
+
+    assert minidsp_client.get("/api/2/devices?maxAge=0").status_code == 200
+    assert len(reads) == initial_reads + 1
+
+    assert minidsp_client.get("/api/2/devices", headers={'Cache-Control': 'no-cache'}).status_code == 200
+    assert len(reads) == initial_reads + 2
+
+
 @pytest.mark.parametrize("slot", [1, 2, 3, 4])
 @pytest.mark.parametrize("mute_op", ['on', 'off'])
 def test_legacy_mute_both_inputs(minidsp_client, minidsp_app, slot, mute_op):
@@ -2409,6 +2436,8 @@ def test_persist_is_atomic(minidsp_client, minidsp_app):
     # trigger a state-mutating operation so _persist() is called
     r = minidsp_client.put('/api/1/devices/master/config/1/active')
     assert r.status_code == 200
+    # state is written behind the request so wait for it
+    wait().at_most(3, SECOND).until(lambda: os.path.exists(state_file))
 
     # the .tmp scratch file must not linger after _persist() completes
     assert not os.path.exists(tmp_file), '.tmp file was not cleaned up — os.replace() may not have been called'
@@ -2797,6 +2826,32 @@ def test_get_by_digest_404(minidsp_client, minidsp_app, endpoint):
     assert r.status_code == 404
 
 
+def test_get_response(minidsp_client, minidsp_app):
+    r = minidsp_client.get("/api/1/catalogue/abcdefghijklm/response?fs=96000&points=50")
+    assert r.status_code == 200
+    response = r.json
+    assert response['digest'] == 'abcdefghijklm'
+    assert response['fs'] == 96000
+    assert len(response['freqs']) == 50
+    assert len(response['magnitude']) == 50
+    assert response['freqs'][0] == pytest.approx(1.0)
+    assert response['freqs'][-1] == pytest.approx(200.0)
+    # 5 x 5dB low shelves at 33Hz
+    assert response['magnitude'][0] == pytest.approx(25.0, abs=0.1)
+    assert abs(response['magnitude'][-1]) < 1.0
+
+
+def test_get_response_404(minidsp_client, minidsp_app):
+    r = minidsp_client.get("/api/1/catalogue/abcdefghijkl/response")
+    assert r.status_code == 404
+
+
+@pytest.mark.parametrize('query', ['fmin=0', 'fmax=30000', 'fmin=100&fmax=50', 'points=1', 'points=100000'])
+def test_get_response_invalid_grid(minidsp_client, minidsp_app, query):
+    r = minidsp_client.get(f"/api/1/catalogue/abcdefghijklm/response?{query}")
+    assert r.status_code == 400
+
+
 @pytest.mark.parametrize('dt,exp', [
     ('24HD', 'Minidsp24HD'),
     ('DDRC24', 'MinidspDDRC24'),
@@ -2932,3 +2987,34 @@ def test_cfg_makes_custom_minidsp():
     assert desc.peq_routes[2].channels == [1, 2, 3]
     assert desc.peq_routes[2].beq_slots == [0, 1]
     assert not desc.peq_routes[2].groups
+
+
+def test_levels_history(minidsp_client):
+    for _ in range(3):
+        assert minidsp_client.get('/api/1/devices/master/levels').status_code == 200
+
+    r = minidsp_client.get('/api/1/devices/master/levels/history?points=2')
+
+    assert r.status_code == 200
+    assert r.json['name'] == 'master'
+    assert len(r.json['ts']) == 2
+    assert list(r.json['levels'].keys()) == ['I0', 'I1', 'O0', 'O1', 'O2', 'O3']
+    assert r.json['levels']['O0'] == {'min': [-120.0, -120.0], 'max': [-120.0, -120.0], 'mean': [-120.0, -120.0]}
+
+
+def test_levels_history_for_unknown_device(minidsp_client):
+    assert minidsp_client.get('/api/1/devices/nope/levels/history').status_code == 404
+
+
+@pytest.mark.parametrize('query', ['points=0', 'points=-1', 'seconds=-5'])
+def test_levels_history_rejects_invalid_args(minidsp_client, query):
+    assert minidsp_client.get(f'/api/1/devices/master/levels/history?{query}').status_code == 400
+
+
+def test_levels_history_for_no_time(minidsp_client):
+    assert minidsp_client.get('/api/1/devices/master/levels').status_code == 200
+
+    r = minidsp_client.get('/api/1/devices/master/levels/history?seconds=0')
+
+    assert r.status_code == 200
+    assert r.json['ts'] == []
@@ -0,0 +1,291 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from conftest import CapturingWsServer, MinidspSpy
+from plumbum import ProcessExecutionError
+
+from ezbeq.device import UnableToPatchDeviceError
+from ezbeq.minidsp import BiquadWriteCache, Minidsp, MinidspCommandQueue, merge_key
+
+
+class ReadCountingSpy(MinidspSpy):
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def __getitem__(self, item):
+        if item == ('-o', 'jsonline'):
+            self.reads += 1
+        return super().__getitem__(item)
+
+
+@pytest.fixture
+def spy() -> ReadCountingSpy:
+    return ReadCountingSpy()
+
+
+def make_device(spy: MinidspSpy, tmp_path, **kwargs) -> Minidsp:
+    cfg = {
+        'type': 'minidsp',
+        'exe': 'minidsp',
+        'cmdTimeout': 2,
+        'make_runner': lambda exe, options: spy,
+        **kwargs
+    }
+    device = Minidsp('master', str(tmp_path), cfg, CapturingWsServer(), None)
+    device.state()
+    return device
+
+
+class TestActiveSlotTracking:
+
+    def test_repeated_commands_do_not_reread_state(self, spy: ReadCountingSpy, tmp_path):
+        device = make_device(spy, tmp_path)
+        spy.reads = 0
+
+        for gain in (-1.0, -2.0, -3.0):
+            device.set_gain('2', 1, gain)
+
+        assert spy.reads == 0
+        assert spy.take_commands() == ['config 1', 'input 0 gain -- -1.00', 'input 0 gain -- -2.00',
+                                       'input 0 gain -- -3.00']
+
+    def test_state_is_reread_when_stale(self, spy: ReadCountingSpy, tmp_path):
+        device = make_device(spy, tmp_path, activeSlotTtl=0)
+        spy.reads = 0
+
+        device.set_gain('1', 1, -1.0)
+        device.set_gain('1', 1, -2.0)
+
+        assert spy.reads == 2
+        assert spy.take_commands() == ['input 0 gain -- -1.00', 'input 0 gain -- -2.00']
+
+    def test_ws_stream_updates_active_slot(self, spy: ReadCountingSpy, tmp_path):
+        device = make_device(spy, tmp_path)
+        device.set_gain('1', 1, -1.0)
+        spy.take_commands()
+        spy.reads = 0
+
+        device.on_ws_message({'master': {'preset': 3, 'volume': 0.0, 'mute': False}})
+        device.set_gain('1', 1, -2.0)
+
+        assert spy.reads == 0
+        assert spy.take_commands() == ['config 0', 'input 0 gain -- -2.00']
+
+
+@pytest.mark.parametrize('cmd,key', [
+    ('input 0 gain -- -1.00', 'input 0 gain'),
+    ('gain -- -10.00', 'gain'),
+    ('mute on', 'mute'),
+    ('output 2 mute off', 'output 2 mute'),
+    ('input 1 peq 3 bypass on', 'input 1 peq 3 bypass'),
+    ('input 1 peq 3 set -- 1.0 0.0 0.0 0.0 0.0', None),
+    ('input 0 peq all bypass on', None),
+    ('output 0 crossover 1 2 bypass on', None),
+    ('input 0 polarity inverted', None),
+    ('config 1', None),
+])
+def test_merge_key(cmd, key):
+    assert merge_key(cmd) == key
+
+
+class TestCommandQueue:
+
+    @staticmethod
+    def make_queue(sent: list, blocker: threading.Event | None = None) -> MinidspCommandQueue:
+        def send(cmds, slot):
+            if blocker:
+                blocker.wait(timeout=2)
+            sent.append((slot, cmds))
+
+        return MinidspCommandQueue('test', ThreadPoolExecutor(max_workers=1), send)
+
+    def test_submissions_while_busy_are_merged(self):
+        sent = []
+        blocker = threading.Event()
+        queue = self.make_queue(sent, blocker)
+        first = queue.submit(1, ['input 0 gain -- -1.00'])
+        pending = [
+            queue.submit(1, ['input 0 gain -- -2.00']),
+            queue.submit(None, ['mute on']),
+            queue.submit(1, ['input 1 gain -- -1.00', 'input 0 gain -- -3.00']),
+        ]
+        blocker.set()
+        for f in [first] + pending:
+            f.result(timeout=2)
+
+        assert sent == [
+            (1, ['input 0 gain -- -1.00']),
+            (1, ['mute on', 'input 1 gain -- -1.00', 'input 0 gain -- -3.00']),
+        ]
+
+    def test_raw_bypass_all_is_not_merged_with_per_index_bypass(self):
+        sent = []
+        blocker = threading.Event()
+        queue = self.make_queue(sent, blocker)
+        first = queue.submit(1, ['mute on'])
+        pending = [
+            queue.submit(1, ['input 0 peq 0 bypass on']),
+            queue.submit(1, ['input 0 peq all bypass on']),
+            queue.submit(1, ['input 0 peq 0 bypass off', 'input 0 peq all bypass off']),
+        ]
+        blocker.set()
+        for f in [first] + pending:
+            f.result(timeout=2)
+
+        assert sent[1] == (1, ['input 0 peq all bypass on', 'input 0 peq 0 bypass off', 'input 0 peq all bypass off'])
+
+    def test_different_slots_are_not_merged(self):
+        sent = []
+        blocker = threading.Event()
+        queue = self.make_queue(sent, blocker)
+        futures = [queue.submit(0, ['mute on']), queue.submit(1, ['mute off']), queue.submit(2, ['mute on'])]
+        blocker.set()
+        for f in futures:
+            f.result(timeout=2)
+
+        assert sent == [(0, ['mute on']), (1, ['mute off']), (2, ['mute on'])]
+
+    def test_failure_is_reported_to_every_merged_submission(self):
+        blocker = threading.Event()
+
+        def send(cmds, slot):
+            blocker.wait(timeout=2)
+            if len(cmds) > 1:
+                raise ValueError('boom')
+
+        queue = MinidspCommandQueue('test', ThreadPoolExecutor(max_workers=1), send)
+        queue.submit(1, ['mute on'])
+        merged = [queue.submit(1, ['input 0 mute on']), queue.submit(1, ['input 1 mute on'])]
+        blocker.set()
+
+        for f in merged:
+            with pytest.raises(ValueError):
+                f.result(timeout=2)
+
+
+def test_patch_sends_slot_changes_as_one_batch(spy: ReadCountingSpy, tmp_path):
+    device = make_device(spy, tmp_path)
+    spy.history.clear()
+
+    device.update({'slots': [{
+        'id': '2',
+        'gains': [{'id': '1', 'value': -1.0}, {'id': '2', 'value': -2.0}],
+        'mutes': [{'id': '1', 'value': True}],
+        'outputGains': [{'id': '3', 'value': 1.5}],
+        'outputMutes': [{'id': '4', 'value': False}],
+    }]})
+
+    assert len(spy.history) == 1
+    assert spy.take_commands() == ['config 1', 'input 0 gain -- -1.00', 'input 1 gain -- -2.00', 'input 0 mute on',
+                                   'output 2 gain -- 1.50', 'output 3 mute off']
+    slot = device.state().get_slot('2').as_dict()
+    assert slot['active'] is True
+    assert [g['value'] for g in slot['gains']] == [-1.0, -2.0]
+    assert [m['value'] for m in slot['mutes']] == [True, False]
+
+
+class TestBiquadDiffing:
+
+    def test_only_changed_biquads_are_sent(self):
+        cache = BiquadWriteCache()
+        cache.record(1, ['input 0 peq 0 set -- 1 0 0 0 0', 'input 0 peq 0 bypass off', 'input 0 peq 1 bypass on'])
+
+        assert cache.diff(1, [
+            'input 0 peq 0 set -- 1 0 0 0 0',
+            'input 0 peq 0 bypass off',
+            'input 0 peq 1 set -- 2 0 0 0 0',
+            'input 0 peq 1 bypass off',
+            'input 0 gain -- 0.00',
+        ]) == ['input 0 peq 1 set -- 2 0 0 0 0', 'input 0 peq 1 bypass off', 'input 0 gain -- 0.00']
+        assert cache.diff(2, ['input 0 peq 0 bypass off']) == ['input 0 peq 0 bypass off']
+
+    def test_unknown_commands_invalidate_the_slot(self):
+        cache = BiquadWriteCache()
+        cache.record(1, ['input 0 peq 0 bypass off'])
+        cache.record(2, ['input 0 peq 0 bypass off'])
+        cache.record(1, ['input 0 peq all bypass on'])
+
+        assert cache.diff(1, ['input 0 peq 0 bypass off']) == ['input 0 peq 0 bypass off']
+        assert cache.diff(2, ['input 0 peq 0 bypass off']) == []
+
+    def test_reloading_biquads_sends_nothing(self, spy: ReadCountingSpy, tmp_path):
+        device = make_device(spy, tmp_path, diffBiquads=True)
+        biquads = [{'b0': '1.0', 'b1': '0.5', 'b2': '0.25', 'a1': '0.1', 'a2': '0.2'}]
+        device.load_biquads('1', True, [1], [], biquads)
+        assert len(spy.take_commands()) == 11
+        spy.history.clear()
+
+        device.load_biquads('1', True, [1], [], biquads)
+        assert not spy.history
+
+        device.load_biquads('1', True, [1], [], [{**biquads[0], 'b0': '0.9'}])
+        assert spy.take_commands() == ['input 0 peq 0 set -- 0.9 0.5 0.25 0.1 0.2']
+
+    def test_failure_invalidates_everything(self, spy: ReadCountingSpy, tmp_path):
+        device = make_device(spy, tmp_path, diffBiquads=True)
+        biquads = [{'b0': '1.0', 'b1': '0.5', 'b2': '0.25', 'a1': '0.1', 'a2': '0.2'}]
+        device.load_biquads('1', False, [1], [], biquads)
+        spy.take_commands()
+
+        spy.run = lambda *args, **kwargs: (_ for _ in ()).throw(ProcessExecutionError([], 1, '', 'boom'))
+        with pytest.raises(UnableToPatchDeviceError):
+            device.mute('1', 1)
+        del spy.run
+        spy.pending.clear()
+
+        device.load_biquads('1', False, [1], [], biquads)
+        assert spy.take_commands() == ['input 0 peq 0 set -- 1.0 0.5 0.25 0.1 0.2', 'input 0 peq 0 bypass off']
+
+
+class ProbeCountingSpy(ReadCountingSpy):
+
+    def __init__(self, fail: bool = False):
+        super().__init__()
+        self.probes = 0
+        self.fail = fail
+
+    def __getitem__(self, item):
+        if item == 'probe':
+            self.probes += 1
+            if self.fail:
+                return lambda *args, **kwargs: (_ for _ in ()).throw(ProcessExecutionError([], 1, '', 'boom'))
+            return lambda *args, **kwargs: '0: Found 2x4HD with serial 911111 at ws://localhost/devices/0/ws'
+        return super().__getitem__(item)
+
+
+class TestSerialDiscovery:
+
+    def test_probe_is_cached(self, tmp_path):
+        spy = ProbeCountingSpy()
+        device = make_device(spy, tmp_path)
+        for _ in range(3):
+            assert device.state(refresh=True).serialise()['serials'] == ['911111']
+
+        assert spy.probes == 1
+        assert spy.reads == 4
+
+    def test_probe_is_refreshed_after_interval(self, tmp_path):
+        spy = ProbeCountingSpy()
+        device = make_device(spy, tmp_path, probeInterval=0)
+        for _ in range(3):
+            device.state(refresh=True)
+
+        assert spy.probes == 4
+
+    def test_failed_probe_is_retried_sooner(self, tmp_path, monkeypatch):
+        monkeypatch.setattr('ezbeq.minidsp.FAILED_PROBE_RETRY_SECONDS', 0)
+        spy = ProbeCountingSpy(fail=True)
+        device = make_device(spy, tmp_path)
+        for _ in range(2):
+            device.state(refresh=True)
+        assert spy.probes == 3
+
+        spy.fail = False
+        for _ in range(3):
+            device.state(refresh=True)
+
+        assert spy.probes == 4
+        assert device._Minidsp__serials[0] == ['911111']
@@ -0,0 +1,134 @@
+import json
+import threading
+
+import pytest
+from conftest import CapturingWsServer, MinidspSpy
+from pytest_httpserver import HTTPServer
+from werkzeug import Response
+
+from ezbeq.minidsp import Minidsp, to_rs_configs
+
+STATUS = {
+    'master': {'preset': 2, 'source': 'Usb', 'volume': -12.5, 'mute': False},
+    'input_levels': [-10.0, -11.0],
+    'output_levels': [-20.0, -21.0, -22.0, -23.0]
+}
+DEVICES = [{'url': 'usb:1', 'version': {'hw_id': 10, 'dsp_version': 100, 'serial': 911111}, 'product_name': '2x4HD'}]
+
+
+class TestToRsConfigs:
+
+    def test_master_commands(self):
+        assert to_rs_configs(['mute on', 'gain -- -10.50']) == [
+            {'master_status': {'mute': True, 'volume': -10.5}}
+        ]
+
+    def test_slot_change_starts_new_config(self):
+        assert to_rs_configs(['input 0 mute on', 'config 1', 'input 1 gain -- 2.00']) == [
+            {'inputs': [{'index': 0, 'gate': {'mute': True}, 'peq': []}]},
+            {'master_status': {'preset': 1}, 'inputs': [{'index': 1, 'gate': {'gain': 2.0}, 'peq': []}]},
+        ]
+
+    def test_peq_commands_are_merged(self):
+        assert to_rs_configs([
+            'input 0 peq 3 set -- 1.0 -1.9 0.9 1.9 -0.9',
+            'input 0 peq 3 bypass off',
+            'output 1 peq 0 bypass on',
+        ]) == [{
+            'inputs': [{
+                'index': 0,
+                'peq': [{'index': 3, 'coeff': {'b0': 1.0, 'b1': -1.9, 'b2': 0.9, 'a1': 1.9, 'a2': -0.9}, 'bypass': False}]
+            }],
+            'outputs': [{'index': 1, 'peq': [{'index': 0, 'bypass': True}]}]
+        }]
+
+    @pytest.mark.parametrize('cmd', [
+        'output 0 crossover 0 1 bypass on',
+        'input 0 polarity inverted',
+        'input 0 peq 1 set -- 1.0 0.0',
+    ])
+    def test_unsupported_commands(self, cmd):
+        assert to_rs_configs(['mute on', cmd]) is None
+
+
+@pytest.fixture
+def spy() -> MinidspSpy:
+    return MinidspSpy()
+
+
+@pytest.fixture
+def device(httpserver: HTTPServer, spy: MinidspSpy, tmp_path) -> Minidsp:
+    cfg = {
+        'type': 'minidsp',
+        'exe': 'minidsp',
+        'cmdTimeout': 2,
+        'transport': 'http',
+        'wsIp': f"{httpserver.host}:{httpserver.port}",
+        'make_runner': lambda exe, options: spy
+    }
+    return Minidsp('master', str(tmp_path), cfg, CapturingWsServer(), None)
+
+
+def test_state_is_read_via_http(httpserver: HTTPServer, spy: MinidspSpy, device: Minidsp):
+    httpserver.expect_request('/devices/0').respond_with_json(STATUS)
+    httpserver.expect_request('/devices').respond_with_json(DEVICES)
+
+    state = device.state(refresh=True).serialise()
+
+    assert state['masterVolume'] == -12.5
+    assert state['serials'] == ['911111']
+    assert not spy.history
+
+
+def test_commands_are_posted_via_http(httpserver: HTTPServer, spy: MinidspSpy, device: Minidsp):
+    httpserver.expect_request('/devices/0').respond_with_json(STATUS)
+    httpserver.expect_request('/devices').respond_with_json(DEVICES)
+    httpserver.expect_request('/devices/0/config', method='POST').respond_with_data('')
+
+    device.set_gain('3', 1, -5.0)
+
+    posted = [json.loads(r.data) for r, _ in httpserver.log if r.path == '/devices/0/config']
+    assert posted == [{'inputs': [{'index': 0, 'gate': {'gain': -5.0}, 'peq': []}]}]
+    assert not spy.take_commands()
+
+
+def test_falls_back_to_cli_when_daemon_fails(httpserver: HTTPServer, spy: MinidspSpy, device: Minidsp):
+    httpserver.expect_request('/devices/0').respond_with_response(Response(status=500))
+
+    device.mute(None, None)
+
+    assert spy.take_commands() == ['mute on']
+    assert device.state(refresh=True).mute is True
+    # the transport is not retried immediately after a failure
+    assert [r.path for r, _ in httpserver.log] == ['/devices/0']
+
+
+def test_unsupported_commands_use_cli(httpserver: HTTPServer, spy: MinidspSpy, device: Minidsp):
+    httpserver.expect_request('/devices/0').respond_with_json(STATUS)
+    httpserver.expect_request('/devices').respond_with_json(DEVICES)
+
+    device.send_commands('3', [1], [], ['polarity inverted'])
+
+    assert spy.take_commands() == ['input 0 polarity inverted']
+    assert not [r for r, _ in httpserver.log if r.path == '/devices/0/config']
+
+
+def test_each_thread_has_its_own_session(httpserver: HTTPServer, device: Minidsp):
+    httpserver.expect_request('/devices/0').respond_with_json(STATUS)
+    transport = device._Minidsp__http
+    sessions = {}
+
+    def read(name: str):
+        assert transport.status() == STATUS
+        sessions[name] = transport._MinidspRsHttpTransport__session
+
+    threads = [threading.Thread(target=read, args=(str(i),)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    read('main')
+    read('main again')
+
+    assert len({id(s) for s in sessions.values()}) == 4
+    assert sessions['main'] is sessions['main again']
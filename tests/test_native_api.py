@@ -0,0 +1,143 @@
+import json
+
+import pytest
+from busypie import SECOND, wait
+from twisted.internet import reactor
+from twisted.web.test.requesthelper import DummyRequest
+
+from ezbeq.apis.native import NativeApi, _cache_control_max_age
+
+
+def make_request(path: str, args: dict[str, list[str]] | None = None, headers: dict[str, str] | None = None,
+                 method: bytes = b'GET') -> DummyRequest:
+    request = DummyRequest([s.encode('utf-8') for s in path.strip('/').split('/')])
+    request.method = method
+    request.args = {k.encode('utf-8'): [v.encode('utf-8') for v in vs] for k, vs in (args or {}).items()}
+    for k, v in (headers or {}).items():
+        request.requestHeaders.addRawHeader(k, v)
+    return request
+
+
+def render(app, path: str, **kwargs) -> tuple[int, object]:
+    """
+    Renders path (below /api) via the native api, pumping the reactor until the response is written.
+    """
+    native: NativeApi = app.extensions['native_api']
+    request = make_request(path, **kwargs)
+    resource = native.resource(request)
+    assert resource is not None
+    resource.render(request)
+
+    def finished():
+        # results from the worker pools are handed back via callFromThread
+        reactor.runUntilCurrent()
+        return request.finished
+
+    wait().at_most(5 * SECOND).until(finished)
+    assert request.responseHeaders.getRawHeaders(b'content-type') == [b'application/json']
+    return request.responseCode or 200, json.loads(b''.join(request.written))
+
+
+def test_meta_matches_wsgi(minidsp_client, minidsp_app):
+    code, body = render(minidsp_app, '/1/meta')
+
+    assert code == 200
+    assert body == minidsp_client.get('/api/1/meta').json
+    assert body['count'] == 1
+
+
+@pytest.mark.parametrize('args', [{}, {'text': ['Resur']}, {'authors': ['me']}, {'years': ['1997', '2001']},
+                                  {'tmdbid': ['8078'], 'fields': ['title', 'id']}])
+def test_search_matches_wsgi(minidsp_client, minidsp_app, args):
+    code, body = render(minidsp_app, '/1/search', args=args)
+
+    assert code == 200
+    assert body == minidsp_client.get('/api/1/search', query_string=args).json
+
+
+def test_search_with_invalid_year(minidsp_app):
+    code, _ = render(minidsp_app, '/1/search', args={'years': ['soon']})
+
+    assert code == 400
+
+
+@pytest.mark.parametrize('args,headers', [({}, {}), ({'maxAge': ['0']}, {}), ({}, {'Cache-Control': 'no-cache'})])
+def test_devices_matches_wsgi(minidsp_client, minidsp_app, args, headers):
+    code, body = render(minidsp_app, '/2/devices', args=args, headers=headers)
+
+    assert code == 200
+    expected = minidsp_client.get('/api/2/devices', query_string=args, headers=headers).json
+    assert body.keys() == expected.keys() == {'master'}
+    for v in (body['master'], expected['master']):
+        v.pop('latencyMillis')
+    assert body == expected
+
+
+def test_levels(minidsp_app):
+    code, body = render(minidsp_app, '/1/devices/master/levels')
+
+    assert code == 200
+    assert body['name'] == 'master'
+    assert list(body['levels'].keys()) == ['I0', 'I1', 'O0', 'O1', 'O2', 'O3']
+
+
+def test_levels_for_unknown_device(minidsp_app):
+    code, _ = render(minidsp_app, '/1/devices/nope/levels')
+
+    assert code == 500
+
+
+def test_levels_history(minidsp_app):
+    for _ in range(3):
+        assert render(minidsp_app, '/1/devices/master/levels')[0] == 200
+
+    code, body = render(minidsp_app, '/1/devices/master/levels/history', args={'points': ['2']})
+
+    assert code == 200
+    assert len(body['ts']) == 2
+    assert body['levels']['O0'] == {'min': [-120.0, -120.0], 'max': [-120.0, -120.0], 'mean': [-120.0, -120.0]}
+
+
+def test_levels_history_for_unknown_device(minidsp_app):
+    assert render(minidsp_app, '/1/devices/nope/levels/history')[0] == 404
+
+
+@pytest.mark.parametrize('args', [{'points': ['0']}, {'points': ['-1']}, {'seconds': ['-5']}])
+def test_levels_history_rejects_invalid_args(minidsp_app, args):
+    assert render(minidsp_app, '/1/devices/master/levels/history', args=args)[0] == 400
+
+
+def test_levels_history_for_no_time(minidsp_app):
+    assert render(minidsp_app, '/1/devices/master/levels')[0] == 200
+
+    code, body = render(minidsp_app, '/1/devices/master/levels/history', args={'seconds': ['0']})
+
+    assert code == 200
+    assert body['ts'] == []
+
+
+@pytest.mark.parametrize('path,method', [
+    ('/1/version', b'GET'),
+    ('/2/devices/master', b'GET'),
+    ('/1/devices/master/levels/history/more', b'GET'),
+    ('/2/devices', b'PATCH'),
+    ('/1/search', b'POST'),
+])
+def test_falls_through_to_wsgi(minidsp_app, path, method):
+    native: NativeApi = minidsp_app.extensions['native_api']
+
+    assert native.resource(make_request(path, method=method)) is None
+
+
+@pytest.mark.parametrize('header,expected', [
+    (None, None),
+    ('no-cache', 0.0),
+    ('max-age=5', 5.0),
+    ('private, max-age="2.5"', 2.5),
+    ('max-age=10, no-cache', 0.0),
+    ('max-age=soon', None),
+])
+def test_cache_control_max_age(header, expected):
+    request = make_request('/2/devices', headers={'Cache-Control': header} if header else None)
+
+    assert _cache_control_max_age(request) == expected
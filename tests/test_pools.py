@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+from busypie import SECOND, wait
+from prometheus_client import REGISTRY
+
+from ezbeq.config import THREAD_POOL_SIZES, Config
+from ezbeq.pools import WorkerPool, WorkerPools
+
+
+def sample(name: str, pool: str) -> float:
+    return REGISTRY.get_sample_value(name, {'pool': pool}) or 0
+
+
+class PoolConfig(Config):
+
+    def __init__(self, pools: dict | None):
+        self.__pools = pools
+        super().__init__('pools')
+
+    def load_config(self):
+        return {'devices': {}} if self.__pools is None else {'devices': {}, 'threadPools': self.__pools}
+
+
+def test_thread_pool_sizes_default():
+    assert PoolConfig(None).thread_pool_sizes == THREAD_POOL_SIZES
+
+
+def test_thread_pool_sizes_override():
+    sizes = PoolConfig({'http': 3, 'device-io': 0}).thread_pool_sizes
+
+    assert sizes == THREAD_POOL_SIZES | {'http': 3, 'device-io': 1}
+
+
+@pytest.fixture
+def pool(request):
+    pool = WorkerPool(request.node.name, 1)
+    yield pool
+    pool.stop()
+
+
+def test_reports_queued_and_busy_tasks(pool):
+    release = threading.Event()
+    ran = []
+
+    def task(i):
+        release.wait(5)
+        ran.append(i)
+
+    pool.call_in_thread(task, 1)
+    pool.call_in_thread(task, 2)
+
+    wait().at_most(2 * SECOND).until(lambda: sample('ezbeq_thread_pool_busy', pool.name) == 1)
+    assert sample('ezbeq_thread_pool_queued', pool.name) == 1
+    assert sample('ezbeq_thread_pool_wait_seconds_count', pool.name) == 1
+
+    release.set()
+
+    wait().at_most(2 * SECOND).until(lambda: ran == [1, 2])
+    wait().at_most(2 * SECOND).until(lambda: sample('ezbeq_thread_pool_busy', pool.name) == 0)
+    assert sample('ezbeq_thread_pool_queued', pool.name) == 0
+    assert sample('ezbeq_thread_pool_wait_seconds_count', pool.name) == 2
+
+
+def test_stop_resets_gauges_and_cannot_restart(pool):
+    release = threading.Event()
+    pool.call_in_thread(release.wait, 5)
+    pool.call_in_thread(release.wait, 5)
+    wait().at_most(2 * SECOND).until(lambda: sample('ezbeq_thread_pool_queued', pool.name) == 1)
+
+    threading.Timer(0.1, release.set).start()
+    pool.stop()
+
+    assert sample('ezbeq_thread_pool_queued', pool.name) == 0
+    assert sample('ezbeq_thread_pool_busy', pool.name) == 0
+    with pytest.raises(RuntimeError):
+        pool.call_in_thread(release.wait, 5)
+
+
+def test_joined_pool_does_not_count_tasks(pool):
+    thread_pool = pool.thread_pool
+    pool.stop()
+
+    thread_pool.callInThread(lambda: None)
+
+    assert sample('ezbeq_thread_pool_queued', pool.name) == 0
+
+
+def test_resize(pool):
+    assert sample('ezbeq_thread_pool_max_threads', pool.name) == 1
+    assert pool.thread_pool.max == 1
+
+    pool.resize(3)
+
+    assert pool.max_threads == 3
+    assert pool.thread_pool.max == 3
+    assert sample('ezbeq_thread_pool_max_threads', pool.name) == 3
+
+
+def test_configure_resizes_named_pools():
+    pools = WorkerPools({'test-a': 1, 'test-b': 2})
+
+    pools.configure({'test-a': 4, 'test-b': 2})
+
+    assert [(p.name, p.max_threads) for p in pools] == [('test-a', 4), ('test-b', 2)]
+    with pytest.raises(KeyError):
+        pools.configure({'test-c': 1})
@@ -0,0 +1,60 @@
+import pytest
+
+from ezbeq.catalogue import CatalogueEntry
+from ezbeq.response import FrequencyResponseService, compute_response
+
+
+class _Catalogue:
+
+    def __init__(self, *entries: CatalogueEntry):
+        self.entries = {e.digest: e for e in entries}
+        self.lookups = 0
+
+    def find(self, entry_id: str, match_on_idx: bool | None = None, as_dict: bool = False):
+        self.lookups += 1
+        return self.entries.get(entry_id, None)
+
+
+def _entry(digest: str, filters: list[dict]) -> CatalogueEntry:
+    return CatalogueEntry(digest, {'title': digest, 'digest': digest, 'filters': filters})
+
+
+def test_response_sums_each_filter():
+    peq = {'type': 'PeakingEQ', 'freq': 40.0, 'gain': 6.0, 'q': 1.0}
+    entry = _entry('a', [peq, {**peq, 'count': 2}])
+    response = compute_response(entry, 48000, 40.0, 41.0, 2)
+    assert response['freqs'] == [40.0, 41.0]
+    assert response['magnitude'][0] == pytest.approx(18.0, abs=0.01)
+
+
+def test_response_without_filters_is_flat():
+    assert compute_response(_entry('a', []), 48000, 10.0, 100.0, 3)['magnitude'] == [0.0, 0.0, 0.0]
+
+
+def test_responses_are_cached_by_digest_fs_and_grid():
+    catalogue = _Catalogue(_entry('a', [{'type': 'LowShelf', 'freq': 30.0, 'gain': 5.0, 'q': 0.7}]))
+    service = FrequencyResponseService(catalogue)
+    first = service.response('a')
+    assert service.response('a') is first
+    assert catalogue.lookups == 1
+    service.response('a', fs=96000)
+    service.response('a', points=10)
+    assert catalogue.lookups == 3
+
+
+def test_least_recently_used_response_is_evicted():
+    catalogue = _Catalogue(*[_entry(d, []) for d in 'abc'])
+    service = FrequencyResponseService(catalogue, cache_size=2)
+    service.response('a')
+    service.response('b')
+    service.response('a')
+    service.response('c')
+    assert catalogue.lookups == 3
+    service.response('a')
+    assert catalogue.lookups == 3
+    service.response('b')
+    assert catalogue.lookups == 4
+
+
+def test_unknown_entry():
+    assert FrequencyResponseService(_Catalogue()).response('x') is None
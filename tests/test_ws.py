@@ -0,0 +1,416 @@
+import json
+import threading
+from queue import SimpleQueue
+
+import pytest
+from autobahn.websocket.compress import (
+    PerMessageDeflate,
+    PerMessageDeflateOffer,
+    PerMessageDeflateOfferAccept,
+)
+from autobahn.websocket.protocol import WebSocketProtocol
+from conftest import CapturingWsServer, CapturingWsServerFactory
+from twisted.internet.testing import StringTransport
+
+from ezbeq.apis.ws import (
+    STATE_PATCH_CAPABILITY,
+    AutobahnWsServerFactory,
+    ClientSender,
+    WsProtocol,
+    WsServer,
+    make_json_patch,
+    pack_levels,
+    unpack_levels,
+)
+
+
+class FakeClient:
+
+    def __init__(self, peer: str):
+        self.peer = peer
+        self.state = WebSocketProtocol.STATE_OPEN
+        self.sent: list[dict] = []
+
+    def sendMessage(self, payload: bytes, isBinary: bool = False):
+        self.sent.append({'binary': unpack_levels(payload)} if isBinary else json.loads(payload.decode('utf8')))
+
+    def sendPreparedMessage(self, prepared):
+        if prepared.doNotCompress:
+            frame = prepared.payloadHybi
+            length = frame[1] & 0x7F
+            self.sendMessage(frame[{126: 4, 127: 10}.get(length, 2):], isBinary=frame[0] & 0x0F == 2)
+        else:
+            self.sendMessage(prepared.payload, prepared.binary)
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def dropConnection(self, abort=False):
+        self.state = WebSocketProtocol.STATE_CLOSED
+
+
+class TestMakeJsonPatch:
+
+    def test_identical_values_produce_no_ops(self):
+        assert make_json_patch({'a': [1, {'b': 2}]}, {'a': [1, {'b': 2}]}) == []
+
+    def test_nested_changes(self):
+        old = {'mute': False, 'slots': [{'id': '1', 'gain': 0.0}, {'id': '2', 'gain': 0.0}], 'gone': 1}
+        new = {'mute': True, 'slots': [{'id': '1', 'gain': 0.0}, {'id': '2', 'gain': -1.5}], 'added': 'x'}
+        assert make_json_patch(old, new) == [
+            {'op': 'replace', 'path': '/mute', 'value': True},
+            {'op': 'replace', 'path': '/slots/1/gain', 'value': -1.5},
+            {'op': 'remove', 'path': '/gone'},
+            {'op': 'add', 'path': '/added', 'value': 'x'},
+        ]
+
+    def test_resized_lists_are_replaced(self):
+        assert make_json_patch({'a': [1, 2]}, {'a': [1]}) == [{'op': 'replace', 'path': '/a', 'value': [1]}]
+
+    def test_type_changes_are_replaced(self):
+        assert make_json_patch({'a': 1}, {'a': True}) == [{'op': 'replace', 'path': '/a', 'value': True}]
+
+    def test_keys_are_escaped(self):
+        assert make_json_patch({}, {'a/b~c': 1}) == [{'op': 'add', 'path': '/a~1b~0c', 'value': 1}]
+
+
+def test_identical_states_are_suppressed():
+    ws = CapturingWsServer()
+
+    assert ws.broadcast_state('master', {'name': 'master', 'mute': False}) is True
+    assert ws.broadcast_state('master', {'name': 'master', 'mute': False}) is False
+    assert ws.broadcast_state('other', {'name': 'other', 'mute': False}) is True
+    assert ws.broadcast_state('master', {'name': 'master', 'mute': True}) is True
+
+    msgs = [json.loads(m) for m in ws.take_messages()]
+    assert [(m['message'], m['data']['name'], m['data']['mute']) for m in msgs] == [
+        ('DeviceState', 'master', False),
+        ('DeviceState', 'other', False),
+        ('DeviceState', 'master', True),
+    ]
+
+
+class BlockingStateFactory(CapturingWsServerFactory):
+    """
+    Records each state broadcast along with its patch, holding the next one until released once block is set.
+    """
+
+    def __init__(self):
+        super().__init__(SimpleQueue())
+        self.sent = []
+        self.block = False
+        self.sending = threading.Event()
+        self.release = threading.Event()
+
+    def broadcast_state(self, device: str, msg: str, patch):
+        if self.block and not self.sending.is_set():
+            self.sending.set()
+            self.release.wait(5)
+        self.sent.append((json.loads(msg)['data']['mute'], json.loads(patch() or 'null')))
+
+
+def test_interleaved_state_broadcasts_are_sent_in_order():
+    factory = BlockingStateFactory()
+    ws = WsServer(factory)
+    ws.broadcast_state('master', {'name': 'master', 'mute': False})
+    factory.sent.clear()
+    factory.block = True
+
+    first = threading.Thread(target=ws.broadcast_state, args=('master', {'name': 'master', 'mute': True}))
+    second = threading.Thread(target=ws.broadcast_state, args=('master', {'name': 'master', 'mute': False}))
+    first.start()
+    assert factory.sending.wait(5)
+    second.start()
+    second.join(0.2)
+    factory.release.set()
+    first.join(5)
+    second.join(5)
+
+    assert [(mute, p['data']['patch']) for mute, p in factory.sent] == [
+        (True, [{'op': 'replace', 'path': '/mute', 'value': True}]),
+        (False, [{'op': 'replace', 'path': '/mute', 'value': False}]),
+    ]
+
+
+def test_patch_clients_receive_deltas_after_a_full_state():
+    factory = AutobahnWsServerFactory()
+    legacy = FakeClient('legacy')
+    patching = FakeClient('patching')
+    factory.register(legacy)
+    factory.register(patching)
+    factory.set_capabilities(patching, [STATE_PATCH_CAPABILITY])
+    patches = []
+
+    def patch():
+        patches.append(1)
+        return json.dumps({'message': 'DeviceStatePatch', 'data': {'name': 'master', 'patch': []}})
+
+    factory.broadcast_state('master', json.dumps({'message': 'DeviceState', 'data': {}}), patch)
+    factory.broadcast_state('master', json.dumps({'message': 'DeviceState', 'data': {}}), patch)
+
+    assert [m['message'] for m in legacy.sent] == ['DeviceState', 'DeviceState']
+    assert [m['message'] for m in patching.sent] == ['DeviceState', 'DeviceStatePatch']
+    assert len(patches) == 1
+
+    factory.set_capabilities(patching, [])
+    factory.broadcast_state('master', json.dumps({'message': 'DeviceState', 'data': {}}), patch)
+    assert patching.sent[-1]['message'] == 'DeviceState'
+    assert len(patches) == 1
+
+
+def test_broadcast_is_framed_once_for_all_clients():
+    factory = AutobahnWsServerFactory()
+    clients = [FakeClient(str(i)) for i in range(3)]
+    for c in clients:
+        factory.register(c)
+    prepared = []
+    prepare = factory.prepareMessage
+    factory.prepareMessage = lambda *args, **kwargs: prepared.append(args) or prepare(*args, **kwargs)
+
+    factory.broadcast(json.dumps({'message': 'Hello'}))
+
+    assert len(prepared) == 1
+    assert all(c.sent == [{'message': 'Hello'}] for c in clients)
+
+
+def test_closed_clients_are_discarded():
+    factory = AutobahnWsServerFactory()
+    open_client = FakeClient('open')
+    closed_client = FakeClient('closed')
+    closed_client.state = WebSocketProtocol.STATE_CLOSED
+    factory.register(open_client)
+    factory.register(closed_client)
+
+    factory.broadcast(json.dumps({'message': 'Hello'}))
+    factory.broadcast(json.dumps({'message': 'Again'}))
+
+    assert open_client.sent == [{'message': 'Hello'}, {'message': 'Again'}]
+    assert closed_client.sent == []
+
+
+def prepared(factory: AutobahnWsServerFactory, msg: str):
+    return factory.prepareMessage(json.dumps({'message': msg}).encode('utf8'))
+
+
+class TestClientSender:
+
+    def test_messages_are_held_while_paused(self):
+        factory = AutobahnWsServerFactory()
+        client = FakeClient('slow')
+        sender = ClientSender(client)
+
+        sender.pauseProducing()
+        assert sender.send(prepared(factory, 'a'))
+        assert sender.send(prepared(factory, 'b'))
+        assert client.sent == []
+        assert sender.queued == 2
+
+        sender.resumeProducing()
+        assert client.sent == [{'message': 'a'}, {'message': 'b'}]
+        assert sender.queued == 0
+
+    def test_levels_are_latest_wins(self):
+        factory = AutobahnWsServerFactory()
+        client = FakeClient('slow')
+        sender = ClientSender(client)
+
+        sender.pauseProducing()
+        for i in range(5):
+            sender.send_levels('master', prepared(factory, f'master{i}'))
+        sender.send_levels('other', prepared(factory, 'other0'))
+        sender.send(prepared(factory, 'state'))
+        sender.resumeProducing()
+
+        assert client.sent == [{'message': 'state'}, {'message': 'master4'}, {'message': 'other0'}]
+
+    def test_overflow_is_reported(self):
+        factory = AutobahnWsServerFactory()
+        sender = ClientSender(FakeClient('slow'), max_queued=2)
+
+        sender.pauseProducing()
+        assert sender.send(prepared(factory, 'a'))
+        assert sender.send(prepared(factory, 'b'))
+        assert not sender.send(prepared(factory, 'c'))
+
+    def test_waits_until_drained(self):
+        factory = AutobahnWsServerFactory()
+        sender = ClientSender(FakeClient('slow'))
+        fired = []
+
+        sender.when_writable().addCallback(fired.append)
+        assert fired == [None]
+
+        sender.pauseProducing()
+        sender.send(prepared(factory, 'a'))
+        sender.when_writable().addCallback(fired.append)
+        assert fired == [None]
+        sender.resumeProducing()
+        assert fired == [None, None]
+
+
+def test_lagging_client_is_dropped():
+    factory = AutobahnWsServerFactory()
+    slow = FakeClient('slow')
+    factory.register(slow)
+    slow.producer.pauseProducing()
+
+    for i in range(300):
+        factory.broadcast(json.dumps({'message': str(i)}))
+
+    assert slow.state == WebSocketProtocol.STATE_CLOSED
+    assert slow.sent == []
+
+
+def test_catalogue_waits_for_slow_client():
+    factory = AutobahnWsServerFactory()
+    client = FakeClient('slow')
+    factory.register(client)
+    results = []
+
+    def loader(publish):
+        results.append(publish(json.dumps({'message': 'chunk0'})))
+
+    factory.init_catalogue_loader(loader)
+    factory.send_catalogue(client)
+    assert results[0].called
+
+    client.producer.pauseProducing()
+    factory.send_catalogue(client)
+    assert not results[1].called
+    client.producer.resumeProducing()
+    assert results[1].called
+    assert client.sent == [{'message': 'chunk0'}, {'message': 'chunk0'}]
+
+
+class TestCompression:
+
+    @staticmethod
+    def open_client(factory: AutobahnWsServerFactory, accept: PerMessageDeflateOfferAccept) -> WebSocketProtocol:
+        client = factory.buildProtocol(None)
+        client.makeConnection(StringTransport())
+        client.state = WebSocketProtocol.STATE_OPEN
+        client.websocket_version = 13
+        client._perMessageCompress = PerMessageDeflate.create_from_offer_accept(True, accept)
+        return client
+
+    def test_offer_is_accepted_with_mem_level(self):
+        factory = AutobahnWsServerFactory()
+        factory.enable_compression(1024, 4)
+
+        accept = factory.perMessageCompressionAccept([PerMessageDeflateOffer()])
+
+        assert isinstance(accept, PerMessageDeflateOfferAccept)
+        assert accept.mem_level == 4
+
+    def test_offer_is_declined_when_disabled(self):
+        factory = AutobahnWsServerFactory()
+        assert factory.perMessageCompressionAccept([PerMessageDeflateOffer()]) is None
+
+    def test_small_messages_are_not_compressed(self):
+        factory = AutobahnWsServerFactory()
+        factory.enable_compression(1024, 8)
+        client = self.open_client(factory, factory.perMessageCompressionAccept([PerMessageDeflateOffer()]))
+        factory.register(client)
+
+        small = json.dumps({'message': 'Small'})
+        factory.broadcast(small)
+        frame = client.transport.value()
+        # RSV1 marks a compressed message
+        assert frame[0] == 0x81
+        assert frame.endswith(small.encode('utf8'))
+        client.transport.clear()
+
+        large = json.dumps({'message': 'Large', 'data': ['abcdefgh'] * 1000})
+        factory.broadcast(large)
+        frame = client.transport.value()
+        assert frame[0] == 0xC1
+        assert len(frame) < len(large) / 10
+
+
+class TestLevelsFrame:
+
+    def test_minidsp_levels_round_trip(self):
+        levels = {'name': 'master', 'ts': 1700000000.25,
+                  'levels': {'I0': -10.5, 'I1': -11.0, 'O0': -20.0, 'O1': -21.5, 'O2': -22.0, 'O3': -120.0}}
+
+        frame = pack_levels(levels)
+
+        assert len(frame) == 2 + 6 + 9 + (1 + 1 + 2 + 8) + (1 + 1 + 2 + 16)
+        assert unpack_levels(frame) == levels
+
+    def test_camilladsp_levels_round_trip(self):
+        levels = {'name': 'cdsp', 'ts': 1.5, 'levels': {'RMS-0': -3.0, 'RMS-1': -4.0, 'Peak-0': -1.0, 'Peak-1': -2.0}}
+        assert unpack_levels(pack_levels(levels)) == levels
+
+    @pytest.mark.parametrize('levels', [
+        {},
+        {'name': 'x', 'ts': 1.0, 'levels': {'L': -10.0}},
+        {'name': 'x', 'ts': 1.0, 'levels': {'I1': -10.0}},
+        {'name': 'x', 'ts': 1.0, 'levels': {'I0': 'loud'}},
+    ])
+    def test_unpackable_levels(self, levels):
+        assert pack_levels(levels) is None
+
+
+class LevelsWsServer(WsServer[AutobahnWsServerFactory]):
+
+    def __init__(self):
+        super().__init__(AutobahnWsServerFactory())
+
+
+def subscribe(factory: AutobahnWsServerFactory, client: FakeClient, cmd: str):
+    client.factory = factory
+    WsProtocol.onMessage(client, cmd.encode('utf-8'), False)
+
+
+def test_levels_are_sent_in_the_subscribed_form():
+    ws = LevelsWsServer()
+    ws.factory.set_levels_provider('master', lambda: None)
+    text = FakeClient('text')
+    binary = FakeClient('binary')
+    for c in (text, binary):
+        ws.factory.register(c)
+    subscribe(ws.factory, text, 'subscribe levels master')
+    subscribe(ws.factory, binary, 'subscribe levels master binary')
+    levels = {'name': 'master', 'ts': 1.0, 'levels': {'I0': -10.0, 'O0': -20.0}}
+
+    assert ws.levels('master', levels)
+    assert ws.levels('master', {})
+
+    assert text.sent == [{'message': 'Levels', 'data': levels}, {'message': 'Levels', 'data': {}}]
+    assert binary.sent == [{'binary': levels}, {'message': 'Levels', 'data': {}}]
+
+
+def test_levels_fps_follows_the_fastest_subscriber():
+    ws = LevelsWsServer()
+    ws.factory.set_levels_provider('my device', lambda: None)
+    slow = FakeClient('slow')
+    fast = FakeClient('fast')
+    for c in (slow, fast):
+        ws.factory.register(c)
+
+    assert ws.levels_fps('my device') is None
+    subscribe(ws.factory, slow, 'subscribe levels my device fps=2')
+    assert ws.levels_fps('my device') == 2
+    subscribe(ws.factory, fast, 'subscribe levels my device binary fps=5')
+    assert ws.levels_fps('my device') == 5
+    ws.factory.unregister(fast)
+    assert ws.levels_fps('my device') == 2
+    ws.factory.unregister(slow)
+    assert ws.levels_fps('my device') is None
+
+
+def test_new_subscribers_receive_the_latest_levels():
+    ws = LevelsWsServer()
+    ws.factory.set_levels_provider('master', lambda: None)
+    first = FakeClient('first')
+    ws.factory.register(first)
+    subscribe(ws.factory, first, 'subscribe levels master')
+    levels = {'name': 'master', 'ts': 1.0, 'levels': {'I0': -10.0}}
+    ws.levels('master', levels)
+
+    late = FakeClient('late')
+    ws.factory.register(late)
+    subscribe(ws.factory, late, 'subscribe levels master binary')
+
+    assert late.sent == [{'binary': levels}]